@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from collections import deque
+from auth_backend import metrics
+
+
+logger = logging.getLogger("auth_backend")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULT_SETTINGS = {
+    "failure_rate": 0.5,
+    "slow_call_ms": 2000,
+    "min_calls": 10,
+    "window_size": 50,
+    "open_seconds": 30,
+    "half_open_calls": 1
+}
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name, **settings):
+        self.name = name
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.state = CLOSED
+        self.opened_at = None
+        self.probes = 0
+        self.rejected = 0
+        # (failed or too slow, seconds) of the most recent calls
+        self._outcomes = deque(maxlen=self.settings["window_size"])
+        self._lock = threading.Lock()
+        self.configure(**settings)
+
+    def configure(self, **settings):
+        with self._lock:
+            self.settings.update((k, v) for k, v in settings.items()
+                                 if v is not None)
+            window_size = int(self.settings["window_size"])
+            if window_size != self._outcomes.maxlen:
+                self._outcomes = deque(self._outcomes, maxlen=window_size)
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN and self.cooled_down():
+                self.transition(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and \
+                    self.probes < self.settings["half_open_calls"]:
+                self.probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def cooled_down(self):
+        return time.time() - self.opened_at >= self.settings["open_seconds"]
+
+    def record(self, failed, seconds):
+        bad = failed or 1000 * seconds >= self.settings["slow_call_ms"]
+        with self._lock:
+            if self.state == HALF_OPEN:
+                # A single probe decides whether the endpoint has recovered
+                self.probes = max(0, self.probes - 1)
+                self._outcomes.clear()
+                self.transition(OPEN if bad else CLOSED)
+            self._outcomes.append((bad, seconds))
+            if self.state == CLOSED and self.failing():
+                self.transition(OPEN)
+
+    def failing(self):
+        calls = len(self._outcomes)
+        if calls < self.settings["min_calls"]:
+            return False
+        failures = sum(1 for bad, _ in self._outcomes if bad)
+        return failures >= self.settings["failure_rate"] * calls
+
+    def transition(self, state):
+        if state == OPEN:
+            self.opened_at = time.time()
+            logger.warning("Circuit breaker for %s opened", self.name)
+        self.state = state
+        metrics.incr("breaker.%s.%s" % (self.name, state))
+
+    def is_open(self):
+        return self.state != CLOSED
+
+    def percentile(self, pct):
+        with self._lock:
+            durations = sorted(seconds for bad, seconds in self._outcomes
+                               if not bad)
+        if len(durations) < self.settings["min_calls"]:
+            return None
+        return durations[int(round(pct / 100.0 * (len(durations) - 1)))]
+
+    def stats(self):
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = sum(1 for bad, _ in self._outcomes if bad)
+            return {
+                "state": self.state,
+                "calls": calls,
+                "failures": failures,
+                "rejected": self.rejected
+            }
+
+
+# Breakers are shared by every request in a warm container, one per
+# upstream endpoint
+_breakers = {}
+_settings = {}
+_lock = threading.Lock()
+
+
+def configure(**settings):
+    with _lock:
+        _settings.update((k, v) for k, v in settings.items()
+                         if v is not None)
+        breakers = list(_breakers.values())
+    for circuit in breakers:
+        circuit.configure(**_settings)
+
+
+def get(name):
+    circuit = _breakers.get(name)
+    if circuit is not None:
+        return circuit
+    with _lock:
+        circuit = _breakers.get(name)
+        if circuit is None:
+            circuit = _breakers[name] = CircuitBreaker(name, **_settings)
+    return circuit
+
+
+def stats():
+    with _lock:
+        breakers = list(_breakers.values())
+    return dict((circuit.name, circuit.stats()) for circuit in breakers)
+
+
+metrics.register_source("circuit_breakers", stats)
+
+
+def reset():
+    with _lock:
+        _breakers.clear()
+        _settings.clear()
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheBackend(object):
+
+    def configure(self, maxsize=None, ttl=None):
+        pass
+
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def entry(self, key):
+        return None
+
+
+class TTLCache(CacheBackend):
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize=None, ttl=None):
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = int(maxsize)
+                self._evict()
+            if ttl is not None:
+                self.ttl = float(ttl)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.time():
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else float(ttl))
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires_at, value)
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def entry(self, key):
+        # (expires_at, value) without counting a hit or refreshing recency
+        with self._lock:
+            return self._data.get(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.expirations = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TieredCache(CacheBackend):
+
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+
+    def configure(self, maxsize=None, ttl=None):
+        self.local.configure(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key, default=None):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        value = self.shared.get(key)
+        if value is None:
+            return default
+        self.local.set(key, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.shared.set(key, value, ttl=ttl)
+        self.local.set(key, value, ttl=ttl)
+
+    def delete(self, key):
+        self.shared.delete(key)
+        self.local.delete(key)
+
+    def entry(self, key):
+        return self.local.entry(key)
+
+    def stats(self):
+        return self.local.stats()
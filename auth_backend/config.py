@@ -0,0 +1,349 @@
+import json
+import threading
+from auth_backend import datastore
+from auth_backend import records
+from auth_backend import revocation
+from auth_backend import tokens
+
+
+DEFAULT_JWT_EXPIRY_MINUTES = 10
+DEFAULT_JWT_SIGNING_ALGORITHM = "HS256"
+DEFAULT_VALIDATION_NEGATIVE_TTL = 10
+DEFAULT_PERSIST_MODE = "sync"
+DEFAULT_PERSIST_TIMEOUT = 5
+DEFAULT_REFRESH_BATCH_MAX_SIZE = 100
+DEFAULT_JWKS_MAX_AGE = 3600
+DEFAULT_GITHUB_URL = "https://github.com"
+DEFAULT_GITHUB_API_URL = "https://api.github.com"
+DEFAULT_COALESCE_TIMEOUT = 10
+DEFAULT_RATE_LIMIT_BURST = 10
+DEFAULT_RATE_LIMIT_BACKEND = "memory"
+DEFAULT_DEGRADED_VALIDATION_TTL = 3600
+DEFAULT_BEARER_TOKEN_RECORD = "plain"
+DEFAULT_GITHUB_TOKEN_MODE = "embed"
+PERSIST_MODES = ("sync", "concurrent", "deferred", "buffered")
+RATE_LIMIT_BACKENDS = ("memory", "dynamodb")
+BEARER_TOKEN_RECORDS = ("plain", "compact")
+GITHUB_TOKEN_MODES = ("embed", "reference")
+SIGNING_ALGORITHMS = ("HS256",) + tokens.ASYMMETRIC_ALGORITHMS
+MAX_CACHED_CONFIGS = 16
+
+# Everything in an event except the per-request payload and path
+FIELDS = (
+    "jwt_signing_secret",
+    "jwt_signing_keys",
+    "jwt_active_kid",
+    "jwt_signing_algorithm",
+    "jwt_expiry_minutes",
+    "jwt_jwks_max_age",
+    "jwt_github_token_mode",
+    "oauth_client_id",
+    "oauth_client_secret",
+    "auth_desired_oauth_scopes",
+    "auth_dynamodb_endpoint_url",
+    "auth_dynamodb_table_name",
+    "auth_bearer_token_record",
+    "auth_bearer_token_keys",
+    "auth_dynamodb_max_pool_connections",
+    "auth_dynamodb_connect_timeout",
+    "auth_dynamodb_read_timeout",
+    "auth_persist_mode",
+    "auth_persist_timeout",
+    "auth_persist_workers",
+    "auth_validation_workers",
+    "auth_write_buffer_max_items",
+    "auth_write_buffer_max_age",
+    "auth_refresh_batch_max_size",
+    "auth_coalesce_timeout",
+    "auth_revalidation_window",
+    "auth_revocation_table_name",
+    "auth_revocation_sync_interval",
+    "auth_rate_limit",
+    "auth_rate_limit_burst",
+    "auth_rate_limit_backend",
+    "auth_rate_limit_table_name",
+    "auth_rejected_code_cache_size",
+    "auth_rejected_code_ttl",
+    "github_url",
+    "github_api_url",
+    "github_pool_size",
+    "github_max_retries",
+    "github_backoff_factor",
+    "github_connect_timeout",
+    "github_read_timeout",
+    "github_hedge_percentile",
+    "github_breaker_failure_rate",
+    "github_breaker_slow_call_ms",
+    "github_breaker_min_calls",
+    "github_breaker_open_seconds",
+    "github_degraded_validation_ttl",
+    "github_validation_cache_size",
+    "github_validation_cache_ttl",
+    "github_validation_negative_ttl",
+    "bearer_token_cache_size",
+    "bearer_token_cache_ttl"
+)
+
+
+class ConfigurationError(ValueError):
+    pass
+
+
+def parse(event, name, convert, default=None):
+    value = event.get(name)
+    if value is None:
+        return default
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        raise ConfigurationError("Invalid value for %s: %r" % (name, value))
+
+
+class Config(object):
+
+    def __init__(self, event):
+        self.jwt_signing_secret = event.get("jwt_signing_secret")
+        self.jwt_signing_keys = parse(event, "jwt_signing_keys", parse_keys)
+        self.jwt_active_kid = event.get("jwt_active_kid")
+        self.jwt_signing_algorithm = event.get(
+            "jwt_signing_algorithm") or DEFAULT_JWT_SIGNING_ALGORITHM
+        self.jwt_expiry_minutes = parse(event, "jwt_expiry_minutes", int,
+                                        DEFAULT_JWT_EXPIRY_MINUTES)
+        self.jwt_jwks_max_age = parse(event, "jwt_jwks_max_age", int,
+                                      DEFAULT_JWKS_MAX_AGE)
+        self.jwt_github_token_mode = event.get(
+            "jwt_github_token_mode") or DEFAULT_GITHUB_TOKEN_MODE
+        self.oauth_client_id = event.get("oauth_client_id")
+        self.oauth_client_secret = event.get("oauth_client_secret")
+        self.auth_desired_oauth_scopes = event.get(
+            "auth_desired_oauth_scopes") or ""
+        self.desired_scopes = frozenset(
+            self.auth_desired_oauth_scopes.split(','))
+        self.auth_dynamodb_endpoint_url = event.get(
+            "auth_dynamodb_endpoint_url")
+        self.auth_dynamodb_table_name = event.get("auth_dynamodb_table_name")
+        self.auth_bearer_token_record = event.get(
+            "auth_bearer_token_record") or DEFAULT_BEARER_TOKEN_RECORD
+        self.auth_bearer_token_keys = [
+            key.strip() for key in
+            (event.get("auth_bearer_token_keys") or "").split(',')
+            if key.strip()
+        ]
+        self.datastore_options = {
+            "max_pool_connections": parse(
+                event, "auth_dynamodb_max_pool_connections", int),
+            "connect_timeout": parse(
+                event, "auth_dynamodb_connect_timeout", float),
+            "read_timeout": parse(event, "auth_dynamodb_read_timeout", float)
+        }
+        self.auth_persist_mode = event.get("auth_persist_mode") or \
+            DEFAULT_PERSIST_MODE
+        self.auth_persist_timeout = parse(event, "auth_persist_timeout",
+                                          float, DEFAULT_PERSIST_TIMEOUT)
+        self.worker_settings = {
+            "persist": parse(event, "auth_persist_workers", int),
+            "validate": parse(event, "auth_validation_workers", int)
+        }
+        self.auth_write_buffer_max_items = parse(
+            event, "auth_write_buffer_max_items", int,
+            datastore.BATCH_WRITE_LIMIT)
+        self.auth_write_buffer_max_age = parse(
+            event, "auth_write_buffer_max_age", float,
+            datastore.DEFAULT_BUFFER_MAX_AGE)
+        self.auth_refresh_batch_max_size = parse(
+            event, "auth_refresh_batch_max_size", int,
+            DEFAULT_REFRESH_BATCH_MAX_SIZE)
+        self.auth_coalesce_timeout = parse(event, "auth_coalesce_timeout",
+                                           float, DEFAULT_COALESCE_TIMEOUT)
+        self.auth_revalidation_window = parse(
+            event, "auth_revalidation_window", float, 0)
+        self.auth_revocation_table_name = event.get(
+            "auth_revocation_table_name")
+        self.auth_revocation_sync_interval = parse(
+            event, "auth_revocation_sync_interval", float,
+            revocation.DEFAULT_SYNC_INTERVAL)
+        self.auth_rate_limit = parse(event, "auth_rate_limit", float)
+        self.auth_rate_limit_burst = parse(event, "auth_rate_limit_burst",
+                                           int, DEFAULT_RATE_LIMIT_BURST)
+        self.auth_rate_limit_backend = event.get(
+            "auth_rate_limit_backend") or DEFAULT_RATE_LIMIT_BACKEND
+        self.auth_rate_limit_table_name = event.get(
+            "auth_rate_limit_table_name")
+        self.rejected_code_cache_settings = {
+            "maxsize": parse(event, "auth_rejected_code_cache_size", int),
+            "ttl": parse(event, "auth_rejected_code_ttl", float)
+        }
+        self.github_url = event.get("github_url") or DEFAULT_GITHUB_URL
+        self.github_api_url = event.get("github_api_url") or \
+            DEFAULT_GITHUB_API_URL
+        self.github_settings = {
+            "pool_size": parse(event, "github_pool_size", int),
+            "max_retries": parse(event, "github_max_retries", int),
+            "backoff_factor": parse(event, "github_backoff_factor", float),
+            "connect_timeout": parse(event, "github_connect_timeout", float),
+            "read_timeout": parse(event, "github_read_timeout", float),
+            "hedge_percentile": parse(event, "github_hedge_percentile", float)
+        }
+        self.github_breaker_settings = {
+            "failure_rate": parse(event, "github_breaker_failure_rate",
+                                  float),
+            "slow_call_ms": parse(event, "github_breaker_slow_call_ms",
+                                  float),
+            "min_calls": parse(event, "github_breaker_min_calls", int),
+            "open_seconds": parse(event, "github_breaker_open_seconds", float)
+        }
+        self.degraded_validation_cache_settings = {
+            "ttl": parse(event, "github_degraded_validation_ttl", float,
+                         DEFAULT_DEGRADED_VALIDATION_TTL)
+        }
+        self.validation_cache_settings = {
+            "maxsize": parse(event, "github_validation_cache_size", int),
+            "ttl": parse(event, "github_validation_cache_ttl", float)
+        }
+        self.github_validation_negative_ttl = parse(
+            event, "github_validation_negative_ttl", float,
+            DEFAULT_VALIDATION_NEGATIVE_TTL)
+        self.bearer_token_cache_settings = {
+            "maxsize": parse(event, "bearer_token_cache_size", int),
+            "ttl": parse(event, "bearer_token_cache_ttl", float)
+        }
+        self.validate()
+        self._keyring = None
+        self._record_codec = None
+
+    def validate(self):
+        if self.jwt_expiry_minutes <= 0:
+            raise ConfigurationError("jwt_expiry_minutes must be positive")
+        if self.auth_persist_mode not in PERSIST_MODES:
+            raise ConfigurationError("Unknown auth_persist_mode: %s"
+                                     % self.auth_persist_mode)
+        if any(size is not None and size < 1
+               for size in self.worker_settings.values()):
+            raise ConfigurationError("auth_persist_workers and "
+                                     "auth_validation_workers must be "
+                                     "positive")
+        self.validate_signing()
+        self.validate_rate_limit()
+        self.validate_github()
+        self.validate_bearer_token_storage()
+
+    def validate_signing(self):
+        if self.jwt_signing_algorithm not in SIGNING_ALGORITHMS:
+            raise ConfigurationError("Unsupported jwt_signing_algorithm: %s"
+                                     % self.jwt_signing_algorithm)
+        if self.jwt_signing_algorithm in tokens.ASYMMETRIC_ALGORITHMS and \
+                not (self.jwt_signing_keys and self.jwt_active_kid):
+            raise ConfigurationError("jwt_signing_algorithm %s needs "
+                                     "jwt_signing_keys and jwt_active_kid"
+                                     % self.jwt_signing_algorithm)
+
+    def validate_bearer_token_storage(self):
+        if self.auth_bearer_token_record not in BEARER_TOKEN_RECORDS:
+            raise ConfigurationError("Unknown auth_bearer_token_record: %s"
+                                     % self.auth_bearer_token_record)
+        if self.auth_bearer_token_keys and \
+                self.auth_bearer_token_record != "compact":
+            raise ConfigurationError("auth_bearer_token_keys needs the "
+                                     "compact auth_bearer_token_record")
+        if self.jwt_github_token_mode not in GITHUB_TOKEN_MODES:
+            raise ConfigurationError("Unknown jwt_github_token_mode: %s"
+                                     % self.jwt_github_token_mode)
+
+    def validate_github(self):
+        failure_rate = self.github_breaker_settings["failure_rate"]
+        if failure_rate is not None and not 0 < failure_rate <= 1:
+            raise ConfigurationError("github_breaker_failure_rate must be "
+                                     "between 0 and 1")
+        percentile = self.github_settings["hedge_percentile"]
+        if percentile is not None and not 0 < percentile < 100:
+            raise ConfigurationError("github_hedge_percentile must be "
+                                     "between 0 and 100")
+
+    def validate_rate_limit(self):
+        if self.auth_rate_limit is None:
+            return
+        if self.auth_rate_limit <= 0 or self.auth_rate_limit_burst < 1:
+            raise ConfigurationError("auth_rate_limit and "
+                                     "auth_rate_limit_burst must be positive")
+        if self.auth_rate_limit_backend not in RATE_LIMIT_BACKENDS:
+            raise ConfigurationError("Unknown auth_rate_limit_backend: %s"
+                                     % self.auth_rate_limit_backend)
+        if self.auth_rate_limit_backend == "dynamodb" and \
+                not self.auth_rate_limit_table_name:
+            raise ConfigurationError("auth_rate_limit_table_name is needed "
+                                     "for the dynamodb rate limit backend")
+
+    @property
+    def keyring(self):
+        # Built on first use so that keys are only loaded by requests that
+        # sign or verify tokens
+        if self._keyring is None:
+            try:
+                self._keyring = tokens.get_keyring(self.jwt_signing_keys,
+                                                   self.jwt_active_kid,
+                                                   self.jwt_signing_secret,
+                                                   self.jwt_signing_algorithm)
+            except (ValueError, TypeError) as e:
+                raise ConfigurationError(str(e))
+            except ImportError:
+                raise ConfigurationError("%s signing keys need the "
+                                         "cryptography package"
+                                         % self.jwt_signing_algorithm)
+        return self._keyring
+
+    @property
+    def record_codec(self):
+        if self._record_codec is None:
+            try:
+                self._record_codec = records.RecordCodec(
+                    self.auth_bearer_token_keys)
+            except (ValueError, TypeError) as e:
+                raise ConfigurationError("Invalid auth_bearer_token_keys: %s"
+                                         % e)
+            except ImportError:
+                raise ConfigurationError("auth_bearer_token_keys needs the "
+                                         "cryptography package")
+        return self._record_codec
+
+
+def parse_keys(keys):
+    if isinstance(keys, dict):
+        return keys
+    keys = json.loads(keys)
+    if not isinstance(keys, dict):
+        raise ValueError("Signing keys must be a JSON object")
+    return keys
+
+
+def hashable(value):
+    if isinstance(value, dict):
+        return tuple(sorted(value.items()))
+    return value
+
+
+# A warm container sees the same configuration on every invocation, so it is
+# parsed once and looked up by the raw values afterwards.
+_configs = {}
+_lock = threading.Lock()
+
+
+def get_config(event):
+    cache_key = tuple(map(event.get, FIELDS))
+    try:
+        config = _configs.get(cache_key)
+    except TypeError:
+        # Signing keys can be given as a dict rather than as JSON
+        cache_key = tuple(hashable(value) for value in cache_key)
+        config = _configs.get(cache_key)
+    if config is None:
+        config = Config(event)
+        with _lock:
+            if len(_configs) >= MAX_CACHED_CONFIGS:
+                _configs.clear()
+            config = _configs.setdefault(cache_key, config)
+    return config
+
+
+def reset():
+    with _lock:
+        _configs.clear()
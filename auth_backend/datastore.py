@@ -0,0 +1,252 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from auth_backend import metrics
+
+
+logger = logging.getLogger("auth_backend")
+
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+DEFAULT_CONNECT_TIMEOUT = 2
+DEFAULT_READ_TIMEOUT = 5
+DEFAULT_BATCH_ATTEMPTS = 5
+DEFAULT_BATCH_BACKOFF = 0.05
+DEFAULT_BUFFER_MAX_AGE = 1.0
+BATCH_GET_LIMIT = 100
+BATCH_WRITE_LIMIT = 25
+
+# Resources and Table handles survive across invocations of a warm container,
+# so only the first request pays for the session, credential resolution and
+# the TCP/TLS handshakes to DynamoDB.
+_resources = {}
+_tables = {}
+_write_buffers = {}
+_lock = threading.Lock()
+_flusher = None
+
+
+def errors():
+    # boto3 is imported on first use: it is the slowest part of a cold start
+    # and health checks never touch DynamoDB
+    import boto3.exceptions
+    import botocore.exceptions
+    return (boto3.exceptions.Boto3Error,
+            botocore.exceptions.BotoCoreError,
+            botocore.exceptions.ClientError)
+
+
+def error_code(error):
+    return getattr(error, "response", {}).get("Error", {}).get("Code")
+
+
+def get_resource(endpoint_url,
+                 max_pool_connections=None,
+                 connect_timeout=None,
+                 read_timeout=None):
+    resource = _resources.get(endpoint_url)
+    if resource is not None:
+        return resource
+    with _lock:
+        resource = _resources.get(endpoint_url)
+        if resource is None:
+            import boto3
+            import botocore.config
+            config = botocore.config.Config(
+                max_pool_connections=int(max_pool_connections or DEFAULT_MAX_POOL_CONNECTIONS),  # NOQA
+                connect_timeout=float(connect_timeout or DEFAULT_CONNECT_TIMEOUT),  # NOQA
+                read_timeout=float(read_timeout or DEFAULT_READ_TIMEOUT)
+            )
+            logger.debug("Creating DynamoDB resource for %s", endpoint_url)
+            resource = boto3.resource('dynamodb',
+                                      endpoint_url=endpoint_url,
+                                      config=config)
+            _resources[endpoint_url] = resource
+    return resource
+
+
+def get_table(endpoint_url, table_name, **resource_options):
+    key = (endpoint_url, table_name)
+    table = _tables.get(key)
+    if table is not None:
+        return table
+    resource = get_resource(endpoint_url, **resource_options)
+    with _lock:
+        table = _tables.get(key)
+        if table is None:
+            table = resource.Table(table_name)
+            _tables[key] = table
+    return table
+
+
+def reset():
+    global _flusher
+    with _lock:
+        _resources.clear()
+        _tables.clear()
+        _write_buffers.clear()
+        if _flusher is not None:
+            _flusher.set()
+            _flusher = None
+
+
+def batch_get_items(endpoint_url, table_name, keys,
+                    max_attempts=DEFAULT_BATCH_ATTEMPTS,
+                    backoff=DEFAULT_BATCH_BACKOFF,
+                    **resource_options):
+    resource = get_resource(endpoint_url, **resource_options)
+    items = []
+    unprocessed = []
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        request = {table_name: {"Keys": keys[start:start + BATCH_GET_LIMIT]}}
+        for attempt in range(max_attempts):
+            if attempt:
+                time.sleep(backoff * (2 ** (attempt - 1)))
+            response = resource.batch_get_item(RequestItems=request)
+            items.extend(response.get('Responses', {}).get(table_name, []))
+            request = response.get('UnprocessedKeys')
+            if not request:
+                break
+        if request:
+            logger.warning("Giving up on %d unprocessed keys",
+                           len(request[table_name]["Keys"]))
+            unprocessed.extend(request[table_name]["Keys"])
+    return items, unprocessed
+
+
+def batch_write_items(endpoint_url, table_name, items,
+                      max_attempts=DEFAULT_BATCH_ATTEMPTS,
+                      backoff=DEFAULT_BATCH_BACKOFF,
+                      **resource_options):
+    resource = get_resource(endpoint_url, **resource_options)
+    unwritten = []
+    for start in range(0, len(items), BATCH_WRITE_LIMIT):
+        request = {table_name: [{"PutRequest": {"Item": item}}
+                                for item in items[start:start + BATCH_WRITE_LIMIT]]}  # NOQA
+        for attempt in range(max_attempts):
+            if attempt:
+                time.sleep(backoff * (2 ** (attempt - 1)))
+            response = resource.batch_write_item(RequestItems=request)
+            request = response.get('UnprocessedItems')
+            if not request:
+                break
+        if request:
+            unwritten.extend(r["PutRequest"]["Item"]
+                             for r in request[table_name])
+    return unwritten
+
+
+class WriteBuffer(object):
+
+    def __init__(self, endpoint_url, table_name, key_name="user_id",
+                 max_items=BATCH_WRITE_LIMIT,
+                 max_age=DEFAULT_BUFFER_MAX_AGE,
+                 on_failure=None,
+                 **resource_options):
+        self.endpoint_url = endpoint_url
+        self.table_name = table_name
+        self.key_name = key_name
+        self.max_items = max_items
+        self.max_age = max_age
+        self.on_failure = on_failure
+        self.resource_options = resource_options
+        self._pending = OrderedDict()
+        self._oldest = None
+        self._lock = threading.Lock()
+        # Held across the write, so that an older batch cannot land after a
+        # newer one for the same key
+        self._flush_lock = threading.Lock()
+
+    def put(self, item):
+        with self._lock:
+            # Last write wins for pending puts of the same key
+            self._pending.pop(item[self.key_name], None)
+            self._pending[item[self.key_name]] = item
+            if self._oldest is None:
+                self._oldest = time.time()
+            due = len(self._pending) >= self.max_items
+        if due or self.expired():
+            self.flush()
+
+    def expired(self):
+        oldest = self._oldest
+        return oldest is not None and time.time() - oldest >= self.max_age
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                items = list(self._pending.values())
+                self._pending.clear()
+                self._oldest = None
+            if not items:
+                return True
+            try:
+                with metrics.timer("dynamodb.batch_write"):
+                    unwritten = batch_write_items(self.endpoint_url,
+                                                  self.table_name,
+                                                  items,
+                                                  **self.resource_options)
+            except errors() as e:
+                logger.error("Error flushing %d buffered writes: %s",
+                             len(items), e)
+                unwritten = items
+            if unwritten:
+                logger.error("Could not write %d buffered items",
+                             len(unwritten))
+                if self.on_failure is not None:
+                    self.on_failure(unwritten)
+            return not unwritten
+
+    def __len__(self):
+        return len(self._pending)
+
+
+def get_write_buffer(endpoint_url, table_name, **options):
+    key = (endpoint_url, table_name)
+    buffer = _write_buffers.get(key)
+    if buffer is not None:
+        return buffer
+    with _lock:
+        buffer = _write_buffers.get(key)
+        if buffer is None:
+            buffer = WriteBuffer(endpoint_url, table_name, **options)
+            _write_buffers[key] = buffer
+    return buffer
+
+
+def flush_write_buffers(expired_only=False):
+    success = True
+    for buffer in list(_write_buffers.values()):
+        if not expired_only or buffer.expired():
+            success = buffer.flush() and success
+    return success
+
+
+def background_flush_running():
+    return _flusher is not None
+
+
+def start_background_flush(interval=DEFAULT_BUFFER_MAX_AGE):
+    global _flusher
+    with _lock:
+        if _flusher is not None:
+            return
+        stopped = _flusher = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            flush_write_buffers(expired_only=True)
+        flush_write_buffers()
+
+    thread = threading.Thread(target=run, name="datastore-flusher")
+    thread.daemon = True
+    thread.start()
+
+
+def stop_background_flush():
+    global _flusher
+    with _lock:
+        flusher, _flusher = _flusher, None
+    if flusher is not None:
+        flusher.set()
+    flush_write_buffers()
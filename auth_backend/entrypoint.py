@@ -1,30 +1,108 @@
 import logging
-from auth_backend.jwt_authentication import JWTAuthentication
+from auth_backend import datastore
+from auth_backend import metrics
+from auth_backend import workers
+from auth_backend.config import ConfigurationError
+from auth_backend.http import ERROR_MODE_RETURN
 from auth_backend.http import format_response
+from auth_backend.http import raise_for_status
 
 __version__ = "0.0.4"
+DEFAULT_LOG_LEVEL = "INFO"
+METRICS_DIMENSIONS = {"Service": "auth-backend"}
 logging.basicConfig()
 logger = logging.getLogger("auth_backend")
-logger.setLevel(logging.DEBUG)
+logger.setLevel(DEFAULT_LOG_LEVEL)
+
+# resource path -> handler(event)
+routes = {}
+
+
+def route(resource_path):
+    def register(fn):
+        routes[resource_path] = fn
+        return fn
+    return register
+
+
+def authenticator(event):
+    # The token machinery is imported by the first request that needs it,
+    # so health checks on a cold container stay cheap
+    from auth_backend.jwt_authentication import JWTAuthentication
+    return JWTAuthentication.from_event(event)
+
+
+def configure_logging(level):
+    level = (level or DEFAULT_LOG_LEVEL).upper()
+    if logging.getLevelName(logger.level) == level:
+        return
+    try:
+        logger.setLevel(level)
+    except ValueError:
+        logger.warning("Unknown log level %s", level)
 
 
 def handler(event, context):
-    logger.debug("Received event: %s" % event)
+    configure_logging(event.get("auth_log_level"))
+    try:
+        response = dispatch(event)
+        metrics.incr("responses.%s" % response["http_status"])
+        if event.get("auth_error_mode") == ERROR_MODE_RETURN:
+            return response
+        return raise_for_status(response)
+    finally:
+        # Without a background flusher, buffered and deferred writes must
+        # land before the Lambda container is frozen
+        if not datastore.background_flush_running():
+            datastore.flush_write_buffers()
+            workers.drain("persist")
+        if event.get("auth_metrics") == "emf":
+            metrics.emit_emf(dimensions=METRICS_DIMENSIONS)
+
+
+def dispatch(event):
+    # Events carry the signing and OAuth secrets, so only the path is logged
     resource_path = event.get('resource-path')
+    logger.debug("Received a request for %s", resource_path)
+    fn = routes.get(resource_path)
+    if fn is None:
+        payload = {"error": "Invalid path %s" % resource_path}
+        return format_response(400, payload)
+    try:
+        return fn(event)
+    except ConfigurationError as e:
+        logger.error("Invalid configuration: %s", e)
+        return format_response(500, {"error": "Invalid configuration"})
+
+
+@route("/auth/token")
+def new_token(event):
+    logger.debug("Received a new JWT token request")
+    return authenticator(event).dispense_new_jwt()
+
+
+@route("/auth/refresh")
+def refresh_token(event):
+    logger.debug("Handling a REFRESH TOKEN request")
+    return authenticator(event).refresh_jwt()
+
+
+@route("/auth/refresh/batch")
+def refresh_token_batch(event):
+    logger.debug("Handling a BATCH REFRESH TOKEN request")
+    return authenticator(event).refresh_jwt_batch()
+
+
+@route("/auth/revoke")
+def revoke_token(event):
+    return authenticator(event).revoke_jwt()
 
-    if resource_path == "/auth/token":
-        logger.debug("Received a new JWT token request")
-        auth = JWTAuthentication(event)
-        return auth.dispense_new_jwt()
 
-    elif resource_path == "/auth/refresh":
-        logger.debug("Handling a REFRESH TOKEN request")
-        auth = JWTAuthentication(event)
-        return auth.refresh_jwt()
+@route("/auth/jwks")
+def jwks(event):
+    return authenticator(event).jwks()
 
-    elif resource_path == "/auth/ping":
-        payload = {"version": __version__}
-        return format_response(200, payload)
 
-    payload = {"error": "Invalid path %s" % resource_path}
-    return format_response(400, payload)
+@route("/auth/ping")
+def ping(event):
+    return format_response(200, {"version": __version__})
@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from auth_backend import breaker
+from auth_backend import metrics
+
+
+logger = logging.getLogger("auth_backend")
+
+DEFAULT_SETTINGS = {
+    "pool_size": 10,
+    "max_retries": 2,
+    "backoff_factor": 0.1,
+    "connect_timeout": 2,
+    "read_timeout": 5,
+    "hedge_percentile": None
+}
+# Only these need a new session to take effect
+SESSION_SETTINGS = ("pool_size", "max_retries", "backoff_factor")
+
+# A single Session is shared by the whole process so that consecutive calls
+# to github.com and api.github.com reuse pooled keep-alive connections
+# instead of paying for a new TCP and TLS handshake every time.
+_settings = dict(DEFAULT_SETTINGS)
+_session = None
+_hedge_executor = None
+_lock = threading.Lock()
+
+
+def configure(**settings):
+    global _session
+    changes = dict((k, v) for k, v in settings.items() if v is not None)
+    with _lock:
+        rebuild = any(_settings.get(k) != v for k, v in changes.items()
+                      if k in SESSION_SETTINGS)
+        _settings.update(changes)
+        if rebuild and _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_session():
+    global _session
+    session = _session
+    if session is not None:
+        return session
+    with _lock:
+        if _session is None:
+            _session = build_session(_settings)
+        return _session
+
+
+def build_session(settings):
+    # requests is only imported once a GitHub call is actually made
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.packages.urllib3.util.retry import Retry
+    # Retry only covers idempotent methods, so a single-use OAuth access code
+    # is never POSTed twice.
+    retries = Retry(total=int(settings["max_retries"]),
+                    backoff_factor=float(settings["backoff_factor"]),
+                    status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=int(settings["pool_size"]),
+                          pool_maxsize=int(settings["pool_size"]),
+                          max_retries=retries)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def request(method, url, metric, **kwargs):
+    import requests
+    circuit = breaker.get(metric)
+    if not circuit.allow():
+        # GitHub is failing or too slow: fail fast instead of tying up
+        # this invocation until the timeout
+        metrics.incr("%s.short_circuited" % metric)
+        return None
+    kwargs.setdefault("timeout", (float(_settings["connect_timeout"]),
+                                  float(_settings["read_timeout"])))
+    start = time.time()
+    response = None
+    try:
+        response = send(method, url, metric, circuit, **kwargs)
+        return response
+    except requests.exceptions.RequestException as e:
+        logger.warning("Request to GitHub failed: %s", e)
+        metrics.incr("%s.errors" % metric)
+        return None
+    finally:
+        seconds = time.time() - start
+        metrics.record(metric, seconds)
+        circuit.record(response is None or response.status_code >= 500,
+                       seconds)
+
+
+def send(method, url, metric, circuit, **kwargs):
+    delay = hedge_delay(method, circuit)
+    if delay is None:
+        return get_session().request(method, url, **kwargs)
+    return hedged(delay, metric, method, url, **kwargs)
+
+
+def hedge_delay(method, circuit):
+    # Only idempotent calls are hedged, so a single-use OAuth access code
+    # is never sent twice
+    percentile = _settings["hedge_percentile"]
+    if method != "GET" or percentile is None:
+        return None
+    return circuit.percentile(float(percentile))
+
+
+def hedged(delay, metric, method, url, **kwargs):
+    from concurrent.futures import FIRST_COMPLETED
+    from concurrent.futures import wait
+    session = get_session()
+    executor = get_hedge_executor()
+    first = executor.submit(session.request, method, url, **kwargs)
+    if wait([first], timeout=delay).done:
+        return first.result()
+
+    # The call is slower than most: whichever of the two answers first wins
+    metrics.incr("%s.hedged" % metric)
+    second = executor.submit(session.request, method, url, **kwargs)
+    pending = [first, second]
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is second:
+                    metrics.incr("%s.hedge_won" % metric)
+                return future.result()
+    return first.result()
+
+
+def get_hedge_executor():
+    # Hedged calls get threads of their own, since they may be made from
+    # the shared worker pool and must not wait on it
+    global _hedge_executor
+    executor = _hedge_executor
+    if executor is not None:
+        return executor
+    from concurrent.futures import ThreadPoolExecutor
+    with _lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=2 * int(_settings["pool_size"]))
+        return _hedge_executor
+
+
+def post(url, metric, **kwargs):
+    return request("POST", url, metric, **kwargs)
+
+
+def get(url, metric, **kwargs):
+    return request("GET", url, metric, **kwargs)
+
+
+def connection_stats():
+    stats = {"connections": 0, "requests": 0}
+    session = _session
+    if session is None:
+        return stats
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats["connections"] += pool.num_connections
+            stats["requests"] += pool.num_requests
+    return stats
+
+
+def reset():
+    global _session, _hedge_executor
+    with _lock:
+        if _session is not None:
+            _session.close()
+        if _hedge_executor is not None:
+            _hedge_executor.shutdown(wait=False)
+        _session = None
+        _hedge_executor = None
+        _settings.clear()
+        _settings.update(DEFAULT_SETTINGS)
+    breaker.reset()
@@ -1,11 +1,24 @@
 import json
 
 
-def format_response(http_status_code, payload):
+ERROR_MODE_RAISE = "raise"
+ERROR_MODE_RETURN = "return"
+
+
+def format_response(http_status_code, payload, headers=None):
     response = {
         "http_status": http_status_code,
         "data": payload
     }
-    if http_status_code == 200:
-        return response
-    raise TypeError(json.dumps(response))
+    if headers:
+        response["headers"] = headers
+    return response
+
+
+def raise_for_status(response):
+    # The API Gateway Lambda integration picks the HTTP status by matching a
+    # regex against the error message, so errors have to leave the handler
+    # as an exception carrying the serialized response
+    if response["http_status"] != 200:
+        raise TypeError(json.dumps(response))
+    return response
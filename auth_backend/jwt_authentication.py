@@ -1,26 +1,120 @@
 import logging
-import requests
-import jwt
-import datetime
-import boto3
+import hashlib
+import time
+import uuid
+import concurrent.futures
+from decimal import Decimal
+from auth_backend import breaker
+from auth_backend import datastore
+from auth_backend.config import get_config
+from auth_backend import github
+from auth_backend import metrics
+from auth_backend import prerefresh
+from auth_backend import ratelimit
+from auth_backend import records
+from auth_backend import revocation
+from auth_backend import singleflight
+from auth_backend import tokens
+from auth_backend import workers
+from auth_backend.cache import TieredCache
+from auth_backend.cache import TTLCache
 from auth_backend.http import format_response
 
 
 logger = logging.getLogger("auth_backend")
 
+UNAVAILABLE_MSG = "GitHub is unavailable, try again later"
+DATASTORE_UNAVAILABLE_MSG = "Could not read bearer token, try again later"
+
+
+class UpstreamUnavailable(Exception):
+    pass
+
+
+# GitHub token validation results, keyed by (client id, bearer token hash)
+validation_cache = TTLCache(maxsize=1024, ttl=60)
+metrics.register_source("github_validation_cache", validation_cache.stats)
+
+# The last successful validation of every bearer token, only trusted while
+# GitHub's validation endpoint is unavailable
+degraded_validation_cache = TTLCache(maxsize=1024, ttl=3600)
+
+# Bearer tokens, keyed by (table name, user id)
+bearer_token_cache = TTLCache(maxsize=1024, ttl=300)
+
+
+def use_shared_bearer_token_cache(shared):
+    global bearer_token_cache
+    bearer_token_cache = TieredCache(TTLCache(maxsize=1024, ttl=300), shared)
+
+
+def bearer_token_cache_stats():
+    return bearer_token_cache.stats()
+
+
+metrics.register_source("bearer_token_cache", bearer_token_cache_stats)
+
+
+# Access codes GitHub refused, keyed by (client id, access code hash). Codes
+# are single use, so a refused one is refused again without asking GitHub.
+rejected_code_cache = TTLCache(maxsize=4096, ttl=60)
+metrics.register_source("rejected_access_codes", rejected_code_cache.stats)
+
+
+# Concurrent requests for the same user or bearer token share one upstream
+# call instead of each making their own
+bearer_token_flights = singleflight.SingleFlight("bearer_token_lookup")
+validation_flights = singleflight.SingleFlight("github_validation")
+
+
+def invalidate_bearer_tokens(table_name):
+    def invalidate(items):
+        for item in items:
+            bearer_token_cache.delete((table_name, item['user_id']))
+    return invalidate
+
+
+# The process-wide clients and caches are reconfigured only when a request
+# arrives with a different configuration
+_applied_config = None
+
+
+def apply_config(config):
+    global _applied_config
+    if config is _applied_config:
+        return
+    github.configure(**config.github_settings)
+    workers.configure(**config.worker_settings)
+    breaker.configure(**config.github_breaker_settings)
+    degraded_validation_cache.configure(
+        **config.degraded_validation_cache_settings)
+    validation_cache.configure(**config.validation_cache_settings)
+    bearer_token_cache.configure(**config.bearer_token_cache_settings)
+    rejected_code_cache.configure(**config.rejected_code_cache_settings)
+    _applied_config = config
+
+
+def error_status(error_msg):
+    # An outage is not the client's fault, so it is not reported as a 401
+    # that would end the session
+    if error_msg in (UNAVAILABLE_MSG, DATASTORE_UNAVAILABLE_MSG):
+        return 503
+    return 401
+
 
 class JWTAuthentication(object):
 
-    def __init__(self, lambda_event):
-        for prop in ["payload",
-                     "jwt_signing_secret",
-                     "jwt_expiry_minutes",
-                     "oauth_client_id",
-                     "oauth_client_secret",
-                     "auth_dynamodb_endpoint_url",
-                     "auth_dynamodb_table_name",
-                     "auth_desired_oauth_scopes"]:
-            setattr(self, prop, lambda_event.get(prop))
+    def __init__(self, config, payload, source_ip=None):
+        self.config = config
+        self.payload = payload or {}
+        self.source_ip = source_ip
+        apply_config(config)
+
+    @classmethod
+    def from_event(cls, lambda_event):
+        return cls(get_config(lambda_event),
+                   lambda_event.get("payload"),
+                   lambda_event.get("source-ip"))
 
     def dispense_new_jwt(self):
         temp_access_code = self.payload.get("password")
@@ -30,141 +124,656 @@ class JWTAuthentication(object):
             logger.warning(error_msg)
             return format_response(400, {"error": error_msg})
 
-        bearer_token = self.retrieve_bearer_token(temp_access_code)
-        if not bearer_token:
-            error_msg = "Not Authorized"
+        rate_limited = self.rate_limit()
+        if rate_limited is not None:
+            return rate_limited
+
+        try:
+            bearer_token, userid, login, error_msg = \
+                self.github_identity(temp_access_code)
+        except UpstreamUnavailable as e:
+            logger.info("%s", e)
+            return format_response(503, {"error": UNAVAILABLE_MSG})
+        if error_msg:
             logger.info(error_msg)
             return format_response(401, {"error": error_msg})
 
-        userid, login = self.retrieve_gh_user_info(bearer_token)
+        if self.config.auth_persist_mode == "deferred":
+            return self.deferred_persist_jwt(userid, login, bearer_token)
+        if self.config.auth_persist_mode == "concurrent":
+            return self.concurrent_persist_jwt(userid, login, bearer_token)
+
+        if not self.store_bearer_token(userid, bearer_token, login):
+            return self.persist_error()
+
+        return self.format_jwt(userid, login, bearer_token)
+
+    def github_identity(self, access_code):
+        bearer_token = self.retrieve_bearer_token(access_code)
+        if not bearer_token:
+            return None, None, None, "Not Authorized"
+        # The login writes the record itself, so the validation does not
+        # need to touch it as well
+        userid, login, _ = self.retrieve_gh_user_info(bearer_token,
+                                                      touch=False)
         if not (userid and login):
-            error_msg = "Could not find GitHub user information"
-            logger.info(error_msg)
-            return format_response(401, {"error": error_msg})
+            return (None, None, None,
+                    "Could not find GitHub user information")
+        return bearer_token, userid, login, None
+
+    def rate_limit(self):
+        config = self.config
+        if config.auth_rate_limit is None or not self.source_ip:
+            return None
+        limiter = ratelimit.get_limiter(config.auth_rate_limit_backend,
+                                        config.auth_rate_limit,
+                                        config.auth_rate_limit_burst,
+                                        config.auth_dynamodb_endpoint_url,
+                                        config.auth_rate_limit_table_name,
+                                        **config.datastore_options)
+        if limiter.acquire("ip:%s" % self.source_ip):
+            return None
+        metrics.incr("ratelimit.rejected")
+        logger.info("Rate limited token requests from %s", self.source_ip)
+        return format_response(429, {"error": "Too Many Requests"},
+                               headers={"Retry-After":
+                                        str(limiter.retry_after())})
 
-        if not self.store_bearer_token(userid, bearer_token):
-            error_msg = "Unable to persist bearer token"
-            logger.error(error_msg)
-            return format_response(500, {"error": error_msg})
+    def persist_error(self):
+        error_msg = "Unable to persist bearer token"
+        logger.error(error_msg)
+        return format_response(500, {"error": error_msg})
 
+    def concurrent_persist_jwt(self, userid, login, bearer_token):
+        future = workers.submit("persist", self.store_bearer_token, userid,
+                                bearer_token, login)
+        response = self.format_jwt(userid, login, bearer_token)
+        try:
+            stored = future.result(timeout=self.config.auth_persist_timeout)
+        except concurrent.futures.TimeoutError:
+            logger.error("Timed out persisting bearer token for %s", userid)
+            stored = False
+        if not stored:
+            return self.persist_error()
+        return response
+
+    def deferred_persist_jwt(self, userid, login, bearer_token):
+        # The token is served from the cache until the write lands; if it
+        # fails, store_bearer_token invalidates it and the user logs in again
+        bearer_token_cache.set(self.bearer_token_cache_key(userid),
+                               bearer_token)
+        workers.submit("persist", self.store_bearer_token, userid,
+                       bearer_token, login)
         return self.format_jwt(userid, login, bearer_token)
 
     def refresh_jwt(self):
-        current_jwt = self.payload.get("token")
-        decoded_token = ""
-        try:
-            decoded_token = jwt.decode(current_jwt, self.jwt_signing_secret)
-        except jwt.exceptions.InvalidTokenError:
-            error_msg = "Invalid JSON Web Token"
+        claims, error_msg = self.decode_refresh_token(
+            self.payload.get("token")
+        )
+        if not error_msg and self.is_recently_validated(claims):
+            return self.remint_jwt(claims)
+        if not error_msg:
+            bearer_token = self.lookup_bearer_token(claims['sub'])
+            userid, login, validated_at, error_msg = \
+                self.validate_bearer_token(bearer_token)
+        if error_msg:
             logger.info(error_msg)
-            return format_response(401, {"error": error_msg})
+            return format_response(error_status(error_msg),
+                                   {"error": error_msg})
+
+        return self.format_jwt(userid, login, bearer_token,
+                               validated_at=validated_at,
+                               jti=claims.get('jti'))
+
+    def refresh_jwt_batch(self):
+        tokens = self.payload.get("tokens")
+        if not isinstance(tokens, list) or not tokens:
+            error_msg = "\'tokens\' field must be a non-empty list"
+            logger.warning(error_msg)
+            return format_response(400, {"error": error_msg})
+        if len(tokens) > self.config.auth_refresh_batch_max_size:
+            error_msg = "At most %s tokens can be refreshed at once" % self.config.auth_refresh_batch_max_size  # NOQA
+            logger.warning(error_msg)
+            return format_response(400, {"error": error_msg})
+
+        # Whether a token skips GitHub is decided once, since its window
+        # can run out while the others are being validated
+        decoded_tokens = [
+            (claims, error_msg,
+             not error_msg and self.is_recently_validated(claims))
+            for claims, error_msg in map(self.decode_refresh_token, tokens)
+        ]
+        user_ids = []
+        for claims, error_msg, recent in decoded_tokens:
+            if error_msg or recent:
+                continue
+            if claims['sub'] not in user_ids:
+                user_ids.append(claims['sub'])
+        bearer_tokens, unavailable = self.lookup_bearer_tokens(user_ids)
+        validations = self.validate_bearer_tokens(
+            [user_id for user_id in user_ids if user_id not in unavailable],
+            bearer_tokens)
+        # Users whose item could not be read keep their session and retry
+        for user_id in unavailable:
+            validations[user_id] = (
+                None, (None, None, None, DATASTORE_UNAVAILABLE_MSG))
+
+        results = [self.batch_result(claims, error_msg, recent, validations)
+                   for claims, error_msg, recent in decoded_tokens]
+        return format_response(200, {"results": results})
+
+    def batch_result(self, claims, error_msg, recent, validations):
+        if recent:
+            response = self.remint_jwt(claims)
+            return {"http_status": 200, "token": response['data']['token']}
+        if not error_msg:
+            bearer_token, (userid, login, validated_at, error_msg) = \
+                validations[claims['sub']]
+        if error_msg:
+            return {"http_status": error_status(error_msg),
+                    "error": error_msg}
+        response = self.format_jwt(userid, login, bearer_token,
+                                   validated_at=validated_at,
+                                   jti=claims.get('jti'))
+        return {"http_status": 200, "token": response['data']['token']}
+
+    def decode_refresh_token(self, current_jwt):
+        try:
+            with metrics.timer("jwt.decode"):
+                decoded_token = self.config.keyring.decode(current_jwt)
+        except tokens.InvalidTokenError:
+            metrics.incr("jwt.decode.invalid")
+            return None, "Invalid JSON Web Token"
+
+        if not decoded_token.get('sub'):
+            return None, "sub field not present in JWT"
+        if self.is_revoked(decoded_token):
+            metrics.incr("revocation.rejected")
+            return None, "Token has been revoked"
+        return decoded_token, None
+
+    def revocation_list(self):
+        config = self.config
+        if not config.auth_revocation_table_name:
+            return None
+        return revocation.get_revocation_list(
+            config.auth_dynamodb_endpoint_url,
+            config.auth_revocation_table_name,
+            config.auth_revocation_sync_interval,
+            **config.datastore_options
+        )
+
+    def is_revoked(self, claims):
+        revocation_list = self.revocation_list()
+        jti = claims.get('jti')
+        return revocation_list is not None and jti is not None and \
+            revocation_list.is_revoked(jti)
+
+    def revoke_jwt(self):
+        revocation_list = self.revocation_list()
+        if revocation_list is None:
+            error_msg = "Token revocation is not enabled"
+            logger.warning(error_msg)
+            return format_response(400, {"error": error_msg})
 
-        userid = decoded_token.get('sub')
-        if not userid:
-            error_msg = "sub field not present in JWT"
+        claims, error_msg = self.decode_refresh_token(
+            self.payload.get("token")
+        )
+        if not error_msg and not claims.get('jti'):
+            error_msg = "jti field not present in JWT"
+        if error_msg:
             logger.info(error_msg)
             return format_response(401, {"error": error_msg})
 
-        bearer_token = self.lookup_bearer_token(userid)
+        # Refreshed tokens keep their jti, so the revocation has to outlive
+        # the newest token that may have been minted from this one, including
+        # by containers that have not synced the revocation yet
+        expires_at = int(time.time() + 60 * self.config.jwt_expiry_minutes +
+                         self.config.auth_revocation_sync_interval +
+                         revocation.SYNC_OVERLAP_MS / 1000.0)
+        try:
+            revocation_list.revoke(claims['jti'], expires_at)
+        except datastore.errors() as e:
+            logger.error("Error revoking token: %s", e)
+            return format_response(500, {"error": "Unable to revoke token"})
+        return format_response(200, {"revoked": claims['jti']})
+
+    def validated_at(self, claims):
+        # Tokens minted before validated_at existed were minted right after
+        # a GitHub validation, so their iat is when that happened
+        value = claims.get('validated_at', claims.get('iat'))
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def is_recently_validated(self, claims):
+        window = self.config.auth_revalidation_window
+        if not window:
+            return False
+        if not (claims.get('github_login') and self.has_github_claim(claims)):
+            return False
+        validated_at = self.validated_at(claims)
+        return validated_at is not None and \
+            time.time() - validated_at < window
+
+    def has_github_claim(self, claims):
+        if claims.get('github_token'):
+            return True
+        return self.config.jwt_github_token_mode == "reference" and \
+            bool(claims.get('github_ref'))
+
+    def remint_jwt(self, claims):
+        # validated_at is carried over unchanged, so chaining refreshes
+        # cannot push the next GitHub validation out indefinitely
+        metrics.incr("refresh.revalidation_skipped")
+        return self.format_jwt(claims['sub'],
+                               claims['github_login'],
+                               claims.get('github_token'),
+                               validated_at=self.validated_at(claims),
+                               jti=claims.get('jti'),
+                               github_ref=claims.get('github_ref'))
+
+    def validate_bearer_token(self, bearer_token):
         if not bearer_token:
-            error_msg = "Could not find bearer token in datastore"
-            logger.info(error_msg)
-            return format_response(401, {"error": error_msg})
+            return (None, None, None,
+                    "Could not find bearer token in datastore")
 
-        userid, login = self.retrieve_gh_user_info(bearer_token)
+        try:
+            userid, login, validated_at = \
+                self.retrieve_gh_user_info(bearer_token)
+        except UpstreamUnavailable as e:
+            logger.info("%s", e)
+            return None, None, None, UNAVAILABLE_MSG
         if not (userid and login):
-            error_msg = "Could not validate bearer token"
-            logger.info(error_msg)
-            return format_response(401, {"error": error_msg})
+            return None, None, None, "Could not validate bearer token"
+        return userid, login, validated_at, None
 
-        return self.format_jwt(userid, login, bearer_token)
+    def validate_bearer_tokens(self, user_ids, bearer_tokens):
+        futures = [(userid,
+                    bearer_tokens.get(userid),
+                    workers.submit("validate", self.validate_bearer_token,
+                                   bearer_tokens.get(userid)))
+                   for userid in user_ids]
+        return dict((userid, (bearer_token, future.result()))
+                    for userid, bearer_token, future in futures)
+
+    def access_code_key(self, access_code):
+        code_hash = hashlib.sha256(access_code.encode('utf-8')).hexdigest()
+        return (self.config.oauth_client_id, code_hash)
+
+    def reject_access_code(self, access_code):
+        rejected_code_cache.set(self.access_code_key(access_code), True)
 
     def retrieve_bearer_token(self, access_code):
+        if rejected_code_cache.get(self.access_code_key(access_code)):
+            metrics.incr("github.exchange.rejected_cached")
+            logger.info("Access code was already rejected")
+            return None
+
         payload = {
-            "client_id": self.oauth_client_id,
-            "client_secret": self.oauth_client_secret,
+            "client_id": self.config.oauth_client_id,
+            "client_secret": self.config.oauth_client_secret,
             "code": access_code
         }
-        r = requests.post("https://github.com/login/oauth/access_token",
-                          data=payload,
-                          headers={"Accept": "application/json"})
+        r = github.post("%s/login/oauth/access_token" % self.config.github_url,
+                        "github.exchange",
+                        data=payload,
+                        headers={"Accept": "application/json"})
+        if r is None or r.status_code >= 500:
+            raise UpstreamUnavailable("Could not reach GitHub to exchange "
+                                      "the access code")
         if not r.status_code == 200:
-            logger.info("Could not exchange access code %s for bearer token"
-                        % access_code)
-            logger.info("HTTP response code from GitHub: %s" % r.status_code)
-            logger.debug("URL: %s" % r.url)
-            logger.debug("Headers: %s" % r.headers)
-            logger.debug("Response: %s" % r.text)
+            logger.info("Could not exchange access code for bearer token")
+            logger.info("HTTP response code from GitHub: %s", r.status_code)
+            logger.debug("Response: %s", r.text)
+            self.reject_access_code(access_code)
             return None
 
         gh_response = r.json()
-        if not self.are_scopes_sufficient(gh_response['scope']):
-            error_msg = "Need the following GitHub scopes: %s" % self.auth_desired_oauth_scopes  # NOQA
+        if 'access_token' not in gh_response:
+            logger.info("GitHub refused the access code: %s",
+                        gh_response.get('error'))
+            self.reject_access_code(access_code)
+            return None
+        if not self.are_scopes_sufficient(gh_response.get('scope', '')):
+            error_msg = "Need the following GitHub scopes: %s" % self.config.auth_desired_oauth_scopes  # NOQA
             logger.info(error_msg)
+            self.reject_access_code(access_code)
             return None
 
         return gh_response['access_token']
 
     def are_scopes_sufficient(self, scopes):
         scope_list = scopes.split(',')
-        desired_scope_list = self.auth_desired_oauth_scopes.split(',')
-        logger.debug("Supplied scope list: %s" % scope_list)
-        logger.debug("Desired scope list: %s" % desired_scope_list)
-        return set(desired_scope_list).issubset(set(scope_list))
-
-    def retrieve_gh_user_info(self, bearer_token):
-        r = requests.get(
-            'https://api.github.com/applications/%s/tokens/%s' % (self.oauth_client_id, bearer_token),  # NOQA
-            auth=(self.oauth_client_id, self.oauth_client_secret)
+        logger.debug("Supplied scope list: %s", scope_list)
+        logger.debug("Desired scope list: %s", self.config.desired_scopes)
+        return self.config.desired_scopes.issubset(scope_list)
+
+    def validation_cache_key(self, bearer_token):
+        token_hash = hashlib.sha256(bearer_token.encode('utf-8')).hexdigest()
+        return (self.config.oauth_client_id, token_hash)
+
+    def retrieve_gh_user_info(self, bearer_token, touch=True):
+        cache_key = self.validation_cache_key(bearer_token)
+        cached = validation_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        try:
+            return validation_flights.do(
+                cache_key,
+                lambda: self.validate_with_github(bearer_token, cache_key,
+                                                  touch),
+                timeout=self.config.auth_coalesce_timeout
+            )
+        except singleflight.Timeout as e:
+            raise UpstreamUnavailable(str(e))
+
+    def validate_with_github(self, bearer_token, cache_key, touch=True):
+        r = github.get(
+            '%s/applications/%s/tokens/%s' % (self.config.github_api_url, self.config.oauth_client_id, bearer_token),  # NOQA
+            "github.validate",
+            auth=(self.config.oauth_client_id, self.config.oauth_client_secret)
         )
+        if r is None or r.status_code >= 500:
+            return self.degraded_validation(cache_key)
         if not r.status_code == 200:
+            # The URL carries the bearer token, so it is never logged
             logger.info("Could not retrieve user information")
-            logger.info("HTTP response code from GitHub: %s" % r.status_code)
-            logger.debug("URL: %s" % r.url)
-            logger.debug("Headers: %s" % r.headers)
-            logger.debug("Response: %s" % r.text)
-            return (None, None)
+            logger.info("HTTP response code from GitHub: %s", r.status_code)
+            logger.debug("Response: %s", r.text)
+            if r.status_code in (401, 404):
+                negative_ttl = self.config.github_validation_negative_ttl
+                validation_cache.set(cache_key, (None, None, None),
+                                     ttl=negative_ttl)
+            return (None, None, None)
         gh_response = r.json()
-        return (gh_response.get('user').get('id'),
-                gh_response.get('user').get('login'))
+        # Kept with the validation, so tokens minted from a cached or
+        # degraded validation carry when GitHub actually accepted it
+        user_info = (gh_response.get('user').get('id'),
+                     gh_response.get('user').get('login'),
+                     int(time.time()))
+        validation_cache.set(cache_key, user_info)
+        degraded_validation_cache.set(cache_key, user_info)
+        if touch:
+            self.touch_bearer_token(user_info[0], bearer_token, user_info[1])
+        return user_info
 
-    def format_jwt(self, userid, login, bearer_token):
+    def degraded_validation(self, cache_key):
+        user_info = None
+        if breaker.get("github.validate").is_open():
+            user_info = degraded_validation_cache.get(cache_key)
+        if user_info is None:
+            raise UpstreamUnavailable("Could not reach GitHub to validate "
+                                      "the bearer token")
+        metrics.incr("github.validate.degraded")
+        logger.warning("GitHub is unavailable, using an earlier validation")
+        return user_info
+
+    def format_jwt(self, userid, login, bearer_token, validated_at=None,
+                   jti=None, github_ref=None):
+        now = int(time.time())
         data = {
-            'iat': datetime.datetime.utcnow(),
-            'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=int(self.jwt_expiry_minutes)),  # NOQA
+            # Identifies the login; refreshed tokens keep it so that a
+            # revocation covers all of them
+            "jti": jti or uuid.uuid4().hex,
+            'iat': now,
+            'exp': now + 60 * self.config.jwt_expiry_minutes,
             "sub": userid,
             "github_login": login,
-            "github_token": bearer_token
+            "validated_at": now if validated_at is None else validated_at
         }
-        encoded = jwt.encode(data, self.jwt_signing_secret, algorithm='HS256')
+        if self.config.jwt_github_token_mode == "reference":
+            # Downstream services only get an opaque handle on the bearer
+            # token, which keeps every token and header they parse smaller
+            data["github_ref"] = github_ref or \
+                records.token_reference(bearer_token)
+        else:
+            data["github_token"] = bearer_token
+        with metrics.timer("jwt.encode"):
+            encoded = self.config.keyring.encode(data)
+        # Every minted token marks its user as active, for the server's
+        # background refreshes
+        prerefresh.track(self.config, userid)
         return format_response(200, {"token": encoded})
 
-    def lookup_bearer_token(self, user_id):  # pragma: no cover
+    def jwks(self):
+        cache_control = "public, max-age=%d" % self.config.jwt_jwks_max_age
+        return format_response(200, self.config.keyring.jwks,
+                               headers={"Cache-Control": cache_control})
+
+    def bearer_token_table(self):
+        return datastore.get_table(self.config.auth_dynamodb_endpoint_url,
+                                   self.config.auth_dynamodb_table_name,
+                                   **self.config.datastore_options)
+
+    def bearer_token_cache_key(self, user_id):
+        return (self.config.auth_dynamodb_table_name, user_id)
+
+    def lookup_bearer_token(self, user_id):
+        cache_key = self.bearer_token_cache_key(user_id)
+        bearer_token = bearer_token_cache.get(cache_key)
+        if bearer_token is not None:
+            return bearer_token
         try:
-            dynamodb = boto3.resource(
-                'dynamodb',
-                endpoint_url=self.auth_dynamodb_endpoint_url
+            return bearer_token_flights.do(
+                cache_key,
+                lambda: self.load_bearer_token(user_id, cache_key),
+                timeout=self.config.auth_coalesce_timeout
+            )
+        except singleflight.Timeout as e:
+            logger.error("%s", e)
+            return None
+
+    def load_bearer_token(self, user_id, cache_key):
+        bearer_token = self.fetch_bearer_token(user_id)
+        if bearer_token:
+            bearer_token_cache.set(cache_key, bearer_token)
+        return bearer_token
+
+    def cached_validation(self, user_id):
+        now = time.time()
+        entry = bearer_token_cache.entry(self.bearer_token_cache_key(user_id))
+        if entry is None or entry[0] <= now:
+            return None, None
+        validation = validation_cache.entry(
+            self.validation_cache_key(entry[1]))
+        # Rejections are left to expire; only users GitHub accepted are
+        # kept warm
+        if validation is not None and \
+                (validation[0] <= now or validation[1][0] is None):
+            validation = None
+        return entry, validation
+
+    def next_expiry(self, user_id):
+        entries = [e for e in self.cached_validation(user_id) if e]
+        if not entries:
+            return None
+        return min(expires_at for expires_at, _ in entries)
+
+    def prerefresh(self, user_id, horizon):
+        # Reloads whatever this user's next refresh would otherwise fetch
+        # inline, through the same flights as requests for the same user
+        bearer_entry, validation = self.cached_validation(user_id)
+        if bearer_entry is None:
+            return
+        deadline = time.time() + horizon
+        bearer_token = bearer_entry[1]
+        if bearer_entry[0] <= deadline:
+            cache_key = self.bearer_token_cache_key(user_id)
+            bearer_token = bearer_token_flights.do(
+                cache_key, lambda: self.load_bearer_token(user_id, cache_key))
+            if not bearer_token or bearer_token != bearer_entry[1]:
+                return
+        if validation is not None and validation[0] <= deadline:
+            cache_key = self.validation_cache_key(bearer_token)
+            validation_flights.do(
+                cache_key,
+                lambda: self.validate_with_github(bearer_token, cache_key))
+
+    def lookup_bearer_tokens(self, user_ids):
+        bearer_tokens = {}
+        missing = []
+        for user_id in user_ids:
+            bearer_token = bearer_token_cache.get(
+                self.bearer_token_cache_key(user_id)
             )
-            table = dynamodb.Table(self.auth_dynamodb_table_name)
-            response = table.get_item(Key={"user_id": user_id})
-            return response['Item'].get('bearer_token')
-        except boto3.exceptions.Boto3Error as e:
-            logger.error("Error querying the datastore: %s" % str(e))
+            if bearer_token is None:
+                missing.append(user_id)
+            else:
+                bearer_tokens[user_id] = bearer_token
+        unavailable = []
+        if missing:
+            fetched, unavailable = self.fetch_bearer_tokens(missing)
+            for user_id, bearer_token in fetched.items():
+                if bearer_token:
+                    bearer_token_cache.set(
+                        self.bearer_token_cache_key(user_id), bearer_token
+                    )
+            bearer_tokens.update(fetched)
+        return bearer_tokens, unavailable
+
+    def fetch_bearer_tokens(self, user_ids):  # pragma: no cover
+        try:
+            with metrics.timer("dynamodb.batch_get"):
+                items, unprocessed = datastore.batch_get_items(
+                    self.config.auth_dynamodb_endpoint_url,
+                    self.config.auth_dynamodb_table_name,
+                    [{"user_id": user_id} for user_id in user_ids],
+                    **self.config.datastore_options
+                )
+        except datastore.errors() as e:
+            metrics.incr("dynamodb.batch_get.errors")
+            logger.error("Error querying the datastore: %s", e)
+            return {}, list(user_ids)
+        if unprocessed:
+            metrics.incr("dynamodb.batch_get.unprocessed", len(unprocessed))
+        return (dict((item['user_id'],
+                      self.read_bearer_token(item['user_id'], item))
+                     for item in items),
+                [key['user_id'] for key in unprocessed])
+
+    def fetch_bearer_token(self, user_id):  # pragma: no cover
+        try:
+            table = self.bearer_token_table()
+            with metrics.timer("dynamodb.get"):
+                response = table.get_item(Key={"user_id": user_id})
+            return self.read_bearer_token(user_id, response.get('Item'))
+        except datastore.errors() as e:
+            metrics.incr("dynamodb.get.errors")
+            logger.error("Error querying the datastore: %s", e)
         return None
 
-    def store_bearer_token(self, user_id, bearer_token):  # pragma: no cover
+    def read_bearer_token(self, user_id, item):
+        if not item:
+            return None
         try:
-            dynamodb = boto3.resource(
-                'dynamodb',
-                endpoint_url=self.auth_dynamodb_endpoint_url
-            )
-            table = dynamodb.Table(self.auth_dynamodb_table_name)
-            item = {
-                "user_id": user_id,
-                "bearer_token": bearer_token
-            }
-            table.put_item(Item=item)
-        except boto3.exceptions.Boto3Error as e:
-            logger.error("Error persisting bearer token: %s" % str(e))
+            record = self.config.record_codec.read_item(item)
+        except records.RecordError as e:
+            metrics.incr("records.errors")
+            logger.error("Could not read bearer token record: %s", e)
+            return None
+        if record is None:
+            return None
+        self.seed_validation(user_id, record)
+        return record.bearer_token
+
+    def seed_validation(self, user_id, record):
+        # A record validated within the revalidation window answers for
+        # GitHub until the window runs out
+        window = self.config.auth_revalidation_window
+        if not (window and record.login and record.last_validated):
+            return
+        remaining = record.last_validated + window - time.time()
+        if remaining <= 0:
+            return
+        if isinstance(user_id, Decimal):
+            user_id = int(user_id)
+        validation_cache.set(self.validation_cache_key(record.bearer_token),
+                             (user_id, record.login, record.last_validated),
+                             ttl=remaining)
+
+    def bearer_token_item(self, user_id, bearer_token, login=None):
+        if self.config.auth_bearer_token_record != "compact":
+            return {"user_id": user_id, "bearer_token": bearer_token}
+        record = records.BearerTokenRecord(bearer_token, login,
+                                           int(time.time()))
+        return self.config.record_codec.item(user_id, record)
+
+    def bearer_token_buffer(self):
+        config = self.config
+        return datastore.get_write_buffer(
+            config.auth_dynamodb_endpoint_url,
+            config.auth_dynamodb_table_name,
+            max_items=config.auth_write_buffer_max_items,
+            max_age=config.auth_write_buffer_max_age,
+            on_failure=invalidate_bearer_tokens(
+                config.auth_dynamodb_table_name),
+            **config.datastore_options
+        )
+
+    def store_bearer_token(self, user_id, bearer_token, login=None):
+        cache_key = self.bearer_token_cache_key(user_id)
+        if self.config.auth_persist_mode == "buffered":
+            bearer_token_cache.set(cache_key, bearer_token)
+            self.bearer_token_buffer().put(
+                self.bearer_token_item(user_id, bearer_token, login))
+            return True
+        if not self.persist_bearer_token(user_id, bearer_token, login):
+            bearer_token_cache.delete(cache_key)
             return False
+        bearer_token_cache.set(cache_key, bearer_token)
         return True
+
+    def persist_bearer_token(self, user_id, bearer_token,
+                             login=None):  # pragma: no cover
+        try:
+            table = self.bearer_token_table()
+            item = self.bearer_token_item(user_id, bearer_token, login)
+            with metrics.timer("dynamodb.put"):
+                table.put_item(Item=item, **self.unchanged_condition(item))
+        except datastore.errors() as e:
+            if datastore.error_code(e) == "ConditionalCheckFailedException":
+                # The stored record already holds this bearer token
+                metrics.incr("dynamodb.put.unchanged")
+                return True
+            metrics.incr("dynamodb.put.errors")
+            logger.error("Error persisting bearer token: %s", e)
+            return False
+        return True
+
+    def touch_bearer_token(self, user_id, bearer_token, login):
+        # GitHub just accepted the token, so its record can stand in for the
+        # next validation; written in the background, off the request path
+        if self.config.auth_bearer_token_record != "compact" or \
+                not (user_id and login):
+            return
+        workers.submit("persist", self.refresh_bearer_token_record, user_id,
+                       bearer_token, login)
+
+    def refresh_bearer_token_record(self, user_id, bearer_token, login):
+        item = self.bearer_token_item(user_id, bearer_token, login)
+        try:
+            with metrics.timer("dynamodb.put"):
+                # Only while the item still holds this token, so a newer
+                # login is never overwritten
+                self.bearer_token_table().put_item(
+                    Item=item,
+                    ConditionExpression="token_hash = :hash",
+                    ExpressionAttributeValues={":hash": item["token_hash"]}
+                )
+        except datastore.errors() as e:
+            if datastore.error_code(e) == "ConditionalCheckFailedException":
+                metrics.incr("dynamodb.put.superseded")
+                return
+            metrics.incr("dynamodb.put.errors")
+            logger.error("Error refreshing bearer token record: %s", e)
+
+    def unchanged_condition(self, item):
+        if "token_hash" not in item:
+            return {}
+        return {
+            "ConditionExpression": "attribute_not_exists(token_hash) OR "
+                                   "token_hash <> :hash",
+            "ExpressionAttributeValues": {":hash": item["token_hash"]}
+        }
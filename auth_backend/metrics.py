@@ -0,0 +1,121 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+EMF_NAMESPACE = "AuthBackend"
+
+_lock = threading.Lock()
+_counters = {}
+_timers = {}
+_sources = {}
+# Totals as of the last drain(), so each EMF line only carries what
+# happened since the previous one
+_drained_counters = {}
+_drained_timers = {}
+
+
+def register_source(name, fn):
+    with _lock:
+        _sources[name] = fn
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def record(name, seconds):
+    with _lock:
+        stats = _timers.get(name)
+        if stats is None:
+            stats = _timers[name] = {"count": 0, "total": 0.0, "max": 0.0}
+        stats["count"] += 1
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+
+
+@contextmanager
+def timer(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(name, time.time() - start)
+
+
+def snapshot():
+    with _lock:
+        timers = {}
+        for name, stats in _timers.items():
+            timers[name] = {
+                "count": stats["count"],
+                "mean_ms": 1000.0 * stats["total"] / stats["count"],
+                "max_ms": 1000.0 * stats["max"]
+            }
+        sources = dict(_sources)
+        result = {"counters": dict(_counters), "timers": timers}
+    for name, fn in sources.items():
+        result[name] = fn()
+    return result
+
+
+def drain():
+    with _lock:
+        counters = {}
+        for name, value in _counters.items():
+            delta = value - _drained_counters.get(name, 0)
+            if delta:
+                counters[name] = delta
+        timers = {}
+        for name, stats in _timers.items():
+            count, total = _drained_timers.get(name, (0, 0.0))
+            if stats["count"] > count:
+                timers[name] = 1000.0 * (stats["total"] - total) / \
+                    (stats["count"] - count)
+            _drained_timers[name] = (stats["count"], stats["total"])
+        _drained_counters.update(_counters)
+    return counters, timers
+
+
+def emf(namespace=EMF_NAMESPACE, dimensions=None):
+    counters, timers = drain()
+    if not counters and not timers:
+        return None
+    dimensions = dimensions or {}
+    definitions = [{"Name": name, "Unit": "Count"}
+                   for name in sorted(counters)]
+    definitions.extend({"Name": name, "Unit": "Milliseconds"}
+                       for name in sorted(timers))
+    document = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": namespace,
+                "Dimensions": [sorted(dimensions)],
+                "Metrics": definitions
+            }]
+        }
+    }
+    document.update(dimensions)
+    document.update(counters)
+    document.update(timers)
+    return json.dumps(document, sort_keys=True)
+
+
+def emit_emf(stream=None, **kwargs):
+    # CloudWatch only extracts metrics from log lines that are pure JSON,
+    # so this bypasses the logging formatter
+    line = emf(**kwargs)
+    if line is not None:
+        (stream or sys.stdout).write(line + "\n")
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+        _drained_counters.clear()
+        _drained_timers.clear()
@@ -0,0 +1,161 @@
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from auth_backend import metrics
+from auth_backend import ratelimit
+
+
+logger = logging.getLogger("auth_backend")
+
+DEFAULT_WORKERS = 2
+DEFAULT_BUDGET = 5
+DEFAULT_LEAD_TIME = 10
+DEFAULT_JITTER = 5
+DEFAULT_IDLE_TIMEOUT = 900
+DEFAULT_INTERVAL = 1
+DEFAULT_MAX_USERS = 10000
+
+
+class Scheduler(object):
+
+    def __init__(self, workers=DEFAULT_WORKERS, budget=DEFAULT_BUDGET,
+                 lead_time=DEFAULT_LEAD_TIME, jitter=DEFAULT_JITTER,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, interval=DEFAULT_INTERVAL,
+                 max_users=DEFAULT_MAX_USERS):
+        self.lead_time = float(lead_time)
+        self.jitter = float(jitter)
+        self.idle_timeout = float(idle_timeout)
+        self.interval = float(interval)
+        self.max_users = int(max_users)
+        # Every refresh costs at most one DynamoDB read and one GitHub call,
+        # and never more than `budget` of them start per second
+        self.limiter = ratelimit.TokenBucketLimiter(
+            budget, max(1, int(budget)), maxsize=1)
+        self.executor = ThreadPoolExecutor(max_workers=int(workers))
+        self.rng = random.Random()
+        self.refreshed = 0
+        self.deferred = 0
+        self._users = OrderedDict()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def track(self, config, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+            # Each user gets their own head start, so users who logged in
+            # together do not all come due in the same tick
+            self._users[user_id] = (config, time.time(),
+                                    self.rng.uniform(0, self.jitter))
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def active_users(self):
+        cutoff = time.time() - self.idle_timeout
+        with self._lock:
+            while self._users:
+                user_id, (_, last_seen, _) = next(iter(self._users.items()))
+                if last_seen >= cutoff:
+                    break
+                del self._users[user_id]
+            return [(user_id, config, jitter)
+                    for user_id, (config, _, jitter) in self._users.items()
+                    if user_id not in self._in_flight]
+
+    def due(self):
+        from auth_backend.jwt_authentication import JWTAuthentication
+        now = time.time()
+        for user_id, config, jitter in self.active_users():
+            horizon = self.lead_time + jitter
+            expires_at = JWTAuthentication(config, {}).next_expiry(user_id)
+            if expires_at is not None and expires_at - now <= horizon:
+                yield user_id, config, horizon
+
+    def run_once(self):
+        for user_id, config, horizon in self.due():
+            if not self.limiter.acquire("upstream"):
+                # Out of budget: whoever is left refreshes inline as before
+                self.deferred += 1
+                metrics.incr("prerefresh.deferred")
+                return
+            with self._lock:
+                self._in_flight.add(user_id)
+            self.executor.submit(self.refresh, user_id, config, horizon)
+
+    def refresh(self, user_id, config, horizon):
+        from auth_backend.jwt_authentication import JWTAuthentication
+        from auth_backend.jwt_authentication import UpstreamUnavailable
+        try:
+            JWTAuthentication(config, {}).prerefresh(user_id, horizon)
+            self.refreshed += 1
+            metrics.incr("prerefresh.refreshed")
+        except UpstreamUnavailable:
+            # The entry is left to expire; requests report the outage
+            metrics.incr("prerefresh.unavailable")
+        except Exception:
+            metrics.incr("prerefresh.errors")
+            logger.exception("Error refreshing %s in the background", user_id)
+        finally:
+            with self._lock:
+                self._in_flight.discard(user_id)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Error scheduling background refreshes")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tracked": len(self._users),
+                "in_flight": len(self._in_flight),
+                "refreshed": self.refreshed,
+                "deferred": self.deferred
+            }
+
+
+# Only the long-running local server starts a scheduler; without one,
+# tracking is a no-op
+_scheduler = None
+_lock = threading.Lock()
+
+
+def track(config, user_id):
+    scheduler = _scheduler
+    if scheduler is not None:
+        scheduler.track(config, user_id)
+
+
+def start(**settings):
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(**settings).start()
+            metrics.register_source("prerefresh", _scheduler.stats)
+        return _scheduler
+
+
+def stop():
+    global _scheduler
+    with _lock:
+        scheduler, _scheduler = _scheduler, None
+    if scheduler is not None:
+        scheduler.stop()
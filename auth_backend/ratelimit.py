@@ -0,0 +1,144 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from auth_backend import datastore
+
+
+logger = logging.getLogger("auth_backend")
+
+DEFAULT_MAX_BUCKETS = 10000
+LIMIT_KEY_NAME = "limit_key"
+
+
+class RateLimiter(object):
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = int(burst)
+
+    def acquire(self, key):
+        raise NotImplementedError
+
+    def retry_after(self):
+        return int(math.ceil(1 / self.rate))
+
+
+class TokenBucketLimiter(RateLimiter):
+
+    def __init__(self, rate, burst, maxsize=DEFAULT_MAX_BUCKETS):
+        super(TokenBucketLimiter, self).__init__(rate, burst)
+        self.maxsize = int(maxsize)
+        self.allowed = 0
+        self.rejected = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+                self.allowed += 1
+            else:
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            # Forgetting the least recently seen client hands it a full
+            # bucket, which is the state it would have refilled to anyway
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._buckets),
+                "allowed": self.allowed,
+                "rejected": self.rejected
+            }
+
+
+class DynamoDBRateLimiter(RateLimiter):
+
+    def __init__(self, endpoint_url, table_name, rate, burst,
+                 **resource_options):
+        super(DynamoDBRateLimiter, self).__init__(rate, burst)
+        self.endpoint_url = endpoint_url
+        self.table_name = table_name
+        self.resource_options = resource_options
+        # A fixed window that admits `burst` calls refills at `rate` on
+        # average, and needs a single conditional update per call
+        self.window = self.burst / self.rate
+
+    def acquire(self, key):
+        window = int(time.time() // self.window)
+        try:
+            table = datastore.get_table(self.endpoint_url, self.table_name,
+                                        **self.resource_options)
+            table.update_item(
+                Key={LIMIT_KEY_NAME: "%s:%d" % (key, window)},
+                UpdateExpression="ADD #count :one "
+                                 "SET #expires = if_not_exists(#expires, :expires)",  # NOQA
+                ConditionExpression="attribute_not_exists(#count) OR "
+                                    "#count < :burst",
+                ExpressionAttributeNames={"#count": "request_count",
+                                          "#expires": "expires_at"},
+                ExpressionAttributeValues={
+                    ":one": 1,
+                    ":burst": self.burst,
+                    ":expires": int((window + 2) * self.window)
+                }
+            )
+        except datastore.errors() as e:
+            if datastore.error_code(e) == "ConditionalCheckFailedException":
+                return False
+            # Failing open keeps logins working when the shared counters
+            # are unavailable
+            logger.error("Error updating rate limit counter: %s", e)
+        return True
+
+    def retry_after(self):
+        return int(math.ceil(self.window - time.time() % self.window))
+
+
+# Limiters hold per-client state for the life of a warm container, and are
+# shared by every request with the same settings.
+_limiters = {}
+_lock = threading.Lock()
+_override = None
+
+
+def use_limiter(limiter):
+    global _override
+    _override = limiter
+
+
+def get_limiter(backend, rate, burst, endpoint_url=None, table_name=None,
+                **resource_options):
+    if _override is not None:
+        return _override
+    key = (backend, rate, burst, endpoint_url, table_name)
+    limiter = _limiters.get(key)
+    if limiter is not None:
+        return limiter
+    with _lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            if backend == "dynamodb":
+                limiter = DynamoDBRateLimiter(endpoint_url, table_name,
+                                              rate, burst, **resource_options)
+            else:
+                limiter = TokenBucketLimiter(rate, burst)
+            _limiters[key] = limiter
+    return limiter
+
+
+def reset():
+    global _override
+    with _lock:
+        _limiters.clear()
+        _override = None
@@ -0,0 +1,100 @@
+import base64
+import hashlib
+import struct
+from collections import namedtuple
+from auth_backend import tokens
+
+
+VERSION = 1
+FLAG_ENCRYPTED = 1
+# Version, flags, last validated (epoch seconds) and the login's length,
+# followed by the login and then the bearer token
+HEADER = struct.Struct(">BBIB")
+HASH_SIZE = 16
+
+BearerTokenRecord = namedtuple("BearerTokenRecord",
+                               ["bearer_token", "login", "last_validated"])
+
+
+class RecordError(ValueError):
+    pass
+
+
+def token_hash(bearer_token):
+    return hashlib.sha256(bearer_token.encode('utf-8')).digest()[:HASH_SIZE]
+
+
+def token_reference(bearer_token):
+    return tokens.base64url_encode(token_hash(bearer_token)).decode('ascii')
+
+
+def binary_value(value):
+    # boto3 hands binary attributes back wrapped in a Binary
+    return bytes(getattr(value, 'value', value))
+
+
+class RecordCodec(object):
+
+    def __init__(self, keys=None):
+        self.fernet = None
+        if keys:
+            # cryptography is only needed when records are encrypted, so it
+            # is an optional dependency imported on first use
+            from cryptography.fernet import Fernet
+            from cryptography.fernet import MultiFernet
+            self.fernet = MultiFernet([Fernet(key.encode('ascii'))
+                                       for key in keys])
+
+    def encode(self, record):
+        login = (record.login or "").encode('utf-8')
+        bearer_token = record.bearer_token.encode('utf-8')
+        flags = 0
+        if self.fernet is not None:
+            # Fernet tokens are base64; stored raw they are a quarter smaller
+            bearer_token = base64.urlsafe_b64decode(
+                self.fernet.encrypt(bearer_token))
+            flags |= FLAG_ENCRYPTED
+        return HEADER.pack(VERSION, flags, int(record.last_validated or 0),
+                           len(login)) + login + bearer_token
+
+    def decode(self, data):
+        if len(data) < HEADER.size:
+            raise RecordError("Bearer token record is truncated")
+        version, flags, last_validated, login_size = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise RecordError("Unsupported bearer token record version %s"
+                              % version)
+        login = data[HEADER.size:HEADER.size + login_size].decode('utf-8')
+        bearer_token = data[HEADER.size + login_size:]
+        if flags & FLAG_ENCRYPTED:
+            bearer_token = self.decrypt(bearer_token)
+        return BearerTokenRecord(bearer_token.decode('utf-8'),
+                                 login or None,
+                                 last_validated or None)
+
+    def decrypt(self, data):
+        if self.fernet is None:
+            raise RecordError("Bearer token record is encrypted but no key "
+                              "is configured")
+        from cryptography.fernet import InvalidToken
+        try:
+            return self.fernet.decrypt(base64.urlsafe_b64encode(data))
+        except InvalidToken:
+            raise RecordError("Bearer token record could not be decrypted")
+
+    def item(self, user_id, record):
+        return {
+            "user_id": user_id,
+            "record": self.encode(record),
+            "token_hash": token_hash(record.bearer_token)
+        }
+
+    def read_item(self, item):
+        data = item.get('record')
+        if data is None:
+            # Items written before records existed only have the token
+            bearer_token = item.get('bearer_token')
+            if not bearer_token:
+                return None
+            return BearerTokenRecord(bearer_token, None, None)
+        return self.decode(binary_value(data))
@@ -0,0 +1,188 @@
+import hashlib
+import logging
+import struct
+import threading
+import time
+from auth_backend import datastore
+from auth_backend import metrics
+
+
+logger = logging.getLogger("auth_backend")
+
+DEFAULT_SYNC_INTERVAL = 5
+# Revocations written by other containers with a slightly older clock are
+# still picked up, since every sync re-reads this much history
+SYNC_OVERLAP_MS = 5000
+PARTITION = "revoked"
+
+# 16 bytes of the jti's SHA-256 followed by the revocation's expiry
+ENTRY = struct.Struct(">16sI")
+KEY_SIZE = 16
+
+
+def index_key(jti):
+    return hashlib.sha256(jti.encode('utf-8')).digest()[:KEY_SIZE]
+
+
+class RevocationIndex(object):
+
+    # Entries are kept sorted in a single immutable bytes object, about 20
+    # bytes per revoked token, and replaced wholesale when they change
+    def __init__(self, data=b""):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data) // ENTRY.size
+
+    def __contains__(self, jti):
+        key = index_key(jti)
+        data = self.data
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            start = middle * ENTRY.size
+            probe = data[start:start + KEY_SIZE]
+            if probe < key:
+                low = middle + 1
+            elif probe > key:
+                high = middle
+            else:
+                return True
+        return False
+
+    def entries(self):
+        for i in range(len(self)):
+            yield ENTRY.unpack_from(self.data, i * ENTRY.size)
+
+    def merged(self, revocations, now):
+        entries = dict((key, expires_at)
+                       for key, expires_at in self.entries()
+                       if expires_at > now)
+        for jti, expires_at in revocations:
+            if expires_at > now:
+                key = index_key(jti)
+                entries[key] = max(int(expires_at), entries.get(key, 0))
+        return RevocationIndex(b"".join(ENTRY.pack(key, entries[key])
+                                        for key in sorted(entries)))
+
+
+class RevocationStore(object):
+
+    def __init__(self, endpoint_url, table_name, **resource_options):
+        self.endpoint_url = endpoint_url
+        self.table_name = table_name
+        self.resource_options = resource_options
+
+    def table(self):
+        return datastore.get_table(self.endpoint_url, self.table_name,
+                                   **self.resource_options)
+
+    def revoke(self, jti, expires_at):
+        revoked_at = int(time.time() * 1000)
+        self.table().put_item(Item={
+            "partition": PARTITION,
+            "cursor": "%013d:%s" % (revoked_at, jti),
+            "jti": jti,
+            "expires_at": int(expires_at)
+        })
+
+    def changes_since(self, since_ms):
+        # The sort key starts with the revocation time, so everything newer
+        # than the cursor is a single range query
+        query = {
+            "KeyConditionExpression": "#p = :p AND #c > :since",
+            "ExpressionAttributeNames": {"#p": "partition", "#c": "cursor"},
+            "ExpressionAttributeValues": {
+                ":p": PARTITION,
+                ":since": "%013d" % max(0, since_ms - SYNC_OVERLAP_MS)
+            }
+        }
+        table = self.table()
+        revocations = []
+        latest = since_ms
+        while True:
+            response = table.query(**query)
+            for item in response.get('Items', []):
+                revocations.append((item['jti'], int(item['expires_at'])))
+                latest = max(latest, int(item['cursor'][:13]))
+            if not response.get('LastEvaluatedKey'):
+                return revocations, latest
+            query["ExclusiveStartKey"] = response['LastEvaluatedKey']
+
+
+class RevocationList(object):
+
+    def __init__(self, store, sync_interval=DEFAULT_SYNC_INTERVAL):
+        self.store = store
+        self.sync_interval = float(sync_interval)
+        self.index = RevocationIndex()
+        self.cursor = 0
+        self.synced_at = None
+        self._lock = threading.Lock()
+
+    def stale(self):
+        synced_at = self.synced_at
+        return synced_at is None or \
+            time.time() - synced_at >= self.sync_interval
+
+    def is_revoked(self, jti):
+        if self.stale():
+            # Only the very first sync makes callers wait; afterwards one
+            # caller refreshes the index while the others use the old one
+            self.sync(blocking=self.synced_at is None)
+        return jti in self.index
+
+    def sync(self, blocking=True):
+        if not self._lock.acquire(blocking):
+            return
+        try:
+            if self.stale():
+                self.sync_from_store()
+        finally:
+            self._lock.release()
+
+    def sync_from_store(self):
+        try:
+            with metrics.timer("revocation.sync"):
+                revocations, cursor = self.store.changes_since(self.cursor)
+        except datastore.errors() as e:
+            metrics.incr("revocation.sync.errors")
+            logger.error("Error syncing revoked tokens: %s", e)
+        else:
+            self.index = self.index.merged(revocations, time.time())
+            self.cursor = cursor
+        self.synced_at = time.time()
+
+    def revoke(self, jti, expires_at):
+        self.store.revoke(jti, expires_at)
+        with self._lock:
+            self.index = self.index.merged([(jti, expires_at)], time.time())
+
+    def stats(self):
+        return {"revoked": len(self.index), "cursor": self.cursor}
+
+
+_lists = {}
+_lock = threading.Lock()
+
+
+def get_revocation_list(endpoint_url, table_name,
+                        sync_interval=DEFAULT_SYNC_INTERVAL,
+                        **resource_options):
+    key = (endpoint_url, table_name)
+    revocation_list = _lists.get(key)
+    if revocation_list is not None:
+        return revocation_list
+    with _lock:
+        revocation_list = _lists.get(key)
+        if revocation_list is None:
+            store = RevocationStore(endpoint_url, table_name,
+                                    **resource_options)
+            revocation_list = RevocationList(store, sync_interval)
+            _lists[key] = revocation_list
+    return revocation_list
+
+
+def reset():
+    with _lock:
+        _lists.clear()
@@ -0,0 +1,56 @@
+import threading
+from auth_backend import metrics
+
+
+class Timeout(Exception):
+    pass
+
+
+class Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+        if leader:
+            return self.lead(key, call, fn)
+
+        # Someone else is already making this call: wait for its result
+        # instead of making the same upstream request again
+        metrics.incr("singleflight.%s.coalesced" % self.name)
+        if not call.done.wait(timeout):
+            metrics.incr("singleflight.%s.timeouts" % self.name)
+            raise Timeout("Timed out waiting for %s" % self.name)
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def lead(self, key, call, fn):
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def __len__(self):
+        return len(self._calls)
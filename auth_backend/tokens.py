@@ -0,0 +1,304 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class InvalidTokenError(Exception):
+    pass
+
+
+class DecodeError(InvalidTokenError):
+    pass
+
+
+class InvalidSignatureError(DecodeError):
+    pass
+
+
+class ExpiredSignatureError(InvalidTokenError):
+    pass
+
+
+class ImmatureSignatureError(InvalidTokenError):
+    pass
+
+
+def base64url_encode(data):
+    return base64.urlsafe_b64encode(data).replace(b'=', b'')
+
+
+def base64url_decode(data):
+    try:
+        return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+    except (TypeError, ValueError, binascii.Error):
+        raise DecodeError("Invalid base64 segment")
+
+
+def json_segment(value):
+    return base64url_encode(
+        json.dumps(value, separators=(',', ':')).encode('utf-8')
+    )
+
+
+def split_token(token):
+    try:
+        if not isinstance(token, bytes):
+            token = token.encode('ascii')
+        signing_input, signature = token.rsplit(b'.', 1)
+        header_segment, payload_segment = signing_input.split(b'.', 1)
+    except (AttributeError, UnicodeError, ValueError):
+        raise DecodeError("Not enough segments")
+    return header_segment, payload_segment, signing_input, signature
+
+
+def parse_segment(segment):
+    try:
+        value = json.loads(base64url_decode(segment).decode('utf-8'))
+    except (UnicodeError, ValueError):
+        raise DecodeError("Invalid segment encoding")
+    if not isinstance(value, dict):
+        raise DecodeError("Segment is not a JSON object")
+    return value
+
+
+def validate_claims(claims, leeway=0):
+    now = time.time()
+    try:
+        if 'exp' in claims and int(claims['exp']) < now - leeway:
+            raise ExpiredSignatureError("Signature has expired")
+        if 'nbf' in claims and int(claims['nbf']) > now + leeway:
+            raise ImmatureSignatureError("The token is not yet valid")
+    except (TypeError, ValueError):
+        raise DecodeError("Time claims must be integers")
+
+
+class Codec(object):
+
+    algorithm = None
+
+    def __init__(self, kid=None):
+        self.kid = kid
+        header = OrderedDict([("typ", "JWT"), ("alg", self.algorithm)])
+        if kid is not None:
+            header["kid"] = kid
+        self.header_segment = json_segment(header)
+
+    def encode(self, claims):
+        signing_input = self.header_segment + b'.' + json_segment(claims)
+        signature = base64url_encode(self.sign(signing_input))
+        return (signing_input + b'.' + signature).decode('ascii')
+
+    def decode(self, token, verify_claims=True, leeway=0):
+        return verify_token(self, split_token(token), verify_claims, leeway)
+
+
+class HS256Codec(Codec):
+
+    algorithm = "HS256"
+
+    def __init__(self, secret, kid=None):
+        super(HS256Codec, self).__init__(kid)
+        if not isinstance(secret, bytes):
+            secret = secret.encode('utf-8')
+        # The keyed HMAC state is computed once and copied for every token
+        self._hmac = hmac.new(secret, digestmod=hashlib.sha256)
+
+    def sign(self, signing_input):
+        mac = self._hmac.copy()
+        mac.update(signing_input)
+        return mac.digest()
+
+    def verify(self, signing_input, signature):
+        return hmac.compare_digest(self.sign(signing_input), signature)
+
+
+class AsymmetricCodec(Codec):
+
+    curve_size = 32
+
+    def __init__(self, private_key_pem, algorithm, kid=None):
+        # cryptography is only needed for RS256/ES256, so it is an optional
+        # dependency imported on first use
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import serialization
+        if algorithm not in ASYMMETRIC_ALGORITHMS:
+            raise ValueError("Unsupported algorithm: %s" % algorithm)
+        self.algorithm = algorithm
+        super(AsymmetricCodec, self).__init__(kid)
+        if not isinstance(private_key_pem, bytes):
+            private_key_pem = private_key_pem.encode('utf-8')
+        self.private_key = serialization.load_pem_private_key(
+            private_key_pem, password=None, backend=default_backend()
+        )
+        self.check_key_type()
+        self.public_key = self.private_key.public_key()
+
+    def check_key_type(self):
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        if self.algorithm == "RS256":
+            if not isinstance(self.private_key, rsa.RSAPrivateKey):
+                raise ValueError("RS256 needs an RSA key (key id %s)"
+                                 % self.kid)
+            return
+        if not isinstance(self.private_key, ec.EllipticCurvePrivateKey) or \
+                self.private_key.curve.name != "secp256r1":
+            raise ValueError("ES256 needs a P-256 EC key (key id %s)"
+                             % self.kid)
+
+    def sign(self, signing_input):
+        from cryptography.hazmat.primitives import hashes
+        if self.algorithm == "RS256":
+            from cryptography.hazmat.primitives.asymmetric import padding
+            return self.private_key.sign(signing_input,
+                                         padding.PKCS1v15(),
+                                         hashes.SHA256())
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.hazmat.primitives.asymmetric import utils
+        der = self.private_key.sign(signing_input, ec.ECDSA(hashes.SHA256()))
+        r, s = utils.decode_dss_signature(der)
+        return int_to_bytes(r, self.curve_size) + \
+            int_to_bytes(s, self.curve_size)
+
+    def verify(self, signing_input, signature):
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes
+        try:
+            if self.algorithm == "RS256":
+                from cryptography.hazmat.primitives.asymmetric import padding
+                self.public_key.verify(signature, signing_input,
+                                       padding.PKCS1v15(), hashes.SHA256())
+                return True
+            from cryptography.hazmat.primitives.asymmetric import ec
+            from cryptography.hazmat.primitives.asymmetric import utils
+            if len(signature) != 2 * self.curve_size:
+                return False
+            der = utils.encode_dss_signature(
+                bytes_to_int(signature[:self.curve_size]),
+                bytes_to_int(signature[self.curve_size:])
+            )
+            self.public_key.verify(der, signing_input,
+                                   ec.ECDSA(hashes.SHA256()))
+            return True
+        except InvalidSignature:
+            return False
+
+    def jwk(self):
+        numbers = self.public_key.public_numbers()
+        if self.algorithm == "RS256":
+            jwk = OrderedDict([("kty", "RSA"),
+                               ("n", int_segment(numbers.n)),
+                               ("e", int_segment(numbers.e))])
+        else:
+            jwk = OrderedDict([("kty", "EC"),
+                               ("crv", "P-256"),
+                               ("x", int_segment(numbers.x, self.curve_size)),
+                               ("y", int_segment(numbers.y, self.curve_size))])  # NOQA
+        jwk.update([("alg", self.algorithm), ("use", "sig")])
+        if self.kid is not None:
+            jwk["kid"] = self.kid
+        return jwk
+
+
+ASYMMETRIC_ALGORITHMS = ("RS256", "ES256")
+
+
+def int_to_bytes(value, length=None):
+    if length is None:
+        length = max(1, (value.bit_length() + 7) // 8)
+    return binascii.unhexlify(('%0*x' % (2 * length, value)).encode('ascii'))
+
+
+def bytes_to_int(data):
+    return int(binascii.hexlify(data), 16)
+
+
+def int_segment(value, length=None):
+    return base64url_encode(int_to_bytes(value, length)).decode('ascii')
+
+
+def make_codec(algorithm, key, kid=None):
+    if algorithm == HS256Codec.algorithm:
+        return HS256Codec(key, kid)
+    return AsymmetricCodec(key, algorithm, kid)
+
+
+def verify_token(codec, parts, verify_claims=True, leeway=0):
+    header_segment, payload_segment, signing_input, signature = parts
+    if not codec.verify(signing_input, base64url_decode(signature)):
+        raise InvalidSignatureError("Signature verification failed")
+    claims = parse_segment(payload_segment)
+    if verify_claims:
+        validate_claims(claims, leeway)
+    return claims
+
+
+class Keyring(object):
+
+    def __init__(self, keys=None, active_kid=None, legacy_secret=None,
+                 algorithm=HS256Codec.algorithm):
+        self.codecs = dict((kid, make_codec(algorithm, key, kid))
+                           for kid, key in (keys or {}).items())
+        self.legacy = HS256Codec(legacy_secret) if legacy_secret else None
+        if active_kid is not None and active_kid not in self.codecs:
+            raise ValueError("Unknown active key id: %s" % active_kid)
+        if algorithm in ASYMMETRIC_ALGORITHMS and active_kid is None:
+            # The legacy secret can only verify older HS256 tokens
+            raise ValueError("%s needs signing keys and an active key id"
+                             % algorithm)
+        self.active = self.codecs[active_kid] if active_kid else self.legacy
+        if self.active is None:
+            raise ValueError("No signing key configured")
+        # Tokens we issued carry a byte-identical header segment, which
+        # selects the verification key without parsing any JSON
+        self.by_header = dict((codec.header_segment, codec)
+                              for codec in self.codecs.values())
+        if self.legacy is not None:
+            self.by_header[self.legacy.header_segment] = self.legacy
+        self.jwks = {"keys": [codec.jwk()
+                              for kid, codec in sorted(self.codecs.items())
+                              if codec.algorithm in ASYMMETRIC_ALGORITHMS]}
+
+    def encode(self, claims):
+        return self.active.encode(claims)
+
+    def decode(self, token, verify_claims=True, leeway=0):
+        parts = split_token(token)
+        codec = self.by_header.get(parts[0])
+        if codec is None:
+            codec = self.codec_for_header(parts[0])
+        return verify_token(codec, parts, verify_claims, leeway)
+
+    def codec_for_header(self, header_segment):
+        header = parse_segment(header_segment)
+        kid = header.get("kid")
+        codec = self.codecs.get(kid) if kid is not None else self.legacy
+        if codec is None:
+            raise InvalidSignatureError("Unknown key id")
+        if header.get("alg") != codec.algorithm:
+            raise DecodeError("Unsupported algorithm")
+        return codec
+
+
+_keyrings = {}
+_lock = threading.Lock()
+
+
+def get_keyring(keys=None, active_kid=None, legacy_secret=None,
+                algorithm=HS256Codec.algorithm):
+    cache_key = (tuple(sorted((keys or {}).items())), active_kid,
+                 legacy_secret, algorithm)
+    keyring = _keyrings.get(cache_key)
+    if keyring is None:
+        with _lock:
+            keyring = _keyrings.get(cache_key)
+            if keyring is None:
+                keyring = Keyring(keys, active_kid, legacy_secret,
+                                  algorithm)
+                _keyrings[cache_key] = keyring
+    return keyring
@@ -0,0 +1,72 @@
+import threading
+
+
+# Bearer token writes and batch validations get their own pools, so that a
+# large batch waiting on GitHub cannot hold up the writes logins wait for
+DEFAULT_POOL_SIZES = {
+    "persist": 8,
+    "validate": 8
+}
+
+_sizes = dict(DEFAULT_POOL_SIZES)
+_executors = {}
+# Work that has been submitted but has not finished yet, per pool
+_pending = dict((pool, set()) for pool in DEFAULT_POOL_SIZES)
+_lock = threading.Lock()
+
+
+def configure(**sizes):
+    replaced = []
+    with _lock:
+        for pool, size in sizes.items():
+            if size is None or size == _sizes[pool]:
+                continue
+            _sizes[pool] = size
+            replaced.append(_executors.pop(pool, None))
+    # Work already handed to a replaced pool still runs to completion
+    for executor in replaced:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def get_executor(pool):
+    executor = _executors.get(pool)
+    if executor is not None:
+        return executor
+    # Imported on first use, so that handlers which never submit anything do
+    # not pay for it on a cold start
+    from concurrent.futures import ThreadPoolExecutor
+    with _lock:
+        if pool not in _executors:
+            _executors[pool] = ThreadPoolExecutor(max_workers=_sizes[pool])
+        return _executors[pool]
+
+
+def submit(pool, fn, *args, **kwargs):
+    future = get_executor(pool).submit(fn, *args, **kwargs)
+    with _lock:
+        _pending[pool].add(future)
+    future.add_done_callback(lambda f: discard(pool, f))
+    return future
+
+
+def discard(pool, future):
+    with _lock:
+        _pending[pool].discard(future)
+
+
+def drain(pool):
+    with _lock:
+        futures = list(_pending[pool])
+    if not futures:
+        return
+    from concurrent.futures import wait
+    wait(futures)
+
+
+def shutdown(wait=True):
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
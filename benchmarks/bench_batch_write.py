@@ -0,0 +1,54 @@
+import sys
+import time
+from auth_backend import datastore
+from benchmarks.common import use_fake_aws_credentials
+from benchmarks.stubs import DynamoDBStub
+
+
+TABLE_NAME = "benchmark-auth"
+
+
+def items_for(count):
+    return [{"user_id": i, "bearer_token": "token-%d" % i}
+            for i in range(count)]
+
+
+def per_item(endpoint_url, items):
+    table = datastore.get_table(endpoint_url, TABLE_NAME)
+    for item in items:
+        table.put_item(Item=item)
+
+
+def buffered(endpoint_url, items):
+    buffer = datastore.WriteBuffer(endpoint_url, TABLE_NAME, max_age=60)
+    for item in items:
+        buffer.put(item)
+    buffer.flush()
+
+
+def throughput(fn, endpoint_url, items):
+    start = time.time()
+    fn(endpoint_url, items)
+    return len(items) / (time.time() - start)
+
+
+def main(count, latency):
+    use_fake_aws_credentials()
+    stub = DynamoDBStub(latency=latency).start()
+    try:
+        datastore.reset()
+        items = items_for(count)
+        before = throughput(per_item, stub.endpoint_url, items)
+        after = throughput(buffered, stub.endpoint_url, items)
+    finally:
+        stub.stop()
+    print("Bearer token writes (%d items, %.1fms stub latency)"
+          % (count, latency * 1000))
+    print("  put_item          %8.1f items/sec" % before)
+    print("  batch_write_item  %8.1f items/sec" % after)
+    print("  stub calls: %s" % stub.calls)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 0.002)
@@ -0,0 +1,89 @@
+import json
+import os
+import subprocess
+import sys
+from benchmarks.common import print_report
+from benchmarks.common import use_fake_aws_credentials
+from benchmarks.stubs import DynamoDBStub
+from benchmarks.stubs import GitHubStub
+
+
+TABLE_NAME = "benchmark-auth"
+
+# Runs in a fresh interpreter, like the first invocation of a new Lambda
+# container. "eager" imports everything up front, the way the entrypoint
+# used to before boto3, requests and the token machinery became lazy.
+CHILD = """
+import json
+import sys
+import time
+start = time.time()
+if sys.argv[1] == "eager":
+    import boto3
+    import requests
+    import auth_backend.jwt_authentication
+from auth_backend.entrypoint import handler
+imported = time.time()
+try:
+    handler(json.loads(sys.argv[2]), {})
+except TypeError:
+    pass
+finished = time.time()
+print(json.dumps({"import_ms": 1000 * (imported - start),
+                  "first_call_ms": 1000 * (finished - imported),
+                  "total_ms": 1000 * (finished - start)}))
+"""
+
+
+def make_event(resource_path, github, dynamodb):
+    return {
+        "resource-path": resource_path,
+        "payload": {"password": "code"},
+        "jwt_signing_secret": "benchmark",
+        "jwt_expiry_minutes": "10",
+        "oauth_client_id": "client",
+        "oauth_client_secret": "secret",
+        "auth_dynamodb_endpoint_url": dynamodb.endpoint_url,
+        "auth_dynamodb_table_name": TABLE_NAME,
+        "auth_desired_oauth_scopes": "user",
+        "github_url": github.url,
+        "github_api_url": github.url
+    }
+
+
+def cold_start(mode, event):
+    with open(os.devnull, "w") as devnull:
+        output = subprocess.check_output(
+            [sys.executable, "-c", CHILD, mode, json.dumps(event)],
+            env=dict(os.environ, PYTHONPATH=os.getcwd()),
+            stderr=devnull
+        )
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def average(runs):
+    return dict((key, sum(run[key] for run in runs) / len(runs))
+                for key in runs[0])
+
+
+def main(iterations):
+    use_fake_aws_credentials()
+    github = GitHubStub().start()
+    dynamodb = DynamoDBStub().start()
+    try:
+        for resource_path in ("/auth/ping", "/auth/token"):
+            event = make_event(resource_path, github, dynamodb)
+            results = [
+                (mode, average([cold_start(mode, event)
+                                for _ in range(iterations)]))
+                for mode in ("eager", "lazy")
+            ]
+            print_report("Cold start for %s (%d fresh interpreters)"
+                         % (resource_path, iterations), results)
+    finally:
+        github.stop()
+        dynamodb.stop()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,44 @@
+import sys
+import boto3
+from auth_backend import datastore
+from benchmarks.common import print_report
+from benchmarks.common import summarize
+from benchmarks.common import time_calls
+from benchmarks.common import use_fake_aws_credentials
+from benchmarks.stubs import DynamoDBStub
+
+
+TABLE_NAME = "benchmark-auth"
+
+
+def per_call_resource(endpoint_url):
+    def lookup():
+        dynamodb = boto3.resource('dynamodb', endpoint_url=endpoint_url)
+        table = dynamodb.Table(TABLE_NAME)
+        table.get_item(Key={"user_id": 1})
+    return lookup
+
+
+def shared_resource(endpoint_url):
+    def lookup():
+        table = datastore.get_table(endpoint_url, TABLE_NAME)
+        table.get_item(Key={"user_id": 1})
+    return lookup
+
+
+def main(iterations):
+    use_fake_aws_credentials()
+    stub = DynamoDBStub().start()
+    try:
+        datastore.reset()
+        results = [
+            ("before", summarize(time_calls(per_call_resource(stub.endpoint_url), iterations))),  # NOQA
+            ("after", summarize(time_calls(shared_resource(stub.endpoint_url), iterations)))  # NOQA
+        ]
+    finally:
+        stub.stop()
+    print_report("DynamoDB get_item latency (%d calls)" % iterations, results)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
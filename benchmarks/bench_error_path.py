@@ -0,0 +1,65 @@
+import json
+import logging
+import sys
+import time
+from auth_backend.entrypoint import handler
+
+
+BASE_EVENT = {
+    "jwt_signing_secret": "benchmark-secret",
+    "jwt_expiry_minutes": "10",
+    "oauth_client_id": "client",
+    "oauth_client_secret": "secret",
+    "auth_dynamodb_endpoint_url": "http://127.0.0.1:1",
+    "auth_dynamodb_table_name": "benchmark-auth",
+    "auth_desired_oauth_scopes": "user"
+}
+
+# Requests that are rejected without any upstream call, which is what most
+# of a credential-stuffing run looks like
+REQUESTS = [
+    ("bad-jwt", "/auth/refresh", {"token": "not.a.jwt"}),
+    ("no-code", "/auth/token", {}),
+    ("bad-path", "/auth/nope", {})
+]
+
+
+def raised(event):
+    # How server.py used to turn a Lambda error back into a response
+    try:
+        return handler(event, {})
+    except TypeError as e:
+        return json.loads(str(e))
+
+
+def returned(event):
+    return handler(event, {})
+
+
+def rate(fn, event, iterations):
+    start = time.time()
+    for _ in range(iterations):
+        fn(event)
+    return iterations / (time.time() - start)
+
+
+def main(iterations):
+    # Handler debug logging would dominate both sides of the comparison
+    logging.disable(logging.CRITICAL)
+    print("Error response throughput (responses/sec, %d iterations)"
+          % iterations)
+    print("  %-10s %12s %12s" % ("request", "raise", "return"))
+    for name, resource_path, payload in REQUESTS:
+        event = dict(BASE_EVENT, payload=payload)
+        event["resource-path"] = resource_path
+        return_event = dict(event, auth_error_mode="return")
+        assert raised(event) == returned(return_event)
+        print("  %-10s %12.0f %12.0f" % (
+            name,
+            rate(raised, event, iterations),
+            rate(returned, return_event, iterations)
+        ))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
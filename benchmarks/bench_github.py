@@ -0,0 +1,40 @@
+import sys
+import requests
+from auth_backend import github
+from benchmarks.common import print_report
+from benchmarks.common import summarize
+from benchmarks.common import time_calls
+from benchmarks.stubs import GitHubStub
+
+
+def bare_requests(url):
+    def validate():
+        requests.get(url, auth=("client", "secret"))
+    return validate
+
+
+def shared_session(url):
+    def validate():
+        github.get(url, "github.validate", auth=("client", "secret"))
+    return validate
+
+
+def main(iterations):
+    stub = GitHubStub().start()
+    url = "%s/applications/client/tokens/abc" % stub.url
+    try:
+        github.reset()
+        results = [
+            ("before", summarize(time_calls(bare_requests(url), iterations))),
+            ("after", summarize(time_calls(shared_session(url), iterations)))
+        ]
+    finally:
+        stub.stop()
+    print_report("GitHub token validation latency (%d calls)" % iterations,
+                 results)
+    print("  connections opened by the shared session: %(connections)s "
+          "for %(requests)s requests" % github.connection_stats())
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,57 @@
+import sys
+import time
+import jwt
+from auth_backend import tokens
+
+
+SECRET = "benchmark-secret"
+
+PAYLOADS = [
+    ("small", {"sub": 1234}),
+    ("login", {"sub": 1234,
+               "github_login": "octocat",
+               "github_token": "0123456789abcdef0123456789abcdef01234567"}),
+    ("large", {"sub": 1234,
+               "github_login": "octocat",
+               "github_token": "0123456789abcdef0123456789abcdef01234567",
+               "padding": "x" * 2048})
+]
+
+
+def claims_for(payload):
+    now = int(time.time())
+    claims = dict(payload)
+    claims.update({"iat": now, "exp": now + 600})
+    return claims
+
+
+def rate(fn, iterations):
+    start = time.time()
+    for _ in range(iterations):
+        fn()
+    return iterations / (time.time() - start)
+
+
+def main(iterations):
+    keyring = tokens.get_keyring(legacy_secret=SECRET)
+    print("JWT encode/decode throughput (tokens/sec, %d iterations)"
+          % iterations)
+    print("  %-6s %12s %12s %12s %12s" % ("size", "pyjwt enc",
+                                          "keyring enc", "pyjwt dec",
+                                          "keyring dec"))
+    for name, payload in PAYLOADS:
+        claims = claims_for(payload)
+        token = keyring.encode(claims)
+        results = (
+            rate(lambda: jwt.encode(claims, SECRET, algorithm='HS256'),
+                 iterations),
+            rate(lambda: keyring.encode(claims), iterations),
+            rate(lambda: jwt.decode(token, SECRET, algorithms=['HS256']),
+                 iterations),
+            rate(lambda: keyring.decode(token), iterations)
+        )
+        print("  %-6s %12.0f %12.0f %12.0f %12.0f" % ((name,) + results))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
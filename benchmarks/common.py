@@ -0,0 +1,40 @@
+import os
+import time
+
+
+def use_fake_aws_credentials():
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = int(round((pct / 100.0) * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summarize(samples):
+    return {
+        "calls": len(samples),
+        "mean_ms": 1000.0 * sum(samples) / len(samples),
+        "p50_ms": 1000.0 * percentile(samples, 50),
+        "p99_ms": 1000.0 * percentile(samples, 99)
+    }
+
+
+def time_calls(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.time()
+        fn()
+        samples.append(time.time() - start)
+    return samples
+
+
+def print_report(title, results):
+    print(title)
+    for name, stats in results:
+        print("  %-10s %s" % (name, ", ".join(
+            "%s=%.3f" % (k, v) if isinstance(v, float) else "%s=%s" % (k, v)
+            for k, v in sorted(stats.items()))))
@@ -0,0 +1,77 @@
+import json
+import logging
+import sys
+import threading
+import time
+import server
+from benchmarks.common import use_fake_aws_credentials
+from benchmarks.stubs import DynamoDBStub
+from benchmarks.stubs import GitHubStub
+from benchmarks.traffic import HTTPClient
+from benchmarks.traffic import MIXES
+from benchmarks.traffic import drive
+
+
+TABLE_NAME = "benchmark-auth"
+
+
+def server_config(github, dynamodb, workers):
+    return server.load_config({
+        "OAUTH_CLIENT_ID": "client",
+        "OAUTH_CLIENT_SECRET": "secret",
+        "DYNAMODB_ENDPOINT_URL": dynamodb.endpoint_url,
+        "DYNAMODB_TABLE_NAME": TABLE_NAME,
+        "DESIRED_OAUTH_SCOPES": "user",
+        "GITHUB_URL": github.url,
+        "GITHUB_API_URL": github.url,
+        "SERVER_WORKERS": str(workers)
+    })
+
+
+def serve(config, clients, duration, mix, keepalive=True):
+    httpd = server.make_server("127.0.0.1", 0, config, quiet=True)
+    threading.Thread(target=httpd.serve_forever).start()
+    base_url = "http://127.0.0.1:%s" % httpd.server_address[1]
+    try:
+        deadline = time.time() + duration
+        return drive([HTTPClient(base_url, keepalive, deadline, seed, mix)
+                      for seed in range(clients)], duration)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def run_load(workers, clients, duration, github_latency, dynamodb_latency,
+             keepalive=True, mix=MIXES["steady"]):
+    use_fake_aws_credentials()
+    logging.getLogger("auth_backend").setLevel(logging.WARNING)
+    github = GitHubStub(latency=github_latency).start()
+    dynamodb = DynamoDBStub(latency=dynamodb_latency).start()
+    try:
+        stats = serve(server_config(github, dynamodb, workers), clients,
+                      duration, mix, keepalive)
+    finally:
+        github.stop()
+        dynamodb.stop()
+    stats.update({
+        "workers": workers,
+        "clients": clients,
+        "keepalive": keepalive,
+        "github_calls": github.calls,
+        "dynamodb_calls": dynamodb.calls
+    })
+    return stats
+
+
+def main(duration):
+    # A single worker without keep-alive approximates the old server
+    for workers, keepalive in ((1, False), (16, True)):
+        print(json.dumps(run_load(workers, clients=16, duration=duration,
+                                  github_latency=0.02,
+                                  dynamodb_latency=0.005,
+                                  keepalive=keepalive),
+                         sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 5)
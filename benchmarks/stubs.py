@@ -0,0 +1,198 @@
+import json
+import random
+import socket
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class DynamoDBStubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        request = json.loads(self.rfile.read(length).decode('utf-8'))
+        operation = self.headers['X-Amz-Target'].split('.')[-1]
+        method = getattr(self.server.stub, operation, None)
+        if method is None:
+            self.send_json(400, {"__type": "UnknownOperationException"})
+            return
+        if self.server.stub.record(operation):
+            self.send_json(500, {"__type": "InternalServerError",
+                                 "message": "Injected error"})
+            return
+        self.send_json(200, method(request))
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-amz-json-1.0")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Stub(object):
+
+    handler_class = None
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, error_rate=0,
+                 seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = {}
+        self.errors = {}
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.httpd = ThreadedHTTPServer((host, port), self.handler_class)
+        self.httpd.stub = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://%s:%s" % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def record(self, operation):
+        # Counts the call, waits out the simulated latency and decides
+        # whether this call should fail
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            failed = self.rng.random() < self.error_rate
+            if failed:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        return failed
+
+    def stats(self):
+        with self._lock:
+            return {"calls": dict(self.calls), "errors": dict(self.errors)}
+
+
+class DynamoDBStub(Stub):
+
+    handler_class = DynamoDBStubHandler
+
+    def __init__(self, *args, **kwargs):
+        super(DynamoDBStub, self).__init__(*args, **kwargs)
+        self.items = {}
+
+    @property
+    def endpoint_url(self):
+        return self.url
+
+    def key_for(self, table_name, key):
+        return (table_name, json.dumps(key, sort_keys=True))
+
+    def GetItem(self, request):
+        item = self.items.get(self.key_for(request['TableName'],
+                                           request['Key']))
+        return {"Item": item} if item else {}
+
+    def PutItem(self, request):
+        item = request['Item']
+        key = {"user_id": item['user_id']}
+        self.items[self.key_for(request['TableName'], key)] = item
+        return {}
+
+    def BatchGetItem(self, request):
+        responses = {}
+        for table_name, spec in request['RequestItems'].items():
+            found = [self.items.get(self.key_for(table_name, key))
+                     for key in spec['Keys']]
+            responses[table_name] = [item for item in found if item]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    def BatchWriteItem(self, request):
+        for table_name, writes in request['RequestItems'].items():
+            for write in writes:
+                item = write['PutRequest']['Item']
+                key = {"user_id": item['user_id']}
+                self.items[self.key_for(table_name, key)] = item
+        return {"UnprocessedItems": {}}
+
+
+class GitHubStubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        status, body = self.server.stub.handle("POST", self.path)
+        self.send_json(status, body)
+
+    def do_GET(self):
+        status, body = self.server.stub.handle("GET", self.path)
+        self.send_json(status, body)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GitHubStub(Stub):
+
+    handler_class = GitHubStubHandler
+
+    def __init__(self, host="127.0.0.1", port=0, scopes="user,org",
+                 **kwargs):
+        super(GitHubStub, self).__init__(host, port, **kwargs)
+        self.scopes = scopes
+
+    def handle(self, method, path):
+        path = path.split('?')[0]
+        if method == "POST" and path == "/login/oauth/access_token":
+            if self.record("exchange"):
+                return 503, {"message": "Injected error"}
+            # Every exchange hands out a different bearer token, like it
+            # would for different users
+            return 200, {"access_token": "token-%d" % self.calls["exchange"],
+                         "scope": self.scopes}
+        if method == "GET" and "/tokens/" in path:
+            if self.record("validate"):
+                return 503, {"message": "Injected error"}
+            token = path.rsplit('/', 1)[-1]
+            return 200, {"user": {"id": abs(hash(token)) % 100000,
+                                  "login": "user-%s" % token}}
+        return 404, {"message": "Not Found"}
@@ -0,0 +1,174 @@
+import argparse
+import json
+import platform
+import sys
+import time
+from auth_backend import breaker
+from auth_backend import jwt_authentication
+from auth_backend import metrics
+from auth_backend.entrypoint import __version__
+from benchmarks import load_test
+from benchmarks.common import use_fake_aws_credentials
+from benchmarks.stubs import DynamoDBStub
+from benchmarks.stubs import GitHubStub
+from benchmarks.traffic import HandlerClient
+from benchmarks.traffic import MIXES
+from benchmarks.traffic import drive
+
+
+SCENARIOS = {
+    "steady": {"mix": "steady"},
+    "login-storm": {"mix": "login-storm"},
+    "ping": {"mix": "ping"},
+    "flaky-upstream": {"mix": "steady", "error_rate": 0.05},
+    "github-outage": {"mix": "steady", "github_error_rate": 1.0}
+}
+TARGETS = ("handler", "server")
+DEFAULT_SCENARIOS = ("steady", "login-storm", "ping", "flaky-upstream",
+                     "github-outage")
+DEFAULT_GITHUB_LATENCY = 0.02
+DEFAULT_DYNAMODB_LATENCY = 0.005
+DEFAULT_TOLERANCE = 0.1
+
+# Compared against a baseline report; the sign says which way is worse
+COMPARED = (("ops_per_sec", -1), ("p95_ms", 1), ("upstream_per_request", 1))
+
+
+def reset_state():
+    # Stand-ins start over for every run, so nothing cached by the previous
+    # run may answer for them
+    for cache in (jwt_authentication.validation_cache,
+                  jwt_authentication.bearer_token_cache,
+                  jwt_authentication.rejected_code_cache,
+                  jwt_authentication.degraded_validation_cache):
+        cache.clear()
+    breaker.reset()
+    metrics.reset()
+
+
+def server_config(github, dynamodb, clients):
+    config = load_test.server_config(github, dynamodb, clients)
+    # The handler sets the log level on every call, so injected errors
+    # would otherwise be logged at INFO in the middle of the run
+    config["base_event"]["auth_log_level"] = "WARNING"
+    return config
+
+
+def run_handler(github, dynamodb, clients, duration, mix):
+    base_event = server_config(github, dynamodb, clients)["base_event"]
+    deadline = time.time() + duration
+    return drive([HandlerClient(base_event, deadline, seed, mix)
+                  for seed in range(clients)], duration)
+
+
+def run_server(github, dynamodb, clients, duration, mix):
+    config = server_config(github, dynamodb, clients)
+    return load_test.serve(config, clients, duration, mix)
+
+
+def run_scenario(name, target, options):
+    scenario = SCENARIOS[name]
+    error_rate = scenario.get("error_rate", 0)
+    github = GitHubStub(latency=options.github_latency,
+                        error_rate=scenario.get("github_error_rate",
+                                                error_rate),
+                        seed=1).start()
+    dynamodb = DynamoDBStub(latency=options.dynamodb_latency,
+                            error_rate=error_rate, seed=2).start()
+    reset_state()
+    run = run_handler if target == "handler" else run_server
+    try:
+        stats = run(github, dynamodb, options.clients, options.duration,
+                    MIXES[scenario["mix"]])
+    finally:
+        github.stop()
+        dynamodb.stop()
+
+    upstream = {"github": github.stats(), "dynamodb": dynamodb.stats()}
+    upstream_calls = sum(sum(service["calls"].values())
+                         for service in upstream.values())
+    stats.update({
+        "scenario": name,
+        "target": target,
+        "error_rate": error_rate,
+        "upstream": upstream,
+        "upstream_per_request": upstream_calls / float(stats["requests"] or 1)
+    })
+    return stats
+
+
+def compare(report, baseline, tolerance):
+    previous = dict(((result["scenario"], result["target"]), result)
+                    for result in baseline["results"])
+    regressions = []
+    for result in report["results"]:
+        before = previous.get((result["scenario"], result["target"]))
+        if before is None:
+            continue
+        for field, worse in COMPARED:
+            old, new = before.get(field), result.get(field)
+            if not old or new is None:
+                continue
+            change = (new - old) / float(old)
+            if change * worse > tolerance:
+                regressions.append("%s/%s %s: %.2f -> %.2f (%+.0f%%)" % (
+                    result["scenario"], result["target"], field, old, new,
+                    100 * change))
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Drive the handler and the local server against local "
+                    "GitHub and DynamoDB stand-ins and report as JSON")
+    parser.add_argument("--scenario", action="append",
+                        choices=sorted(SCENARIOS))
+    parser.add_argument("--target", action="append", choices=TARGETS)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--github-latency", type=float,
+                        default=DEFAULT_GITHUB_LATENCY)
+    parser.add_argument("--dynamodb-latency", type=float,
+                        default=DEFAULT_DYNAMODB_LATENCY)
+    parser.add_argument("--output", help="write the report to this file")
+    parser.add_argument("--baseline",
+                        help="report of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    options = parse_args(argv)
+    use_fake_aws_credentials()
+
+    report = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "settings": {
+            "duration": options.duration,
+            "clients": options.clients,
+            "github_latency": options.github_latency,
+            "dynamodb_latency": options.dynamodb_latency
+        },
+        "results": [run_scenario(name, target, options)
+                    for name in options.scenario or DEFAULT_SCENARIOS
+                    for target in options.target or TARGETS]
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare(report, json.load(f), options.tolerance)
+        for regression in regressions:
+            sys.stderr.write("Regression: %s\n" % regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,147 @@
+import json
+import random
+import threading
+import time
+import requests
+from auth_backend.entrypoint import handler
+from benchmarks.common import percentile
+
+
+# Share of each kind of request in a run
+MIXES = {
+    "steady": [("token", 0.1), ("refresh", 0.8), ("ping", 0.1)],
+    "login-storm": [("token", 0.7), ("refresh", 0.2), ("ping", 0.1)],
+    "ping": [("ping", 1.0)]
+}
+
+
+def pick_operation(rng, mix):
+    roll = rng.random()
+    for name, weight in mix:
+        roll -= weight
+        if roll < 0:
+            return name
+    return mix[-1][0]
+
+
+class Client(threading.Thread):
+
+    def __init__(self, deadline, seed, mix):
+        threading.Thread.__init__(self)
+        self.deadline = deadline
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.mix = mix
+        self.token = None
+        self.logins = 0
+        self.latencies = {}
+        self.errors = {}
+
+    def send(self, resource_path, payload):
+        raise NotImplementedError
+
+    def request(self, resource_path, payload):
+        # A request that raises, e.g. a refused connection, counts as an
+        # error for its operation instead of ending this client
+        try:
+            return self.send(resource_path, payload)
+        except Exception:
+            return None, {}
+
+    def call(self, operation):
+        if operation == "ping":
+            return operation, self.request("/auth/ping", None)[0]
+        if operation == "token" or self.token is None:
+            # Every login brings a new access code, as it would from GitHub
+            self.logins += 1
+            status, data = self.request("/auth/token", {
+                "password": "code-%d-%d" % (self.seed, self.logins)
+            })
+            operation = "token"
+        else:
+            status, data = self.request("/auth/refresh",
+                                        {"token": self.token})
+        if status == 200:
+            self.token = data.get('token')
+        return operation, status
+
+    def run(self):
+        while time.time() < self.deadline:
+            start = time.time()
+            operation, status = self.call(pick_operation(self.rng, self.mix))
+            self.latencies.setdefault(operation, []).append(
+                time.time() - start)
+            if status != 200:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+
+class HandlerClient(Client):
+
+    def __init__(self, base_event, *args):
+        Client.__init__(self, *args)
+        self.base_event = base_event
+
+    def send(self, resource_path, payload):
+        event = dict(self.base_event, payload=payload or {})
+        event["resource-path"] = resource_path
+        event["source-ip"] = "10.0.0.%d" % self.seed
+        response = handler(event, {})
+        return response.get('http_status'), response.get('data') or {}
+
+
+class HTTPClient(Client):
+
+    def __init__(self, base_url, keepalive, *args):
+        Client.__init__(self, *args)
+        self.base_url = base_url
+        self.session = requests.Session()
+        if not keepalive:
+            # Every request opens a new connection, which is what the old
+            # single-threaded HTTP/1.0 server forced on clients
+            self.session.headers["Connection"] = "close"
+
+    def send(self, resource_path, payload):
+        url = self.base_url + resource_path
+        if payload is None:
+            r = self.session.get(url)
+        else:
+            r = self.session.post(url, data=json.dumps(payload))
+        return r.status_code, r.json() if r.status_code == 200 else {}
+
+
+def latency_stats(latencies, errors, duration):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "ops_per_sec": len(latencies) / float(duration),
+        "p50_ms": 1000 * percentile(latencies, 50) if latencies else None,
+        "p95_ms": 1000 * percentile(latencies, 95) if latencies else None,
+        "p99_ms": 1000 * percentile(latencies, 99) if latencies else None
+    }
+
+
+def drive(clients, duration):
+    start = time.time()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    duration = max(duration, time.time() - start)
+
+    operations = {}
+    for name in set(name for client in clients for name in client.latencies):
+        operations[name] = latency_stats(
+            [latency for client in clients
+             for latency in client.latencies.get(name, [])],
+            sum(client.errors.get(name, 0) for client in clients),
+            duration
+        )
+    stats = latency_stats(
+        [latency for client in clients
+         for latencies in client.latencies.values()
+         for latency in latencies],
+        sum(sum(client.errors.values()) for client in clients),
+        duration
+    )
+    stats["operations"] = operations
+    return stats
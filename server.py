@@ -1,79 +1,253 @@
-import BaseHTTPServer
 import sys
 import time
 import json
 import os
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from auth_backend import datastore
+from auth_backend import metrics
+from auth_backend import prerefresh
 from auth_backend.entrypoint import handler
 
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # pragma: no cover
+    from http.server import BaseHTTPRequestHandler, HTTPServer
 
-HOST_NAME = sys.argv[1]
-PORT_NUMBER = int(sys.argv[2])
 
+DEFAULT_WORKERS = 16
+DEFAULT_MAX_BODY_BYTES = 64 * 1024
+DEFAULT_KEEPALIVE_TIMEOUT = 30
 
-class LocalAuthenticationBackend(BaseHTTPServer.BaseHTTPRequestHandler):
 
-    server_version = "LocalAuthBackend/0.1"
+def load_prerefresh_config(environ):
+    workers = int(environ.get('SERVER_PREREFRESH_WORKERS', 0))
+    if workers <= 0:
+        return None
+    settings = {"workers": workers}
+    for name, key in [("SERVER_PREREFRESH_BUDGET", "budget"),
+                      ("SERVER_PREREFRESH_LEAD_TIME", "lead_time"),
+                      ("SERVER_PREREFRESH_JITTER", "jitter")]:
+        if name in environ:
+            settings[key] = float(environ[name])
+    return settings
+
+
+def load_config(environ):
+    base_event = {
+        "jwt_signing_secret": environ.get('JWT_SIGNING_SECRET', "supersekr3t"),  # NOQA
+        "jwt_expiry_minutes": environ.get('JWT_EXPIRY_MINUTES', "10"),
+        "oauth_client_id": environ['OAUTH_CLIENT_ID'],
+        "oauth_client_secret": environ['OAUTH_CLIENT_SECRET'],
+        "auth_dynamodb_endpoint_url": environ['DYNAMODB_ENDPOINT_URL'],
+        "auth_dynamodb_table_name": environ['DYNAMODB_TABLE_NAME'],
+        "auth_desired_oauth_scopes": environ['DESIRED_OAUTH_SCOPES']
+    }
+    # Errors come back as response dicts instead of the TypeError the
+    # Lambda integration needs, which saves an exception and a JSON round
+    # trip on every 4xx
+    base_event["auth_error_mode"] = "return"
+    for name, key in [("GITHUB_URL", "github_url"),
+                      ("GITHUB_API_URL", "github_api_url"),
+                      ("AUTH_PERSIST_MODE", "auth_persist_mode"),
+                      ("AUTH_RATE_LIMIT", "auth_rate_limit"),
+                      ("AUTH_RATE_LIMIT_BURST", "auth_rate_limit_burst"),
+                      ("LOG_LEVEL", "auth_log_level")]:
+        if name in environ:
+            base_event[key] = environ[name]
+    workers = int(environ.get('SERVER_WORKERS', DEFAULT_WORKERS))
+    # An idle keep-alive connection holds a worker until it times out, so
+    # some workers are always left for new connections
+    max_keepalive = min(int(environ.get('SERVER_MAX_KEEPALIVE',
+                                        workers // 2)),
+                        workers - 1)
+    # Every worker may hold an upstream connection at the same time
+    base_event["github_pool_size"] = workers
+    base_event["auth_dynamodb_max_pool_connections"] = workers
+    return {
+        "base_event": base_event,
+        "workers": workers,
+        "max_keepalive": max(0, max_keepalive),
+        "max_body_bytes": int(environ.get('SERVER_MAX_BODY_BYTES',
+                                          DEFAULT_MAX_BODY_BYTES)),
+        "keepalive_timeout": float(environ.get('SERVER_KEEPALIVE_TIMEOUT',
+                                               DEFAULT_KEEPALIVE_TIMEOUT)),
+        "prerefresh": load_prerefresh_config(environ)
+    }
+
+
+class LocalAuthenticationBackend(BaseHTTPRequestHandler):
+
+    server_version = "LocalAuthBackend/0.2"
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        self.timeout = self.server.config["keepalive_timeout"]
+        self.keepalive_slot = False
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def finish(self):
+        try:
+            BaseHTTPRequestHandler.finish(self)
+        finally:
+            if self.keepalive_slot:
+                self.server.keepalive_slots.release()
 
     def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-        self.end_headers()
+        self.send_json(200, None)
 
     def do_GET(self):
-        status, result = handle_request({}, self.headers, self.path)
-        self.send_response(status)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
-        self.send_header("Content-type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps(result))
+        if self.path == "/auth/metrics":
+            # Only the local server exposes this, since counters are per
+            # process rather than per Lambda invocation
+            self.send_json(200, metrics.snapshot())
+            return
+        self.respond({})
 
     def do_POST(self):
-        length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(length)
-        payload = json.loads(post_data)
-        status, result = handle_request(payload, self.headers, self.path)
+        length = self.headers.get('Content-Length')
+        if length is None or not length.isdigit():
+            self.send_json(411, {"error": "Content-Length required"})
+            return
+        if int(length) > self.server.config["max_body_bytes"]:
+            self.close_connection = True
+            self.send_json(413, {"error": "Request body too large"})
+            return
+        post_data = self.rfile.read(int(length))
+        try:
+            payload = json.loads(post_data.decode('utf-8'))
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            self.send_json(400, {"error": "Request body must be a JSON "
+                                          "object"})
+            return
+        self.respond(payload)
+
+    def respond(self, payload):
+        status, result, headers = handle_request(
+            self.server.config["base_event"], payload, self.path,
+            self.client_address[0]
+        )
+        self.send_json(status, result, headers)
+
+    def send_json(self, status, result, headers=None):
+        body = b"" if result is None else json.dumps(result).encode('utf-8')
+        if not self.close_connection and not self.keepalive_slot:
+            self.keepalive_slot = self.server.keepalive_slots.acquire(False)
+            self.close_connection = not self.keepalive_slot
         self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header("Access-Control-Allow-Headers", "Content-Type")
         self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
         self.end_headers()
-        self.wfile.write(json.dumps(result))
-
-
-def handle_request(payload, headers, resource_path):
-    event = {
-        "resource-path": resource_path,
-        "payload": payload,
-        "jwt_signing_secret": "supersekr3t",
-        "jwt_expiry_minutes": "10",
-        "oauth_client_id": os.environ['OAUTH_CLIENT_ID'],
-        "oauth_client_secret": os.environ['OAUTH_CLIENT_SECRET'],
-        "auth_dynamodb_endpoint_url": os.environ['DYNAMODB_ENDPOINT_URL'],
-        "auth_dynamodb_table_name": os.environ['DYNAMODB_TABLE_NAME'],
-        "auth_desired_oauth_scopes": os.environ['DESIRED_OAUTH_SCOPES']
-    }
-    try:
-        response_payload = handler(event, {})
-        return transform_response(response_payload)
-    except TypeError as e:
-        return transform_response(json.loads(str(e)))
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class PooledHTTPServer(HTTPServer):
+
+    # Connections held back by max_pending queue here, so the backlog has to
+    # be deeper than TCPServer's default of 5
+    request_queue_size = socket.SOMAXCONN
+
+    def __init__(self, server_address, config, quiet=False):
+        HTTPServer.__init__(self, server_address, LocalAuthenticationBackend)
+        self.config = config
+        self.quiet = quiet
+        self.executor = ThreadPoolExecutor(max_workers=config["workers"])
+        self.keepalive_slots = threading.Semaphore(config["max_keepalive"])
+        # Connections beyond these wait in the listen backlog rather than in
+        # the executor's unbounded queue
+        self.max_pending = 2 * config["workers"]
+        self.connections = set()
+        self.connections_lock = threading.Condition()
+
+    def process_request(self, request, client_address):
+        with self.connections_lock:
+            while len(self.connections) >= self.max_pending:
+                self.connections_lock.wait()
+            self.connections.add(request)
+        self.executor.submit(self.process_request_worker,
+                             request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.connections_lock:
+                self.connections.discard(request)
+                self.connections_lock.notify()
+            self.shutdown_request(request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        # Requests that are being handled still get their response, but idle
+        # keep-alive connections see EOF instead of waiting for a timeout
+        with self.connections_lock:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RD)
+                except socket.error:
+                    pass
+        self.executor.shutdown(wait=True)
+        prerefresh.stop()
+
+
+def handle_request(base_event, payload, resource_path, source_ip=None):
+    event = dict(base_event)
+    event["resource-path"] = resource_path
+    event["payload"] = payload
+    event["source-ip"] = source_ip
+    return transform_response(handler(event, {}))
 
 
 def transform_response(response_payload):
     status = response_payload['http_status']
     data = response_payload['data']
-    return (status, data)
+    headers = response_payload.get('headers', {})
+    return (status, data, headers)
 
 
-if __name__ == '__main__':
-    server_class = BaseHTTPServer.HTTPServer
-    httpd = server_class((HOST_NAME, PORT_NUMBER), LocalAuthenticationBackend)
-    print(time.asctime(), "Server Starts - %s:%s" % (HOST_NAME, PORT_NUMBER))
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        pass
+def make_server(host, port, config, quiet=False):
+    datastore.start_background_flush()
+    if config.get("prerefresh"):
+        prerefresh.start(**config["prerefresh"])
+    return PooledHTTPServer((host, port), config, quiet=quiet)
+
+
+def install_shutdown_handlers(httpd):
+    def shutdown(signum, frame):
+        # shutdown() blocks until serve_forever() returns, so it cannot run
+        # on the thread that is serving
+        threading.Thread(target=httpd.shutdown).start()
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+
+def main(host, port):
+    httpd = make_server(host, port, load_config(os.environ))
+    install_shutdown_handlers(httpd)
+    print(time.asctime(), "Server Starts - %s:%s (%d workers)"
+          % (host, port, httpd.config["workers"]))
+    httpd.serve_forever()
     httpd.server_close()
-    print(time.asctime(), "Server Stops - %s:%s" % (HOST_NAME, PORT_NUMBER))
+    datastore.stop_background_flush()
+    print(time.asctime(), "Server Stops - %s:%s" % (host, port))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], int(sys.argv[2]))
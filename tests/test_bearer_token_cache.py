@@ -0,0 +1,283 @@
+import unittest
+import jwt
+import threading
+import time
+from decimal import Decimal
+from botocore.exceptions import ClientError
+from cryptography.fernet import Fernet
+from mock import patch
+from mock import MagicMock
+from auth_backend import jwt_authentication
+from auth_backend import metrics
+from auth_backend.cache import CacheBackend
+from auth_backend.jwt_authentication import JWTAuthentication
+from auth_backend.records import RecordCodec
+
+
+class DictCache(CacheBackend):
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value, ttl=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class TestBearerTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        patcher1 = patch('auth_backend.jwt_authentication.github')
+        self.addCleanup(patcher1.stop)
+        patcher1.start()
+
+        patcher2 = patch('auth_backend.jwt_authentication.bearer_token_cache',
+                         jwt_authentication.TTLCache())
+        self.addCleanup(patcher2.stop)
+        patcher2.start()
+
+        self.lambda_event = {
+            "payload": {},
+            "auth_dynamodb_endpoint_url": "http://example.com",
+            "auth_dynamodb_table_name": "faker"
+        }
+        self.auth = JWTAuthentication.from_event(self.lambda_event)
+        self.auth.fetch_bearer_token = MagicMock()
+        self.auth.fetch_bearer_token.return_value = "suchtoken"
+        self.auth.persist_bearer_token = MagicMock()
+        self.auth.persist_bearer_token.return_value = True
+
+    def test_lookup_is_read_through(self):
+        self.assertEqual(self.auth.lookup_bearer_token("u1"), "suchtoken")
+        self.assertEqual(self.auth.lookup_bearer_token("u1"), "suchtoken")
+        self.assertEqual(self.auth.fetch_bearer_token.call_count, 1)
+
+    def test_missing_token_is_not_cached(self):
+        self.auth.fetch_bearer_token.return_value = None
+        self.assertEqual(self.auth.lookup_bearer_token("u1"), None)
+        self.assertEqual(self.auth.lookup_bearer_token("u1"), None)
+        self.assertEqual(self.auth.fetch_bearer_token.call_count, 2)
+
+    def test_store_writes_through(self):
+        self.auth.lookup_bearer_token("u1")
+        self.assertTrue(self.auth.store_bearer_token("u1", "newtoken"))
+        self.assertEqual(self.auth.lookup_bearer_token("u1"), "newtoken")
+        self.assertEqual(self.auth.fetch_bearer_token.call_count, 1)
+
+    def test_failed_store_invalidates(self):
+        self.auth.lookup_bearer_token("u1")
+        self.auth.persist_bearer_token.return_value = False
+        self.assertFalse(self.auth.store_bearer_token("u1", "newtoken"))
+        self.auth.lookup_bearer_token("u1")
+        self.assertEqual(self.auth.fetch_bearer_token.call_count, 2)
+
+    def test_concurrent_lookups_coalesced(self):
+        release = threading.Event()
+
+        def slow_fetch(user_id):
+            release.wait(5)
+            return "suchtoken"
+        self.auth.fetch_bearer_token.side_effect = slow_fetch
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.auth.lookup_bearer_token("u1"))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while self.auth.fetch_bearer_token.call_count == 0:
+            release.wait(0.001)
+        release.wait(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["suchtoken"] * 4)
+        self.assertEqual(self.auth.fetch_bearer_token.call_count, 1)
+
+    def test_shared_backend(self):
+        shared = DictCache()
+        jwt_authentication.use_shared_bearer_token_cache(shared)
+        self.auth.store_bearer_token("u1", "newtoken")
+        self.assertEqual(shared.get(("faker", "u1")), "newtoken")
+
+        jwt_authentication.use_shared_bearer_token_cache(shared)
+        self.assertEqual(self.auth.lookup_bearer_token("u1"), "newtoken")
+        self.assertEqual(self.auth.fetch_bearer_token.call_count, 0)
+
+    @patch('auth_backend.jwt_authentication.datastore')
+    def test_buffered_store(self, mock_datastore):
+        self.lambda_event['auth_persist_mode'] = "buffered"
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        auth.persist_bearer_token = MagicMock()
+        auth.fetch_bearer_token = MagicMock()
+        self.assertTrue(auth.store_bearer_token("u1", "newtoken"))
+        buffer = mock_datastore.get_write_buffer.return_value
+        buffer.put.assert_called_once_with({"user_id": "u1",
+                                            "bearer_token": "newtoken"})
+        self.assertEqual(auth.persist_bearer_token.call_count, 0)
+        self.assertEqual(auth.lookup_bearer_token("u1"), "newtoken")
+
+    def test_failed_buffered_write_invalidates(self):
+        self.auth.store_bearer_token("u1", "newtoken")
+        jwt_authentication.invalidate_bearer_tokens("faker")([
+            {"user_id": "u1", "bearer_token": "newtoken"}
+        ])
+        self.auth.lookup_bearer_token("u1")
+        self.assertEqual(self.auth.fetch_bearer_token.call_count, 1)
+
+
+class TestBearerTokenRecords(unittest.TestCase):
+
+    def setUp(self):
+        patcher1 = patch('auth_backend.jwt_authentication.github')
+        self.addCleanup(patcher1.stop)
+        self.mock_github = patcher1.start()
+
+        patcher2 = patch('auth_backend.datastore.get_table')
+        self.addCleanup(patcher2.stop)
+        self.mock_table = patcher2.start().return_value
+
+        jwt_authentication.validation_cache.clear()
+        self.addCleanup(jwt_authentication.validation_cache.clear)
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+        self.lambda_event = {
+            "payload": {},
+            "oauth_client_id": "c123",
+            "auth_dynamodb_endpoint_url": "http://example.com",
+            "auth_dynamodb_table_name": "faker",
+            "auth_bearer_token_record": "compact"
+        }
+
+    def stored_item(self):
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        self.assertTrue(auth.persist_bearer_token(123, "suchtoken", "bob"))
+        return self.mock_table.put_item.call_args[1]
+
+    def test_compact_record_written_conditionally(self):
+        kwargs = self.stored_item()
+        item = kwargs["Item"]
+        self.assertEqual(sorted(item), ["record", "token_hash", "user_id"])
+        self.assertEqual(kwargs["ExpressionAttributeValues"][":hash"],
+                         item["token_hash"])
+        self.assertTrue("token_hash <> :hash" in kwargs["ConditionExpression"])
+        record = RecordCodec().decode(item["record"])
+        self.assertEqual(record.bearer_token, "suchtoken")
+        self.assertEqual(record.login, "bob")
+        self.assertTrue(record.last_validated >= int(time.time()) - 1)
+
+    def test_unchanged_token_not_rewritten(self):
+        self.mock_table.put_item.side_effect = ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem"
+        )
+        self.stored_item()
+        counters = metrics.snapshot().get('counters')
+        self.assertEqual(counters.get('dynamodb.put.unchanged'), 1)
+
+    def test_plain_items_by_default(self):
+        del self.lambda_event["auth_bearer_token_record"]
+        kwargs = self.stored_item()
+        self.assertEqual(kwargs, {"Item": {"user_id": 123,
+                                           "bearer_token": "suchtoken"}})
+
+    def test_encrypted_record(self):
+        self.lambda_event["auth_bearer_token_keys"] = \
+            Fernet.generate_key().decode('ascii')
+        item = self.stored_item()["Item"]
+        self.assertFalse(b"suchtoken" in item["record"])
+        self.mock_table.get_item.return_value = {"Item": item}
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        self.assertEqual(auth.fetch_bearer_token(123), "suchtoken")
+
+    def test_recent_record_skips_validation(self):
+        self.lambda_event["auth_revalidation_window"] = "300"
+        item = self.stored_item()["Item"]
+        item["user_id"] = Decimal(123)
+        self.mock_table.get_item.return_value = {"Item": item}
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        self.assertEqual(auth.fetch_bearer_token(123), "suchtoken")
+        record = RecordCodec().decode(item["record"])
+        self.assertEqual(auth.retrieve_gh_user_info("suchtoken"),
+                         (123, "bob", record.last_validated))
+        self.assertEqual(self.mock_github.get.call_count, 0)
+
+    def test_record_outside_window_is_revalidated(self):
+        item = self.stored_item()["Item"]
+        self.mock_table.get_item.return_value = {"Item": item}
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        auth.fetch_bearer_token(123)
+        self.assertEqual(jwt_authentication.validation_cache.get(
+            auth.validation_cache_key("suchtoken")), None)
+
+    def test_seeded_validation_time_carried_into_refresh(self):
+        self.lambda_event["auth_revalidation_window"] = "300"
+        self.lambda_event["jwt_signing_secret"] = "shh"
+        item = self.stored_item()["Item"]
+        self.mock_table.get_item.return_value = {"Item": item}
+        record = RecordCodec().decode(item["record"])
+        self.lambda_event["payload"] = {
+            "token": jwt.encode({"sub": 123}, "shh", algorithm='HS256')
+        }
+        with patch('auth_backend.jwt_authentication.time') as mock_time:
+            mock_time.time.return_value = record.last_validated + 200
+            result = JWTAuthentication.from_event(
+                self.lambda_event).refresh_jwt()
+        decoded = jwt.decode(result.get('data').get('token'), verify=False)
+        self.assertEqual(decoded.get('validated_at'), record.last_validated)
+        self.assertEqual(self.mock_github.get.call_count, 0)
+
+    def validate(self, login=False):
+        self.mock_github.get.return_value.status_code = 200
+        self.mock_github.get.return_value.json.return_value = {
+            "user": {"id": 123, "login": "bob"}
+        }
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        auth.retrieve_bearer_token = MagicMock(return_value="suchtoken")
+        with patch('auth_backend.jwt_authentication.workers') as mock_workers:
+            mock_workers.submit.side_effect = \
+                lambda pool, fn, *args: fn(*args)
+            if login:
+                self.assertEqual(auth.github_identity("code")[1:3],
+                                 (123, "bob"))
+            else:
+                self.assertEqual(
+                    auth.retrieve_gh_user_info("suchtoken")[:2],
+                    (123, "bob"))
+
+    def test_validation_refreshes_record(self):
+        self.validate()
+        kwargs = self.mock_table.put_item.call_args[1]
+        self.assertEqual(kwargs["ConditionExpression"], "token_hash = :hash")
+        record = RecordCodec().decode(kwargs["Item"]["record"])
+        self.assertEqual(record.login, "bob")
+        self.assertTrue(record.last_validated >= int(time.time()) - 1)
+
+    def test_replaced_token_not_overwritten(self):
+        self.mock_table.put_item.side_effect = ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem"
+        )
+        self.validate()
+        counters = metrics.snapshot().get('counters')
+        self.assertEqual(counters.get('dynamodb.put.superseded'), 1)
+
+    def test_login_does_not_refresh_record(self):
+        self.validate(login=True)
+        self.assertEqual(self.mock_table.put_item.call_count, 0)
+
+    def test_plain_items_not_refreshed(self):
+        del self.lambda_event["auth_bearer_token_record"]
+        self.validate()
+        self.assertEqual(self.mock_table.put_item.call_count, 0)
+
+    def test_unreadable_record(self):
+        self.mock_table.get_item.return_value = {
+            "Item": {"user_id": 123, "record": b"\x09garbage"}
+        }
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        self.assertEqual(auth.fetch_bearer_token(123), None)
+        counters = metrics.snapshot().get('counters')
+        self.assertEqual(counters.get('records.errors'), 1)
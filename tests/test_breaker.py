@@ -0,0 +1,90 @@
+import unittest
+from mock import patch
+from auth_backend import breaker
+from auth_backend import metrics
+from auth_backend.breaker import CircuitBreaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        patcher1 = patch('auth_backend.breaker.time')
+        self.addCleanup(patcher1.stop)
+        self.mock_time = patcher1.start()
+        self.mock_time.time.return_value = 1000.0
+
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.circuit = CircuitBreaker("github.validate", failure_rate=0.5,
+                                      min_calls=4, slow_call_ms=500,
+                                      open_seconds=30)
+
+    def trip(self):
+        for _ in range(4):
+            self.circuit.record(True, 0.01)
+
+    def test_opens_on_failure_rate(self):
+        for failed in [True, False, True]:
+            self.circuit.record(failed, 0.01)
+        self.assertEqual(self.circuit.state, breaker.CLOSED)
+        self.circuit.record(False, 0.01)
+        self.assertEqual(self.circuit.state, breaker.OPEN)
+        self.assertFalse(self.circuit.allow())
+        self.assertEqual(self.circuit.stats(), {"state": "open",
+                                                "calls": 4,
+                                                "failures": 2,
+                                                "rejected": 1})
+        counters = metrics.snapshot().get('counters')
+        self.assertEqual(counters.get('breaker.github.validate.open'), 1)
+
+    def test_slow_calls_count_as_failures(self):
+        for _ in range(4):
+            self.circuit.record(False, 0.6)
+        self.assertEqual(self.circuit.state, breaker.OPEN)
+
+    def test_half_open_probe_closes(self):
+        self.trip()
+        self.mock_time.time.return_value = 1030.0
+        self.assertTrue(self.circuit.allow())
+        self.assertEqual(self.circuit.state, breaker.HALF_OPEN)
+        self.assertFalse(self.circuit.allow())
+        self.circuit.record(False, 0.01)
+        self.assertEqual(self.circuit.state, breaker.CLOSED)
+        self.assertTrue(self.circuit.allow())
+        counters = metrics.snapshot().get('counters')
+        self.assertEqual(counters.get('breaker.github.validate.half_open'), 1)
+        self.assertEqual(counters.get('breaker.github.validate.closed'), 1)
+
+    def test_half_open_probe_reopens(self):
+        self.trip()
+        self.mock_time.time.return_value = 1030.0
+        self.assertTrue(self.circuit.allow())
+        self.circuit.record(True, 0.01)
+        self.assertEqual(self.circuit.state, breaker.OPEN)
+        self.mock_time.time.return_value = 1059.0
+        self.assertFalse(self.circuit.allow())
+
+    def test_percentile(self):
+        self.assertEqual(self.circuit.percentile(95), None)
+        for seconds in [0.1, 0.2, 0.3, 0.4, 0.9]:
+            self.circuit.record(False, seconds)
+        self.assertEqual(self.circuit.percentile(50), 0.3)
+        self.assertEqual(self.circuit.percentile(100), 0.4)
+
+
+class TestBreakerRegistry(unittest.TestCase):
+
+    def setUp(self):
+        breaker.reset()
+        self.addCleanup(breaker.reset)
+
+    def test_breakers_shared_and_configured(self):
+        circuit = breaker.get("github.validate")
+        self.assertTrue(breaker.get("github.validate") is circuit)
+        breaker.configure(min_calls=3, failure_rate=None)
+        self.assertEqual(circuit.settings["min_calls"], 3)
+        self.assertEqual(circuit.settings["failure_rate"], 0.5)
+        self.assertEqual(breaker.get("github.exchange").settings["min_calls"],
+                         3)
+        self.assertEqual(sorted(breaker.stats()),
+                         ["github.exchange", "github.validate"])
@@ -0,0 +1,80 @@
+import unittest
+from mock import patch
+from auth_backend.cache import TieredCache
+from auth_backend.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_get_and_set(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        self.assertEqual(cache.get("a"), None)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats().get('hits'), 1)
+        self.assertEqual(cache.stats().get('misses'), 1)
+
+    @patch('auth_backend.cache.time')
+    def test_expiry(self, mock_time):
+        mock_time.time.return_value = 100
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=30)
+        mock_time.time.return_value = 115
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.get("b"), 2)
+        self.assertEqual(cache.stats().get('expirations'), 1)
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats().get('evictions'), 1)
+
+    def test_configure_shrinks(self):
+        cache = TTLCache(maxsize=3, ttl=60)
+        for key in "abc":
+            cache.set(key, key)
+        cache.configure(maxsize=1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get("c"), "c")
+
+    def test_delete(self):
+        cache = TTLCache()
+        cache.set("a", 1)
+        cache.delete("a")
+        self.assertEqual(cache.get("a"), None)
+
+    @patch('auth_backend.cache.time')
+    def test_entry(self, mock_time):
+        mock_time.time.return_value = 100
+        cache = TTLCache(maxsize=2, ttl=10)
+        self.assertEqual(cache.entry("a"), None)
+        cache.set("a", 1)
+        self.assertEqual(cache.entry("a"), (110, 1))
+        self.assertEqual(cache.stats().get('hits'), 0)
+
+
+class TestTieredCache(unittest.TestCase):
+
+    def setUp(self):
+        self.local = TTLCache()
+        self.shared = TTLCache()
+        self.cache = TieredCache(self.local, self.shared)
+
+    def test_shared_hit_populates_local(self):
+        self.shared.set("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.local.get("a"), 1)
+
+    def test_set_and_delete_both_tiers(self):
+        self.cache.set("a", 1)
+        self.assertEqual(self.shared.get("a"), 1)
+        self.cache.delete("a")
+        self.assertEqual(self.local.get("a"), None)
+        self.assertEqual(self.shared.get("a"), None)
@@ -0,0 +1,123 @@
+import unittest
+import json
+from mock import patch
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from auth_backend import config
+from auth_backend.config import Config
+from auth_backend.config import ConfigurationError
+from auth_backend.config import get_config
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        config.reset()
+        self.addCleanup(config.reset)
+        self.lambda_event = {
+            "jwt_signing_secret": "sekr3t",
+            "jwt_expiry_minutes": "10",
+            "oauth_client_id": "c123",
+            "oauth_client_secret": "shh!",
+            "auth_desired_oauth_scopes": "user,org",
+            "auth_dynamodb_endpoint_url": "http://example.com",
+            "auth_dynamodb_table_name": "faker",
+            "payload": {"token": "abc"}
+        }
+
+    def test_values_are_parsed(self):
+        self.lambda_event["auth_persist_timeout"] = "0.5"
+        self.lambda_event["github_pool_size"] = "4"
+        conf = Config(self.lambda_event)
+        self.assertEqual(conf.jwt_expiry_minutes, 10)
+        self.assertEqual(conf.desired_scopes, frozenset(["user", "org"]))
+        self.assertEqual(conf.auth_persist_timeout, 0.5)
+        self.assertEqual(conf.github_settings["pool_size"], 4)
+        self.assertEqual(conf.auth_persist_mode, config.DEFAULT_PERSIST_MODE)
+        self.assertEqual(conf.github_url, config.DEFAULT_GITHUB_URL)
+        self.assertEqual(conf.github_settings["hedge_percentile"], None)
+        self.assertEqual(conf.github_breaker_settings["min_calls"], None)
+
+    def test_invalid_values(self):
+        for name, value in [("jwt_expiry_minutes", "ten"),
+                            ("jwt_expiry_minutes", "0"),
+                            ("auth_persist_mode", "eventually"),
+                            ("jwt_signing_algorithm", "none"),
+                            ("jwt_signing_algorithm", "RS256"),
+                            ("jwt_signing_keys", "[1, 2]"),
+                            ("github_breaker_failure_rate", "2"),
+                            ("github_hedge_percentile", "100"),
+                            ("auth_persist_workers", "0"),
+                            ("auth_bearer_token_record", "binary"),
+                            ("auth_bearer_token_keys", "abc"),
+                            ("jwt_github_token_mode", "opaque")]:
+            event = dict(self.lambda_event)
+            event[name] = value
+            with self.assertRaises(ConfigurationError):
+                Config(event)
+
+    def test_signing_keys_parsed_once(self):
+        keys = {"old": "secret-1", "new": "secret-2"}
+        self.lambda_event["jwt_signing_keys"] = json.dumps(keys)
+        self.lambda_event["jwt_active_kid"] = "new"
+        conf = Config(self.lambda_event)
+        self.assertEqual(conf.jwt_signing_keys, keys)
+        self.assertEqual(conf.keyring.active.kid, "new")
+        self.assertTrue(conf.keyring is conf.keyring)
+
+    def test_mismatched_signing_key(self):
+        ec_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+        pem = ec_key.private_bytes(serialization.Encoding.PEM,
+                                   serialization.PrivateFormat.PKCS8,
+                                   serialization.NoEncryption())
+        self.lambda_event["jwt_signing_algorithm"] = "RS256"
+        self.lambda_event["jwt_signing_keys"] = {"k1": pem.decode('ascii')}
+        self.lambda_event["jwt_active_kid"] = "k1"
+        conf = Config(self.lambda_event)
+        with self.assertRaises(ConfigurationError):
+            conf.keyring
+
+    def test_missing_cryptography(self):
+        ec_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+        pem = ec_key.private_bytes(serialization.Encoding.PEM,
+                                   serialization.PrivateFormat.PKCS8,
+                                   serialization.NoEncryption())
+        self.lambda_event["jwt_signing_algorithm"] = "ES256"
+        self.lambda_event["jwt_signing_keys"] = {"k1": pem.decode('ascii')}
+        self.lambda_event["jwt_active_kid"] = "k1"
+        self.lambda_event["auth_bearer_token_record"] = "compact"
+        self.lambda_event["auth_bearer_token_keys"] = \
+            "cw_0x689RpI-jtRR7oE8h_eQsKImvJapLeSbXpwF4e4="
+        conf = Config(self.lambda_event)
+        with patch.dict('sys.modules', {
+                'cryptography.hazmat.backends': None,
+                'cryptography.fernet': None}):
+            for name in ["keyring", "record_codec"]:
+                with self.assertRaises(ConfigurationError) as raised:
+                    getattr(conf, name)
+                self.assertTrue("cryptography" in str(raised.exception))
+
+    def test_missing_signing_key(self):
+        del self.lambda_event["jwt_signing_secret"]
+        conf = Config(self.lambda_event)
+        with self.assertRaises(ConfigurationError):
+            conf.keyring
+
+    def test_config_reused_across_payloads(self):
+        first = get_config(self.lambda_event)
+        self.lambda_event["payload"] = {"token": "def"}
+        self.lambda_event["resource-path"] = "/auth/refresh"
+        self.assertTrue(get_config(self.lambda_event) is first)
+
+    def test_config_rebuilt_when_settings_change(self):
+        first = get_config(self.lambda_event)
+        self.lambda_event["jwt_expiry_minutes"] = "5"
+        second = get_config(self.lambda_event)
+        self.assertFalse(second is first)
+        self.assertEqual(second.jwt_expiry_minutes, 5)
+
+    def test_signing_keys_given_as_dict(self):
+        self.lambda_event["jwt_signing_keys"] = {"k1": "secret"}
+        self.assertTrue(get_config(self.lambda_event) is
+                        get_config(dict(self.lambda_event)))
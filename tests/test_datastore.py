@@ -0,0 +1,186 @@
+import threading
+import unittest
+from botocore.exceptions import ClientError
+from mock import patch
+from auth_backend import datastore
+
+
+class TestDatastore(unittest.TestCase):
+
+    def setUp(self):
+        patcher1 = patch('boto3.resource')
+        self.addCleanup(patcher1.stop)
+        self.mock_resource = patcher1.start()
+        datastore.reset()
+        self.addCleanup(datastore.reset)
+
+    def test_table_is_reused(self):
+        table1 = datastore.get_table("http://example.com", "faker")
+        table2 = datastore.get_table("http://example.com", "faker")
+        self.assertIs(table1, table2)
+        self.assertEqual(self.mock_resource.call_count, 1)
+        self.assertEqual(self.mock_resource.return_value.Table.call_count, 1)  # NOQA
+
+    def test_tables_share_a_resource(self):
+        datastore.get_table("http://example.com", "faker")
+        datastore.get_table("http://example.com", "other")
+        self.assertEqual(self.mock_resource.call_count, 1)
+        self.assertEqual(self.mock_resource.return_value.Table.call_count, 2)  # NOQA
+
+    def test_resource_per_endpoint(self):
+        datastore.get_table("http://example.com", "faker")
+        datastore.get_table("http://example.org", "faker")
+        self.assertEqual(self.mock_resource.call_count, 2)
+
+    def test_resource_options(self):
+        datastore.get_resource("http://example.com",
+                               max_pool_connections="25",
+                               connect_timeout="1",
+                               read_timeout="3")
+        config = self.mock_resource.call_args[1]['config']
+        self.assertEqual(config.max_pool_connections, 25)
+        self.assertEqual(config.connect_timeout, 1.0)
+        self.assertEqual(config.read_timeout, 3.0)
+
+    def test_default_resource_options(self):
+        datastore.get_resource("http://example.com")
+        config = self.mock_resource.call_args[1]['config']
+        self.assertEqual(config.max_pool_connections,
+                         datastore.DEFAULT_MAX_POOL_CONNECTIONS)
+
+    def test_batch_get_items_chunks_keys(self):
+        resource = self.mock_resource.return_value
+        resource.batch_get_item.return_value = {
+            "Responses": {"faker": [{"user_id": 1}]}
+        }
+        keys = [{"user_id": i} for i in range(250)]
+        items, unprocessed = datastore.batch_get_items("http://example.com",
+                                                       "faker", keys)
+        self.assertEqual(resource.batch_get_item.call_count, 3)
+        chunk_sizes = [len(c[1]['RequestItems']['faker']['Keys'])
+                       for c in resource.batch_get_item.call_args_list]
+        self.assertEqual(chunk_sizes, [100, 100, 50])
+        self.assertEqual(len(items), 3)
+        self.assertEqual(unprocessed, [])
+
+    @patch('auth_backend.datastore.time')
+    def test_batch_get_items_retries_unprocessed(self, mock_time):
+        resource = self.mock_resource.return_value
+        unprocessed = {"faker": {"Keys": [{"user_id": 2}]}}
+        resource.batch_get_item.side_effect = [
+            {"Responses": {"faker": [{"user_id": 1}]},
+             "UnprocessedKeys": unprocessed},
+            {"Responses": {"faker": [{"user_id": 2}]}}
+        ]
+        keys = [{"user_id": 1}, {"user_id": 2}]
+        items, _ = datastore.batch_get_items("http://example.com", "faker",
+                                             keys)
+        self.assertEqual(items, [{"user_id": 1}, {"user_id": 2}])
+        self.assertEqual(resource.batch_get_item.call_args_list[1][1],
+                         {"RequestItems": unprocessed})
+        self.assertEqual(mock_time.sleep.call_count, 1)
+
+    @patch('auth_backend.datastore.time')
+    def test_batch_get_items_reports_unprocessed(self, mock_time):
+        resource = self.mock_resource.return_value
+        resource.batch_get_item.return_value = {
+            "Responses": {"faker": [{"user_id": 1}]},
+            "UnprocessedKeys": {"faker": {"Keys": [{"user_id": 2}]}}
+        }
+        keys = [{"user_id": 1}, {"user_id": 2}]
+        items, unprocessed = datastore.batch_get_items(
+            "http://example.com", "faker", keys, max_attempts=2)
+        self.assertEqual(unprocessed, [{"user_id": 2}])
+
+    def test_batch_write_items_chunks_and_retries(self):
+        resource = self.mock_resource.return_value
+        unprocessed = {"faker": [{"PutRequest": {"Item": {"user_id": 3}}}]}
+        resource.batch_write_item.side_effect = [
+            {"UnprocessedItems": unprocessed},
+            {},
+            {}
+        ]
+        items = [{"user_id": i} for i in range(30)]
+        unwritten = datastore.batch_write_items("http://example.com",
+                                                "faker", items,
+                                                backoff=0)
+        self.assertEqual(unwritten, [])
+        chunk_sizes = [len(c[1]['RequestItems']['faker'])
+                       for c in resource.batch_write_item.call_args_list]
+        self.assertEqual(chunk_sizes, [25, 1, 5])
+
+    def test_batch_write_items_gives_up(self):
+        resource = self.mock_resource.return_value
+        unprocessed = {"faker": [{"PutRequest": {"Item": {"user_id": 3}}}]}
+        resource.batch_write_item.return_value = {
+            "UnprocessedItems": unprocessed
+        }
+        unwritten = datastore.batch_write_items("http://example.com",
+                                                "faker", [{"user_id": 3}],
+                                                max_attempts=2,
+                                                backoff=0)
+        self.assertEqual(unwritten, [{"user_id": 3}])
+
+    def test_write_buffer_coalesces_and_flushes_on_size(self):
+        resource = self.mock_resource.return_value
+        resource.batch_write_item.return_value = {}
+        buffer = datastore.WriteBuffer("http://example.com", "faker",
+                                       max_items=2, max_age=60)
+        buffer.put({"user_id": 1, "bearer_token": "a"})
+        buffer.put({"user_id": 1, "bearer_token": "b"})
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(resource.batch_write_item.call_count, 0)
+        buffer.put({"user_id": 2, "bearer_token": "c"})
+        self.assertEqual(len(buffer), 0)
+        request = resource.batch_write_item.call_args[1]['RequestItems']
+        self.assertEqual([r['PutRequest']['Item'] for r in request['faker']],
+                         [{"user_id": 1, "bearer_token": "b"},
+                          {"user_id": 2, "bearer_token": "c"}])
+
+    def test_write_buffer_flushes_when_expired(self):
+        resource = self.mock_resource.return_value
+        resource.batch_write_item.return_value = {}
+        buffer = datastore.WriteBuffer("http://example.com", "faker",
+                                       max_items=25, max_age=0)
+        buffer.put({"user_id": 1})
+        self.assertEqual(resource.batch_write_item.call_count, 1)
+
+    def test_write_buffer_flushes_in_order(self):
+        resource = self.mock_resource.return_value
+        writing = threading.Event()
+        release = threading.Event()
+        written = []
+
+        def batch_write_item(RequestItems):
+            written.extend(r['PutRequest']['Item']['bearer_token']
+                           for r in RequestItems['faker'])
+            writing.set()
+            release.wait(5)
+            return {}
+        resource.batch_write_item.side_effect = batch_write_item
+        buffer = datastore.WriteBuffer("http://example.com", "faker",
+                                       max_age=60)
+        buffer.put({"user_id": 1, "bearer_token": "old"})
+        first = threading.Thread(target=buffer.flush)
+        first.start()
+        writing.wait(5)
+        buffer.put({"user_id": 1, "bearer_token": "new"})
+        second = threading.Thread(target=buffer.flush)
+        second.start()
+        second.join(0.1)
+        self.assertEqual(written, ["old"])
+        release.set()
+        first.join()
+        second.join()
+        self.assertEqual(written, ["old", "new"])
+
+    def test_write_buffer_failure_callback(self):
+        resource = self.mock_resource.return_value
+        resource.batch_write_item.side_effect = ClientError({}, "BatchWriteItem")  # NOQA
+        failed = []
+        buffer = datastore.get_write_buffer("http://example.com", "faker",
+                                            max_age=60,
+                                            on_failure=failed.extend)
+        buffer.put({"user_id": 1})
+        self.assertFalse(datastore.flush_write_buffers())
+        self.assertEqual(failed, [{"user_id": 1}])
@@ -1,16 +1,32 @@
 import unittest
 from mock import patch
 from mock import call
+from auth_backend import workers
+from auth_backend.config import ConfigurationError
 from auth_backend.entrypoint import handler
+from auth_backend.entrypoint import logger
 import json
+import logging
+import subprocess
+import sys
+import time
 
 
 class TestEntrypoint(unittest.TestCase):
 
     def setUp(self):
-        patcher1 = patch('auth_backend.entrypoint.JWTAuthentication')
+        patcher1 = patch('auth_backend.jwt_authentication.JWTAuthentication')
         self.addCleanup(patcher1.stop)
         self.mock_jwt_auth = patcher1.start()
+        auth = self.mock_jwt_auth.from_event.return_value
+        for method in [auth.dispense_new_jwt, auth.refresh_jwt,
+                       auth.refresh_jwt_batch, auth.revoke_jwt, auth.jwks]:
+            method.return_value = {"http_status": 200, "data": {}}
+
+        patcher2 = patch('auth_backend.entrypoint.datastore')
+        self.addCleanup(patcher2.stop)
+        self.mock_datastore = patcher2.start()
+        self.mock_datastore.background_flush_running.return_value = False
 
     def test_invalid_path(self):
         with self.assertRaises(TypeError) as cm:
@@ -27,14 +43,107 @@ class TestEntrypoint(unittest.TestCase):
         self.assertTrue("version" in result.get('data'))
         self.assertEqual(len(self.mock_jwt_auth.mock_calls), 0)
 
+    def test_ping_is_a_cold_path(self):
+        script = ("import sys\n"
+                  "from auth_backend.entrypoint import handler\n"
+                  "handler({'resource-path': '/auth/ping'}, {})\n"
+                  "heavy = ('boto3', 'requests', "
+                  "'auth_backend.jwt_authentication')\n"
+                  "print(','.join(m for m in heavy if m in sys.modules))\n")
+        output = subprocess.check_output([sys.executable, "-c", script])
+        self.assertEqual(output.strip(), b"")
+
     def test_token_endpoint(self):
         handler({"resource-path": "/auth/token"}, {})
-        self.assertTrue(call({'resource-path': '/auth/token'}) in self.mock_jwt_auth.mock_calls)  # NOQA
-        self.assertTrue(call().dispense_new_jwt() in self.mock_jwt_auth.mock_calls)  # NOQA
+        self.assertTrue(call.from_event({'resource-path': '/auth/token'}) in self.mock_jwt_auth.mock_calls)  # NOQA
+        self.assertTrue(call.from_event().dispense_new_jwt() in self.mock_jwt_auth.mock_calls)  # NOQA
         self.assertEqual(len(self.mock_jwt_auth.mock_calls), 2)
 
     def test_refresh_endpoint(self):
         handler({"resource-path": "/auth/refresh"}, {})
-        self.assertTrue(call({'resource-path': '/auth/refresh'}) in self.mock_jwt_auth.mock_calls)  # NOQA
-        self.assertTrue(call().refresh_jwt() in self.mock_jwt_auth.mock_calls)  # NOQA
+        self.assertTrue(call.from_event({'resource-path': '/auth/refresh'}) in self.mock_jwt_auth.mock_calls)  # NOQA
+        self.assertTrue(call.from_event().refresh_jwt() in self.mock_jwt_auth.mock_calls)  # NOQA
+        self.assertEqual(len(self.mock_jwt_auth.mock_calls), 2)
+
+    def test_refresh_batch_endpoint(self):
+        handler({"resource-path": "/auth/refresh/batch"}, {})
+        self.assertTrue(call.from_event({'resource-path': '/auth/refresh/batch'}) in self.mock_jwt_auth.mock_calls)  # NOQA
+        self.assertTrue(call.from_event().refresh_jwt_batch() in self.mock_jwt_auth.mock_calls)  # NOQA
+        self.assertEqual(len(self.mock_jwt_auth.mock_calls), 2)
+
+    def test_revoke_endpoint(self):
+        handler({"resource-path": "/auth/revoke"}, {})
+        self.assertTrue(call.from_event({'resource-path': '/auth/revoke'}) in self.mock_jwt_auth.mock_calls)  # NOQA
+        self.assertTrue(call.from_event().revoke_jwt() in self.mock_jwt_auth.mock_calls)  # NOQA
+        self.assertEqual(len(self.mock_jwt_auth.mock_calls), 2)
+
+    def test_write_buffers_flushed(self):
+        handler({"resource-path": "/auth/token"}, {})
+        self.assertEqual(self.mock_datastore.flush_write_buffers.call_count, 1)  # NOQA
+
+    def test_write_buffers_left_to_background_flush(self):
+        self.mock_datastore.background_flush_running.return_value = True
+        handler({"resource-path": "/auth/token"}, {})
+        self.assertEqual(self.mock_datastore.flush_write_buffers.call_count, 0)  # NOQA
+
+    def test_deferred_writes_drained(self):
+        writes = []
+        workers.submit("persist", lambda: time.sleep(0.1) or
+                       writes.append(1))
+        handler({"resource-path": "/auth/ping"}, {})
+        self.assertEqual(writes, [1])
+
+    def test_error_returned_in_return_mode(self):
+        result = handler({"resource-path": "/",
+                          "auth_error_mode": "return"}, {})
+        self.assertEqual(result.get('http_status'), 400)
+        self.assertEqual(result.get('data').get('error'), "Invalid path /")
+
+    def test_error_raised_for_lambda_integration(self):
+        self.mock_jwt_auth.from_event.return_value.refresh_jwt.return_value = {  # NOQA
+            "http_status": 401, "data": {"error": "Not Authorized"}
+        }
+        with self.assertRaises(TypeError) as cm:
+            handler({"resource-path": "/auth/refresh"}, {})
+        self.assertEqual(json.loads(str(cm.exception)).get('http_status'),
+                         401)
+
+    def test_invalid_configuration(self):
+        self.mock_jwt_auth.from_event.side_effect = ConfigurationError("bad")
+        with self.assertRaises(TypeError) as cm:
+            handler({"resource-path": "/auth/token"}, {})
+        result_json = json.loads(str(cm.exception))
+        self.assertEqual(result_json.get('http_status'), 500)
+        self.assertEqual(result_json.get('data').get('error'),
+                         "Invalid configuration")
+
+    def test_emf_emitted_when_configured(self):
+        with patch('auth_backend.entrypoint.metrics') as mock_metrics:
+            handler({"resource-path": "/auth/ping"}, {})
+            self.assertEqual(mock_metrics.emit_emf.call_count, 0)
+            handler({"resource-path": "/auth/ping",
+                     "auth_metrics": "emf"}, {})
+            self.assertEqual(mock_metrics.emit_emf.call_count, 1)
+
+    def test_log_level_configurable(self):
+        self.addCleanup(logger.setLevel, logger.level)
+        handler({"resource-path": "/auth/ping",
+                 "auth_log_level": "warning"}, {})
+        self.assertEqual(logger.level, logging.WARNING)
+        handler({"resource-path": "/auth/ping"}, {})
+        self.assertEqual(logger.level, logging.INFO)
+
+    def test_secrets_not_logged(self):
+        self.addCleanup(logger.setLevel, logger.level)
+        with patch.object(logger, 'handle') as mock_handle:
+            handler({"resource-path": "/auth/ping",
+                     "auth_log_level": "debug",
+                     "jwt_signing_secret": "sekr3t"}, {})
+        messages = [c[0][0].getMessage() for c in mock_handle.call_args_list]
+        self.assertTrue(messages)
+        self.assertFalse(any("sekr3t" in m for m in messages))
+
+    def test_jwks_endpoint(self):
+        handler({"resource-path": "/auth/jwks"}, {})
+        self.assertTrue(call.from_event().jwks() in self.mock_jwt_auth.mock_calls)  # NOQA
         self.assertEqual(len(self.mock_jwt_auth.mock_calls), 2)
@@ -0,0 +1,103 @@
+import time
+import unittest
+from mock import patch
+from mock import MagicMock
+from auth_backend import breaker
+from auth_backend import github
+from auth_backend import metrics
+import requests
+
+
+class TestGitHubSession(unittest.TestCase):
+
+    def setUp(self):
+        github.reset()
+        metrics.reset()
+        self.addCleanup(github.reset)
+        self.addCleanup(metrics.reset)
+
+    def test_session_is_shared(self):
+        self.assertIs(github.get_session(), github.get_session())
+
+    def test_configure_rebuilds_session(self):
+        session = github.get_session()
+        github.configure(pool_size=20)
+        self.assertIsNot(session, github.get_session())
+
+    def test_configure_unchanged_keeps_session(self):
+        session = github.get_session()
+        github.configure(pool_size=None, read_timeout=5)
+        self.assertIs(session, github.get_session())
+
+    def test_adapter_settings(self):
+        github.configure(pool_size=3, max_retries=4)
+        adapter = github.get_session().get_adapter("https://github.com")
+        self.assertEqual(adapter._pool_maxsize, 3)
+        self.assertEqual(adapter.max_retries.total, 4)
+
+    @patch('auth_backend.github.get_session')
+    def test_request_timeout_and_metrics(self, mock_get_session):
+        mock_get_session.return_value.request.return_value.status_code = 200
+        github.configure(connect_timeout=1, read_timeout=2)
+        github.get("https://api.github.com", "github.validate")
+        kwargs = mock_get_session.return_value.request.call_args[1]
+        self.assertEqual(kwargs.get('timeout'), (1.0, 2.0))
+        timers = metrics.snapshot().get('timers')
+        self.assertEqual(timers.get('github.validate').get('count'), 1)
+
+    @patch('auth_backend.github.get_session')
+    def test_request_error(self, mock_get_session):
+        mock_get_session.return_value.request = MagicMock(
+            side_effect=requests.exceptions.ConnectTimeout()
+        )
+        result = github.post("https://github.com", "github.exchange")
+        self.assertEqual(result, None)
+        counters = metrics.snapshot().get('counters')
+        self.assertEqual(counters.get('github.exchange.errors'), 1)
+
+    @patch('auth_backend.github.get_session')
+    def test_open_breaker_short_circuits(self, mock_get_session):
+        mock_get_session.return_value.request.return_value.status_code = 503
+        breaker.configure(min_calls=2, failure_rate=1)
+        for _ in range(2):
+            self.assertEqual(github.get("https://api.github.com",
+                                        "github.validate").status_code, 503)
+        self.assertEqual(github.get("https://api.github.com",
+                                    "github.validate"), None)
+        self.assertEqual(mock_get_session.return_value.request.call_count, 2)
+        counters = metrics.snapshot().get('counters')
+        self.assertEqual(counters.get('github.validate.short_circuited'), 1)
+        self.assertEqual(counters.get('breaker.github.validate.open'), 1)
+        self.assertEqual(metrics.snapshot().get('circuit_breakers').get(
+            'github.validate').get('state'), "open")
+
+    @patch('auth_backend.github.get_session')
+    def test_slow_request_is_hedged(self, mock_get_session):
+        responses = [MagicMock(status_code=200), MagicMock(status_code=200)]
+        delays = [0.5, 0]
+
+        def request(*args, **kwargs):
+            response = responses.pop(0)
+            time.sleep(delays.pop(0))
+            return response
+        mock_get_session.return_value.request = MagicMock(
+            side_effect=request
+        )
+        github.configure(hedge_percentile=90)
+        with patch.object(breaker.CircuitBreaker, 'percentile',
+                          return_value=0.05):
+            result = github.get("https://api.github.com", "github.validate")
+        self.assertTrue(result is not None)
+        self.assertEqual(mock_get_session.return_value.request.call_count, 2)
+        counters = metrics.snapshot().get('counters')
+        self.assertEqual(counters.get('github.validate.hedged'), 1)
+        self.assertEqual(counters.get('github.validate.hedge_won'), 1)
+
+    @patch('auth_backend.github.get_session')
+    def test_posts_are_never_hedged(self, mock_get_session):
+        mock_get_session.return_value.request.return_value.status_code = 200
+        github.configure(hedge_percentile=90)
+        with patch.object(breaker.CircuitBreaker, 'percentile',
+                          return_value=0.0):
+            github.post("https://github.com", "github.exchange")
+        self.assertEqual(mock_get_session.return_value.request.call_count, 1)
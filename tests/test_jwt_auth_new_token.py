@@ -2,20 +2,38 @@ import unittest
 from mock import patch
 from mock import MagicMock
 from auth_backend.jwt_authentication import JWTAuthentication
-import json
+from auth_backend.jwt_authentication import rejected_code_cache
+from auth_backend.jwt_authentication import validation_cache
+from auth_backend import ratelimit
+from auth_backend import workers
+from auth_backend.cache import TTLCache
+import threading
+import time
 
 
 class TestJWTAuthNewToken(unittest.TestCase):
 
     def setUp(self):
-        patcher1 = patch('auth_backend.jwt_authentication.requests')
+        patcher1 = patch('auth_backend.jwt_authentication.github')
         self.addCleanup(patcher1.stop)
-        self.mock_requests = patcher1.start()
+        self.mock_github = patcher1.start()
 
-        patcher2 = patch('auth_backend.jwt_authentication.boto3')
+        patcher2 = patch('boto3.resource')
         self.addCleanup(patcher2.stop)
         self.mock_boto = patcher2.start()
 
+        patcher3 = patch('auth_backend.jwt_authentication.bearer_token_cache',
+                         TTLCache())
+        self.addCleanup(patcher3.stop)
+        patcher3.start()
+
+        validation_cache.clear()
+        self.addCleanup(validation_cache.clear)
+        rejected_code_cache.clear()
+        self.addCleanup(rejected_code_cache.clear)
+        ratelimit.reset()
+        self.addCleanup(ratelimit.reset)
+
         self.lambda_event = {
             "jwt_signing_secret": "sekr3t",
             "jwt_expiry_minutes": "10",
@@ -31,59 +49,106 @@ class TestJWTAuthNewToken(unittest.TestCase):
     def test_empty_temp_access_code(self):
         payload = {"password": ""}
         self.lambda_event['payload'] = payload
-        jwt = JWTAuthentication(self.lambda_event)
-        with self.assertRaises(TypeError) as cm:
-            jwt.dispense_new_jwt()
-        result_json = json.loads(str(cm.exception))
+        jwt = JWTAuthentication.from_event(self.lambda_event)
+        result_json = jwt.dispense_new_jwt()
         self.assertEqual(result_json.get('http_status'), 400)
-        self.assertEqual(len(self.mock_requests.mock_calls), 0)
+        self.assertEqual(len(self.mock_github.post.mock_calls), 0)
+        self.assertEqual(len(self.mock_github.get.mock_calls), 0)
 
     def test_invalid_temp_access_code(self):
-        self.mock_requests.post = MagicMock()
-        self.mock_requests.post.return_value.status_code = 100
+        self.mock_github.post = MagicMock()
+        self.mock_github.post.return_value.status_code = 100
         payload = {"password": "code123"}
         self.lambda_event['payload'] = payload
-        jwt = JWTAuthentication(self.lambda_event)
-        with self.assertRaises(TypeError) as cm:
-            jwt.dispense_new_jwt()
-        result_json = json.loads(str(cm.exception))
+        jwt = JWTAuthentication.from_event(self.lambda_event)
+        result_json = jwt.dispense_new_jwt()
         self.assertEqual(result_json.get('http_status'), 401)
         self.assertEqual(result_json.get('data').get('error'),
                          "Not Authorized")
 
     def test_insufficient_scopes(self):
-        self.mock_requests.post = MagicMock()
-        self.mock_requests.post.return_value.status_code = 200
-        self.mock_requests.post.return_value.json.return_value = {
+        self.mock_github.post = MagicMock()
+        self.mock_github.post.return_value.status_code = 200
+        self.mock_github.post.return_value.json.return_value = {
             "scope": "none"
         }
         payload = {"password": "code123"}
         self.lambda_event['payload'] = payload
-        jwt = JWTAuthentication(self.lambda_event)
-        jwt.auth_desired_oauth_scopes = 'bob'
-        with self.assertRaises(TypeError) as cm:
-            jwt.dispense_new_jwt()
-        result_json = json.loads(str(cm.exception))
+        self.lambda_event['auth_desired_oauth_scopes'] = 'bob'
+        jwt = JWTAuthentication.from_event(self.lambda_event)
+        result_json = jwt.dispense_new_jwt()
         self.assertEqual(result_json.get('http_status'), 401)
         self.assertEqual(result_json.get('data').get('error'),
                          "Not Authorized")
 
+    def test_rejected_access_code_cached(self):
+        self.mock_github.post = MagicMock()
+        self.mock_github.post.return_value.status_code = 200
+        self.mock_github.post.return_value.json.return_value = {
+            "error": "bad_verification_code"
+        }
+        self.lambda_event['payload'] = {"password": "garbage"}
+        for _ in range(3):
+            jwt = JWTAuthentication.from_event(self.lambda_event)
+            result_json = jwt.dispense_new_jwt()
+            self.assertEqual(result_json.get('http_status'), 401)
+        self.assertEqual(self.mock_github.post.call_count, 1)
+
+    def test_upstream_failure_not_cached(self):
+        self.mock_github.post = MagicMock(return_value=None)
+        self.lambda_event['payload'] = {"password": "code123"}
+        for _ in range(2):
+            jwt = JWTAuthentication.from_event(self.lambda_event)
+            self.assertEqual(jwt.dispense_new_jwt().get('http_status'), 503)
+        self.assertEqual(self.mock_github.post.call_count, 2)
+
+    def test_validation_outage_is_not_a_refusal(self):
+        self.mock_github.post.return_value.status_code = 200
+        self.mock_github.post.return_value.json.return_value = {
+            "access_token": "suchtoken",
+            "scope": "user"
+        }
+        self.mock_github.get.return_value.status_code = 502
+        self.lambda_event['auth_desired_oauth_scopes'] = "user"
+        self.lambda_event['payload'] = {"password": "code123"}
+        jwt = JWTAuthentication.from_event(self.lambda_event)
+        result = jwt.dispense_new_jwt()
+        self.assertEqual(result.get('http_status'), 503)
+
+    def test_rate_limited(self):
+        self.mock_github.post = MagicMock()
+        self.mock_github.post.return_value.status_code = 401
+        self.lambda_event['auth_rate_limit'] = "0.5"
+        self.lambda_event['auth_rate_limit_burst'] = "2"
+        self.lambda_event['source-ip'] = "10.0.0.1"
+        statuses = []
+        for i in range(3):
+            self.lambda_event['payload'] = {"password": "code%d" % i}
+            jwt = JWTAuthentication.from_event(self.lambda_event)
+            statuses.append(jwt.dispense_new_jwt())
+        self.assertEqual([r.get('http_status') for r in statuses],
+                         [401, 401, 429])
+        self.assertEqual(statuses[-1].get('headers'), {"Retry-After": "2"})
+        self.assertEqual(self.mock_github.post.call_count, 2)
+
+        self.lambda_event['source-ip'] = "10.0.0.2"
+        jwt = JWTAuthentication.from_event(self.lambda_event)
+        self.assertEqual(jwt.dispense_new_jwt().get('http_status'), 401)
+
     def test_invalid_user_id(self):
-        self.mock_requests.post = MagicMock()
-        self.mock_requests.post.return_value.status_code = 200
-        self.mock_requests.post.return_value.json.return_value = {
+        self.mock_github.post = MagicMock()
+        self.mock_github.post.return_value.status_code = 200
+        self.mock_github.post.return_value.json.return_value = {
             "scope": "user,org,bob",
             "access_token": "verytoken"
         }
         payload = {"password": "code123"}
         self.lambda_event['payload'] = payload
-        jwt = JWTAuthentication(self.lambda_event)
-        jwt.auth_desired_oauth_scopes = 'user,org'
-        self.mock_requests.get = MagicMock()
-        self.mock_requests.get.return_value.status_code = 100
-        with self.assertRaises(TypeError) as cm:
-            jwt.dispense_new_jwt()
-        result_json = json.loads(str(cm.exception))
+        self.lambda_event['auth_desired_oauth_scopes'] = 'user,org'
+        jwt = JWTAuthentication.from_event(self.lambda_event)
+        self.mock_github.get = MagicMock()
+        self.mock_github.get.return_value.status_code = 100
+        result_json = jwt.dispense_new_jwt()
         self.assertEqual(result_json.get('http_status'), 401)
         self.assertEqual(result_json.get('data').get('error'),
                          "Could not find GitHub user information")
@@ -91,12 +156,12 @@ class TestJWTAuthNewToken(unittest.TestCase):
     def test_unable_to_persist_bearer_token(self):
         payload = {"password": "code123"}
         self.lambda_event['payload'] = payload
-        jwt = JWTAuthentication(self.lambda_event)
+        jwt = JWTAuthentication.from_event(self.lambda_event)
         jwt.retrieve_bearer_token = MagicMock()
         jwt.retrieve_bearer_token.return_value = "suchtokenWow"
-        self.mock_requests.get = MagicMock()
-        self.mock_requests.get.return_value.status_code = 200
-        self.mock_requests.get.return_value.json.return_value = {
+        self.mock_github.get = MagicMock()
+        self.mock_github.get.return_value.status_code = 200
+        self.mock_github.get.return_value.json.return_value = {
             "user": {
                 "id": "u123",
                 "login": "bob"
@@ -104,9 +169,7 @@ class TestJWTAuthNewToken(unittest.TestCase):
         }
         jwt.store_bearer_token = MagicMock()
         jwt.store_bearer_token.return_value = False
-        with self.assertRaises(TypeError) as cm:
-            jwt.dispense_new_jwt()
-        result_json = json.loads(str(cm.exception))
+        result_json = jwt.dispense_new_jwt()
         self.assertEqual(result_json.get('http_status'), 500)
         self.assertEqual(result_json.get('data').get('error'),
                          "Unable to persist bearer token")
@@ -114,12 +177,12 @@ class TestJWTAuthNewToken(unittest.TestCase):
     def test_get_new_jwt(self):
         payload = {"password": "code123"}
         self.lambda_event['payload'] = payload
-        jwt = JWTAuthentication(self.lambda_event)
+        jwt = JWTAuthentication.from_event(self.lambda_event)
         jwt.retrieve_bearer_token = MagicMock()
         jwt.retrieve_bearer_token.return_value = "suchtokenWow"
-        self.mock_requests.get = MagicMock()
-        self.mock_requests.get.return_value.status_code = 200
-        self.mock_requests.get.return_value.json.return_value = {
+        self.mock_github.get = MagicMock()
+        self.mock_github.get.return_value.status_code = 200
+        self.mock_github.get.return_value.json.return_value = {
             "user": {
                 "id": "u123",
                 "login": "bob"
@@ -130,3 +193,66 @@ class TestJWTAuthNewToken(unittest.TestCase):
         result = jwt.dispense_new_jwt()
         self.assertEqual(result.get('http_status'), 200)
         self.assertTrue("token" in result.get('data'))
+
+    def slow_login(self, persist_mode, store_delay, format_delay=0):
+        self.lambda_event['auth_persist_mode'] = persist_mode
+        jwt = JWTAuthentication.from_event(self.lambda_event)
+        jwt.retrieve_bearer_token = MagicMock(return_value="suchtokenWow")
+        jwt.retrieve_gh_user_info = MagicMock(
+            return_value=("u123", "bob", int(time.time())))
+
+        def slow_store(userid, bearer_token, login=None):
+            time.sleep(store_delay)
+            return True
+        jwt.persist_bearer_token = MagicMock(side_effect=slow_store)
+
+        format_jwt = jwt.format_jwt
+
+        def slow_format(*args):
+            time.sleep(format_delay)
+            return format_jwt(*args)
+        jwt.format_jwt = slow_format
+        return jwt
+
+    def timed_dispense(self, jwt):
+        start = time.time()
+        result = jwt.dispense_new_jwt()
+        return result, time.time() - start
+
+    def test_sync_persist_latency(self):
+        jwt = self.slow_login("sync", store_delay=0.2, format_delay=0.2)
+        result, elapsed = self.timed_dispense(jwt)
+        self.assertEqual(result.get('http_status'), 200)
+        self.assertTrue(elapsed >= 0.4)
+
+    def test_concurrent_persist_latency(self):
+        # The delay stands in for everything a login does after the write
+        # starts; encoding alone takes microseconds, so the real saving is
+        # far smaller than this
+        jwt = self.slow_login("concurrent", store_delay=0.2, format_delay=0.2)
+        result, elapsed = self.timed_dispense(jwt)
+        self.assertEqual(result.get('http_status'), 200)
+        self.assertTrue(elapsed < 0.35)
+        self.assertEqual(jwt.persist_bearer_token.call_count, 1)
+
+    def test_concurrent_persist_timeout(self):
+        self.lambda_event['auth_persist_timeout'] = "0.05"
+        jwt = self.slow_login("concurrent", store_delay=0.2)
+        result_json = jwt.dispense_new_jwt()
+        self.assertEqual(result_json.get('http_status'), 500)
+
+    def test_concurrent_persist_not_queued_behind_validations(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        for _ in range(2 * workers.DEFAULT_POOL_SIZES["validate"]):
+            workers.submit("validate", release.wait, 5)
+        self.lambda_event['auth_persist_timeout'] = "1"
+        jwt = self.slow_login("concurrent", store_delay=0)
+        self.assertEqual(jwt.dispense_new_jwt().get('http_status'), 200)
+
+    def test_deferred_persist_latency(self):
+        jwt = self.slow_login("deferred", store_delay=0.2)
+        result, elapsed = self.timed_dispense(jwt)
+        self.assertEqual(result.get('http_status'), 200)
+        self.assertTrue(elapsed < 0.1)
+        self.assertEqual(jwt.lookup_bearer_token("u123"), "suchtokenWow")
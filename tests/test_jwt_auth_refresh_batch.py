@@ -0,0 +1,142 @@
+import unittest
+from mock import patch
+from mock import MagicMock
+from auth_backend.cache import TTLCache
+from auth_backend.jwt_authentication import JWTAuthentication
+import jwt
+import time
+
+
+class TestJWTAuthRefreshBatch(unittest.TestCase):
+
+    def setUp(self):
+        patcher1 = patch('auth_backend.jwt_authentication.github')
+        self.addCleanup(patcher1.stop)
+        self.mock_github = patcher1.start()
+
+        patcher2 = patch('auth_backend.jwt_authentication.bearer_token_cache',
+                         TTLCache())
+        self.addCleanup(patcher2.stop)
+        self.bearer_token_cache = patcher2.start()
+
+        self.jwt_signing_secret = "shh"
+        self.lambda_event = {
+            "jwt_signing_secret": self.jwt_signing_secret,
+            "jwt_expiry_minutes": "10",
+            "oauth_client_id": "c123",
+            "oauth_client_secret": "shh!",
+            "payload": {},
+            "auth_dynamodb_endpoint_url": "http://example.com",
+            "auth_dynamodb_table_name": "faker"
+        }
+
+    def token_for(self, sub, **claims):
+        claims["sub"] = sub
+        return jwt.encode(claims,
+                          self.jwt_signing_secret,
+                          algorithm='HS256')
+
+    def batch_auth(self, tokens):
+        self.lambda_event['payload'] = {"tokens": tokens}
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        auth.fetch_bearer_tokens = MagicMock(return_value=({
+            "user1": "token1",
+            "user2": "token2"
+        }, []))
+        self.validated_at = int(time.time()) - 45
+        auth.retrieve_gh_user_info = MagicMock(
+            side_effect=lambda bearer_token: {
+                "token1": ("user1", "bob", self.validated_at),
+                "token2": (None, None, None)
+            }[bearer_token]
+        )
+        return auth
+
+    def test_empty_batch(self):
+        auth = self.batch_auth([])
+        result_json = auth.refresh_jwt_batch()
+        self.assertEqual(result_json.get('http_status'), 400)
+
+    def test_batch_too_large(self):
+        self.lambda_event['auth_refresh_batch_max_size'] = "2"
+        auth = self.batch_auth([self.token_for("user1")] * 3)
+        result_json = auth.refresh_jwt_batch()
+        self.assertEqual(result_json.get('http_status'), 400)
+
+    def test_per_token_results(self):
+        auth = self.batch_auth([self.token_for("user1"),
+                                "fake",
+                                self.token_for("user2"),
+                                self.token_for("user3"),
+                                self.token_for("user1")])
+        result = auth.refresh_jwt_batch()
+        self.assertEqual(result.get('http_status'), 200)
+        results = result.get('data').get('results')
+        self.assertEqual([r.get('http_status') for r in results],
+                         [200, 401, 401, 401, 200])
+        decoded = jwt.decode(results[0].get('token'), verify=False)
+        self.assertEqual(decoded.get('validated_at'), self.validated_at)
+        self.assertEqual(results[1].get('error'), "Invalid JSON Web Token")
+        self.assertEqual(results[2].get('error'),
+                         "Could not validate bearer token")
+        self.assertEqual(results[3].get('error'),
+                         "Could not find bearer token in datastore")
+
+    def test_unique_users_fetched_once(self):
+        auth = self.batch_auth([self.token_for("user1"),
+                                self.token_for("user2"),
+                                self.token_for("user1")])
+        auth.refresh_jwt_batch()
+        auth.fetch_bearer_tokens.assert_called_once_with(["user1", "user2"])
+        self.assertEqual(auth.retrieve_gh_user_info.call_count, 2)
+
+    def test_cached_bearer_tokens_skip_datastore(self):
+        self.bearer_token_cache.set(("faker", "user1"), "token1")
+        auth = self.batch_auth([self.token_for("user1"),
+                                self.token_for("user2")])
+        auth.refresh_jwt_batch()
+        auth.fetch_bearer_tokens.assert_called_once_with(["user2"])
+
+    def test_recently_validated_tokens_skip_lookup(self):
+        self.lambda_event['auth_revalidation_window'] = "300"
+        recent = self.token_for("user2",
+                                github_login="alice",
+                                github_token="token2",
+                                validated_at=int(time.time()) - 10)
+        auth = self.batch_auth([recent, self.token_for("user1")])
+        result = auth.refresh_jwt_batch()
+        results = result.get('data').get('results')
+        self.assertEqual([r.get('http_status') for r in results], [200, 200])
+        auth.fetch_bearer_tokens.assert_called_once_with(["user1"])
+        auth.retrieve_gh_user_info.assert_called_once_with("token1")
+        decoded = jwt.decode(results[0].get('token'), verify=False)
+        self.assertEqual(decoded.get('github_login'), "alice")
+
+    @patch('auth_backend.jwt_authentication.time')
+    def test_window_expiring_during_lookup(self, mock_time):
+        now = int(time.time())
+        mock_time.time.return_value = now
+        self.lambda_event['auth_revalidation_window'] = "60"
+        recent = self.token_for("user2",
+                                github_login="alice",
+                                github_token="token2",
+                                validated_at=now - 59)
+        auth = self.batch_auth([recent, self.token_for("user1")])
+
+        def slow_fetch(user_ids):
+            mock_time.time.return_value = now + 2
+            return {"user1": "token1"}, []
+        auth.fetch_bearer_tokens.side_effect = slow_fetch
+        result = auth.refresh_jwt_batch()
+        results = result.get('data').get('results')
+        self.assertEqual([r.get('http_status') for r in results], [200, 200])
+
+    def test_unreadable_items_are_retryable(self):
+        auth = self.batch_auth([self.token_for("user1"),
+                                self.token_for("user2")])
+        auth.fetch_bearer_tokens.return_value = ({"user1": "token1"},
+                                                 ["user2"])
+        result = auth.refresh_jwt_batch()
+        results = result.get('data').get('results')
+        self.assertEqual([r.get('http_status') for r in results], [200, 503])
+        auth.retrieve_gh_user_info.assert_called_once_with("token1")
@@ -1,22 +1,33 @@
 import unittest
 from mock import patch
 from mock import MagicMock
+from auth_backend import jwt_authentication
+from auth_backend import records
 from auth_backend.jwt_authentication import JWTAuthentication
+from auth_backend.jwt_authentication import UpstreamUnavailable
+from auth_backend.jwt_authentication import degraded_validation_cache
+from auth_backend.jwt_authentication import validation_cache
 import json
 import jwt
+import time
 
 
 class TestJWTAuthRefreshToken(unittest.TestCase):
 
     def setUp(self):
-        patcher1 = patch('auth_backend.jwt_authentication.requests')
+        patcher1 = patch('auth_backend.jwt_authentication.github')
         self.addCleanup(patcher1.stop)
-        self.mock_requests = patcher1.start()
+        self.mock_github = patcher1.start()
 
-        patcher2 = patch('auth_backend.jwt_authentication.boto3')
+        patcher2 = patch('boto3.resource')
         self.addCleanup(patcher2.stop)
         self.mock_boto = patcher2.start()
 
+        validation_cache.clear()
+        self.addCleanup(validation_cache.clear)
+        degraded_validation_cache.clear()
+        self.addCleanup(degraded_validation_cache.clear)
+
         self.jwt_signing_secret = "shh"
 
         token = jwt.encode({"sub": "user1"},
@@ -37,15 +48,14 @@ class TestJWTAuthRefreshToken(unittest.TestCase):
     def test_invalid_jwt(self):
         payload = {"token": "fake"}
         self.lambda_event['payload'] = payload
-        auth = JWTAuthentication(self.lambda_event)
-        auth.jwt_signing_secret = self.jwt_signing_secret
-        with self.assertRaises(TypeError) as cm:
-            auth.refresh_jwt()
-        result_json = json.loads(str(cm.exception))
+        self.lambda_event['jwt_signing_secret'] = self.jwt_signing_secret
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        result_json = auth.refresh_jwt()
         self.assertEqual(result_json.get('http_status'), 401)
         self.assertEqual(result_json.get('data').get('error'),
                          "Invalid JSON Web Token")
-        self.assertEqual(len(self.mock_requests.mock_calls), 0)
+        self.assertEqual(len(self.mock_github.post.mock_calls), 0)
+        self.assertEqual(len(self.mock_github.get.mock_calls), 0)
 
     def test_jwt_invalid_subject_field(self):
         token = jwt.encode({"subs": "user1"},
@@ -53,51 +63,49 @@ class TestJWTAuthRefreshToken(unittest.TestCase):
                            algorithm='HS256')
         payload = {"token": token}
         self.lambda_event['payload'] = payload
-        auth = JWTAuthentication(self.lambda_event)
-        auth.jwt_signing_secret = self.jwt_signing_secret
-        with self.assertRaises(TypeError) as cm:
-            auth.refresh_jwt()
-        result_json = json.loads(str(cm.exception))
+        self.lambda_event['jwt_signing_secret'] = self.jwt_signing_secret
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        result_json = auth.refresh_jwt()
         self.assertEqual(result_json.get('http_status'), 401)
         self.assertEqual(result_json.get('data').get('error'),
                          "sub field not present in JWT")
-        self.assertEqual(len(self.mock_requests.mock_calls), 0)
+        self.assertEqual(len(self.mock_github.post.mock_calls), 0)
+        self.assertEqual(len(self.mock_github.get.mock_calls), 0)
 
     def test_bearer_token_not_available(self):
-        auth = JWTAuthentication(self.lambda_event)
-        auth.jwt_signing_secret = self.jwt_signing_secret
+        self.lambda_event['jwt_signing_secret'] = self.jwt_signing_secret
+        auth = JWTAuthentication.from_event(self.lambda_event)
         auth.lookup_bearer_token = MagicMock()
         auth.lookup_bearer_token.return_value = None
-        with self.assertRaises(TypeError) as cm:
-            auth.refresh_jwt()
-        result_json = json.loads(str(cm.exception))
+        result_json = auth.refresh_jwt()
         self.assertEqual(result_json.get('http_status'), 401)
         self.assertEqual(result_json.get('data').get('error'),
                          "Could not find bearer token in datastore")
-        self.assertEqual(len(self.mock_requests.mock_calls), 0)
+        self.assertEqual(len(self.mock_github.post.mock_calls), 0)
+        self.assertEqual(len(self.mock_github.get.mock_calls), 0)
 
     def test_invalid_user_id(self):
-        auth = JWTAuthentication(self.lambda_event)
-        auth.jwt_signing_secret = self.jwt_signing_secret
+        self.lambda_event['jwt_signing_secret'] = self.jwt_signing_secret
+        auth = JWTAuthentication.from_event(self.lambda_event)
         auth.lookup_bearer_token = MagicMock()
         auth.lookup_bearer_token.return_value = "suchtoken"
         auth.retrieve_gh_user_info = MagicMock()
-        auth.retrieve_gh_user_info.return_value = (None, None)
-        with self.assertRaises(TypeError) as cm:
-            auth.refresh_jwt()
-        result_json = json.loads(str(cm.exception))
+        auth.retrieve_gh_user_info.return_value = (None, None, None)
+        result_json = auth.refresh_jwt()
         self.assertEqual(result_json.get('http_status'), 401)
         self.assertEqual(result_json.get('data').get('error'),
                          "Could not validate bearer token")
-        self.assertEqual(len(self.mock_requests.mock_calls), 0)
+        self.assertEqual(len(self.mock_github.post.mock_calls), 0)
+        self.assertEqual(len(self.mock_github.get.mock_calls), 0)
 
     def test_refresh_jwt(self):
-        auth = JWTAuthentication(self.lambda_event)
-        auth.jwt_signing_secret = self.jwt_signing_secret
+        self.lambda_event['jwt_signing_secret'] = self.jwt_signing_secret
+        auth = JWTAuthentication.from_event(self.lambda_event)
         auth.lookup_bearer_token = MagicMock()
         auth.lookup_bearer_token.return_value = "suchtoken"
         auth.retrieve_gh_user_info = MagicMock()
-        auth.retrieve_gh_user_info.return_value = ("manytokenseven", "bob")
+        auth.retrieve_gh_user_info.return_value = ("manytokenseven", "bob",
+                                                   int(time.time()))
         result = auth.refresh_jwt()
         self.assertEqual(result.get('http_status'), 200)
         self.assertTrue("token" in result.get('data'))
@@ -108,10 +116,273 @@ class TestJWTAuthRefreshToken(unittest.TestCase):
                            algorithm='HS256')
         payload = {"token": token}
         self.lambda_event['payload'] = payload
-        auth = JWTAuthentication(self.lambda_event)
+        auth = JWTAuthentication.from_event(self.lambda_event)
         result = auth.format_jwt("123", "bob", "bobstoken")
         self.assertEqual(result.get('http_status'), 200)
         jwt_token = result.get('data').get('token')
         decoded_token = jwt.decode(jwt_token, verify=False)
         self.assertEqual(decoded_token.get('github_login'), "bob")
         self.assertEqual(decoded_token.get('github_token'), "bobstoken")
+
+    def test_validation_is_cached(self):
+        self.mock_github.get.return_value.status_code = 200
+        self.mock_github.get.return_value.json.return_value = {
+            "user": {
+                "id": "u123",
+                "login": "bob"
+            }
+        }
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        user_info = auth.retrieve_gh_user_info("suchtoken")
+        self.assertEqual(user_info[:2], ("u123", "bob"))
+        self.assertEqual(auth.retrieve_gh_user_info("suchtoken"), user_info)
+        self.assertEqual(self.mock_github.get.call_count, 1)
+        self.assertEqual(validation_cache.stats().get('hits'), 1)
+
+    def degraded_validation(self, breaker_open):
+        self.mock_github.get.return_value.status_code = 200
+        self.mock_github.get.return_value.json.return_value = {
+            "user": {
+                "id": "u123",
+                "login": "bob"
+            }
+        }
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        with patch('auth_backend.jwt_authentication.time') as mock_time:
+            mock_time.time.return_value = 1000.0
+            auth.retrieve_gh_user_info("suchtoken")
+        validation_cache.clear()
+        self.mock_github.get.return_value = None
+        with patch('auth_backend.jwt_authentication.breaker') as mock_breaker:
+            mock_breaker.get.return_value.is_open.return_value = breaker_open
+            return auth.retrieve_gh_user_info("suchtoken")
+
+    def test_degraded_validation_while_breaker_open(self):
+        self.assertEqual(self.degraded_validation(breaker_open=True),
+                         ("u123", "bob", 1000))
+        self.assertEqual(degraded_validation_cache.stats().get('hits'), 1)
+
+    def test_no_degraded_validation_while_breaker_closed(self):
+        with self.assertRaises(UpstreamUnavailable):
+            self.degraded_validation(breaker_open=False)
+
+    def test_outage_without_degraded_validation(self):
+        self.lambda_event['jwt_signing_secret'] = self.jwt_signing_secret
+        self.mock_github.get.return_value = None
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        auth.lookup_bearer_token = MagicMock(return_value="suchtoken")
+        result = auth.refresh_jwt()
+        self.assertEqual(result.get('http_status'), 503)
+        self.assertEqual(result.get('data').get('error'),
+                         jwt_authentication.UNAVAILABLE_MSG)
+
+    def test_rejected_validation_is_cached(self):
+        self.mock_github.get.return_value.status_code = 404
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        self.assertEqual(auth.retrieve_gh_user_info("suchtoken"),
+                         (None, None, None))
+        self.assertEqual(auth.retrieve_gh_user_info("suchtoken"),
+                         (None, None, None))
+        self.assertEqual(self.mock_github.get.call_count, 1)
+
+    def test_refresh_keeps_cached_validation_time(self):
+        self.lambda_event['jwt_signing_secret'] = self.jwt_signing_secret
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        auth.lookup_bearer_token = MagicMock(return_value="suchtoken")
+        validated_at = int(time.time()) - 45
+        validation_cache.set(auth.validation_cache_key("suchtoken"),
+                             ("user1", "bob", validated_at))
+        result = auth.refresh_jwt()
+        decoded = jwt.decode(result.get('data').get('token'), verify=False)
+        self.assertEqual(decoded.get('validated_at'), validated_at)
+        self.assertEqual(self.mock_github.get.call_count, 0)
+
+    def test_failed_validation_is_not_cached(self):
+        self.mock_github.get.return_value.status_code = 500
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        for _ in range(2):
+            with self.assertRaises(UpstreamUnavailable):
+                auth.retrieve_gh_user_info("suchtoken")
+        self.assertEqual(self.mock_github.get.call_count, 2)
+
+    def test_refresh_rotates_signing_key(self):
+        self.lambda_event['jwt_signing_keys'] = json.dumps({
+            "old": self.jwt_signing_secret,
+            "new": "n3w"
+        })
+        self.lambda_event['jwt_active_kid'] = "new"
+        self.lambda_event['payload'] = {
+            "token": jwt.encode({"sub": "user1"},
+                                self.jwt_signing_secret,
+                                algorithm='HS256',
+                                headers={"kid": "old"})
+        }
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        auth.lookup_bearer_token = MagicMock(return_value="suchtoken")
+        auth.retrieve_gh_user_info = MagicMock(
+            return_value=("user1", "bob", int(time.time())))
+        result = auth.refresh_jwt()
+        self.assertEqual(result.get('http_status'), 200)
+        new_token = result.get('data').get('token')
+        self.assertEqual(jwt.get_unverified_header(new_token).get('kid'),
+                         "new")
+        self.assertEqual(jwt.decode(new_token, "n3w").get('sub'), "user1")
+
+    def grace_window_auth(self, validated_ago, **claims):
+        now = int(time.time())
+        token_claims = {"sub": "user1",
+                        "github_login": "bob",
+                        "github_token": "suchtoken",
+                        "iat": now - 30}
+        if validated_ago is not None:
+            token_claims["validated_at"] = now - validated_ago
+        token_claims.update(claims)
+        self.lambda_event['jwt_signing_secret'] = self.jwt_signing_secret
+        self.lambda_event['auth_revalidation_window'] = "300"
+        self.lambda_event['payload'] = {
+            "token": jwt.encode(dict((k, v) for k, v in token_claims.items()
+                                     if v is not None),
+                                self.jwt_signing_secret,
+                                algorithm='HS256')
+        }
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        auth.lookup_bearer_token = MagicMock(return_value="suchtoken")
+        auth.retrieve_gh_user_info = MagicMock(
+            return_value=("user1", "bob", int(time.time())))
+        return auth
+
+    def test_refresh_within_grace_window_skips_io(self):
+        auth = self.grace_window_auth(validated_ago=60)
+        original = jwt.decode(auth.payload["token"], verify=False)
+        result = auth.refresh_jwt()
+        self.assertEqual(result.get('http_status'), 200)
+        self.assertEqual(auth.lookup_bearer_token.call_count, 0)
+        self.assertEqual(auth.retrieve_gh_user_info.call_count, 0)
+        decoded = jwt.decode(result.get('data').get('token'), verify=False)
+        self.assertEqual(decoded.get('sub'), "user1")
+        self.assertEqual(decoded.get('github_login'), "bob")
+        self.assertEqual(decoded.get('github_token'), "suchtoken")
+        self.assertEqual(decoded.get('validated_at'),
+                         original.get('validated_at'))
+        self.assertTrue(decoded.get('iat') >= original.get('iat'))
+
+    def test_refresh_after_grace_window_revalidates(self):
+        auth = self.grace_window_auth(validated_ago=600)
+        result = auth.refresh_jwt()
+        self.assertEqual(result.get('http_status'), 200)
+        self.assertEqual(auth.retrieve_gh_user_info.call_count, 1)
+        decoded = jwt.decode(result.get('data').get('token'), verify=False)
+        self.assertTrue(decoded.get('validated_at') >= int(time.time()) - 1)
+
+    def test_grace_window_uses_iat_of_older_tokens(self):
+        auth = self.grace_window_auth(validated_ago=None,
+                                      iat=int(time.time()) - 600)
+        auth.refresh_jwt()
+        self.assertEqual(auth.retrieve_gh_user_info.call_count, 1)
+
+    def test_grace_window_needs_github_claims(self):
+        auth = self.grace_window_auth(validated_ago=60, github_token=None)
+        auth.refresh_jwt()
+        self.assertEqual(auth.retrieve_gh_user_info.call_count, 1)
+
+    def test_reference_mode_omits_github_token(self):
+        self.lambda_event['jwt_github_token_mode'] = "reference"
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        result = auth.format_jwt("123", "bob", "bobstoken")
+        decoded = jwt.decode(result.get('data').get('token'), verify=False)
+        self.assertFalse("github_token" in decoded)
+        self.assertEqual(decoded.get('github_ref'),
+                         records.token_reference("bobstoken"))
+
+    def test_grace_window_remints_references(self):
+        self.lambda_event['jwt_github_token_mode'] = "reference"
+        auth = self.grace_window_auth(validated_ago=60, github_token=None,
+                                      github_ref="ref")
+        result = auth.refresh_jwt()
+        self.assertEqual(auth.retrieve_gh_user_info.call_count, 0)
+        decoded = jwt.decode(result.get('data').get('token'), verify=False)
+        self.assertEqual(decoded.get('github_ref'), "ref")
+
+    def test_grace_window_needs_token_outside_reference_mode(self):
+        auth = self.grace_window_auth(validated_ago=60, github_token=None,
+                                      github_ref="ref")
+        auth.refresh_jwt()
+        self.assertEqual(auth.retrieve_gh_user_info.call_count, 1)
+
+    def test_grace_window_disabled_by_default(self):
+        auth = self.grace_window_auth(validated_ago=60)
+        self.lambda_event.pop('auth_revalidation_window')
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        auth.lookup_bearer_token = MagicMock(return_value="suchtoken")
+        auth.retrieve_gh_user_info = MagicMock(
+            return_value=("user1", "bob", int(time.time())))
+        auth.refresh_jwt()
+        self.assertEqual(auth.retrieve_gh_user_info.call_count, 1)
+
+    def test_jwks_cache_headers(self):
+        self.lambda_event['jwt_jwks_max_age'] = "60"
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        result = auth.jwks()
+        self.assertEqual(result.get('http_status'), 200)
+        self.assertEqual(result.get('data'), {"keys": []})
+        self.assertEqual(result.get('headers').get('Cache-Control'),
+                         "public, max-age=60")
+
+    def revocation_auth(self, claims):
+        self.lambda_event['jwt_signing_secret'] = self.jwt_signing_secret
+        self.lambda_event['auth_revocation_table_name'] = "revoked"
+        self.lambda_event['payload'] = {
+            "token": jwt.encode(claims, self.jwt_signing_secret,
+                                algorithm='HS256')
+        }
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        auth.revocation_list = MagicMock()
+        auth.revocation_list.return_value.is_revoked.return_value = False
+        auth.lookup_bearer_token = MagicMock(return_value="suchtoken")
+        auth.retrieve_gh_user_info = MagicMock(
+            return_value=("user1", "bob", int(time.time())))
+        return auth
+
+    def test_jti_preserved_across_refresh(self):
+        auth = self.revocation_auth({"sub": "user1", "jti": "abc"})
+        result = auth.refresh_jwt()
+        decoded = jwt.decode(result.get('data').get('token'), verify=False)
+        self.assertEqual(decoded.get('jti'), "abc")
+        auth.revocation_list.return_value.is_revoked.assert_called_once_with(
+            "abc"
+        )
+
+    def test_revoked_jwt_rejected(self):
+        auth = self.revocation_auth({"sub": "user1", "jti": "abc"})
+        auth.revocation_list.return_value.is_revoked.return_value = True
+        result = auth.refresh_jwt()
+        self.assertEqual(result.get('http_status'), 401)
+        self.assertEqual(result.get('data').get('error'),
+                         "Token has been revoked")
+        self.assertEqual(auth.lookup_bearer_token.call_count, 0)
+
+    def test_revoke_jwt(self):
+        self.lambda_event['auth_revocation_sync_interval'] = "10"
+        auth = self.revocation_auth({"sub": "user1", "jti": "abc"})
+        now = int(time.time())
+        result = auth.revoke_jwt()
+        self.assertEqual(result.get('http_status'), 200)
+        self.assertEqual(result.get('data'), {"revoked": "abc"})
+        jti, expires_at = auth.revocation_list.return_value.revoke.call_args[0]
+        self.assertEqual(jti, "abc")
+        self.assertTrue(expires_at >= now + 600 + 10 + 5)
+
+    def test_revoke_jwt_without_jti(self):
+        auth = self.revocation_auth({"sub": "user1"})
+        result = auth.revoke_jwt()
+        self.assertEqual(result.get('http_status'), 401)
+        self.assertEqual(result.get('data').get('error'),
+                         "jti field not present in JWT")
+
+    def test_revocation_disabled_by_default(self):
+        auth = JWTAuthentication.from_event(self.lambda_event)
+        self.assertTrue(auth.revocation_list() is None)
+        result = auth.revoke_jwt()
+        self.assertEqual(result.get('http_status'), 400)
+        self.assertEqual(result.get('data').get('error'),
+                         "Token revocation is not enabled")
@@ -0,0 +1,44 @@
+import unittest
+import json
+from auth_backend import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_snapshot(self):
+        metrics.incr("requests")
+        metrics.incr("requests", 2)
+        metrics.record("github.validate", 0.010)
+        metrics.record("github.validate", 0.030)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["counters"], {"requests": 3})
+        self.assertEqual(snapshot["timers"]["github.validate"]["count"], 2)
+        self.assertAlmostEqual(
+            snapshot["timers"]["github.validate"]["mean_ms"], 20.0)
+        self.assertAlmostEqual(
+            snapshot["timers"]["github.validate"]["max_ms"], 30.0)
+
+    def test_emf_carries_changes_since_last_emission(self):
+        metrics.incr("responses.401", 2)
+        metrics.record("jwt.decode", 0.002)
+        document = json.loads(metrics.emf(dimensions={"Service": "auth"}))
+        definition = document["_aws"]["CloudWatchMetrics"][0]
+        self.assertEqual(definition["Dimensions"], [["Service"]])
+        self.assertEqual(definition["Metrics"], [
+            {"Name": "responses.401", "Unit": "Count"},
+            {"Name": "jwt.decode", "Unit": "Milliseconds"}
+        ])
+        self.assertEqual(document["Service"], "auth")
+        self.assertEqual(document["responses.401"], 2)
+        self.assertAlmostEqual(document["jwt.decode"], 2.0)
+
+        self.assertEqual(metrics.emf(), None)
+        metrics.incr("responses.401")
+        document = json.loads(metrics.emf())
+        self.assertEqual(document["responses.401"], 1)
+        self.assertFalse("jwt.decode" in document)
+        self.assertEqual(metrics.snapshot()["counters"]["responses.401"], 3)
@@ -0,0 +1,192 @@
+import unittest
+from mock import patch
+from mock import MagicMock
+from auth_backend import jwt_authentication
+from auth_backend import metrics
+from auth_backend import prerefresh
+from auth_backend.jwt_authentication import JWTAuthentication
+from auth_backend.prerefresh import Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        patcher1 = patch('auth_backend.prerefresh.time')
+        self.addCleanup(patcher1.stop)
+        self.mock_time = patcher1.start()
+        self.mock_time.time.return_value = 1000.0
+
+        patcher2 = patch('auth_backend.jwt_authentication.JWTAuthentication')
+        self.addCleanup(patcher2.stop)
+        self.mock_auth = patcher2.start().return_value
+        self.expiries = {}
+        self.mock_auth.next_expiry.side_effect = self.expiries.get
+
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.config = MagicMock()
+
+    def scheduler(self, **settings):
+        settings.setdefault("jitter", 0)
+        scheduler = Scheduler(**settings)
+        self.addCleanup(scheduler.stop)
+        return scheduler
+
+    def test_due_before_expiry(self):
+        scheduler = self.scheduler(lead_time=10)
+        for user_id in ["u1", "u2", "u3"]:
+            scheduler.track(self.config, user_id)
+        self.expiries.update({"u1": 1005.0, "u2": 1060.0})
+        self.assertEqual(list(scheduler.due()),
+                         [("u1", self.config, 10.0)])
+
+    def test_jitter_moves_refreshes_earlier(self):
+        scheduler = self.scheduler(lead_time=10, jitter=5)
+        scheduler.track(self.config, "u1")
+        horizon = list(scheduler.active_users())[0][2] + 10
+        self.assertTrue(10 <= horizon <= 15)
+
+    def test_refreshes_within_budget(self):
+        scheduler = self.scheduler(budget=1)
+        for user_id in ["u1", "u2", "u3"]:
+            scheduler.track(self.config, user_id)
+            self.expiries[user_id] = 1001.0
+        scheduler.run_once()
+        scheduler.executor.shutdown(wait=True)
+        self.assertEqual(self.mock_auth.prerefresh.call_count, 1)
+        self.assertEqual(scheduler.stats(), {"tracked": 3,
+                                             "in_flight": 0,
+                                             "refreshed": 1,
+                                             "deferred": 1})
+        counters = metrics.snapshot().get('counters')
+        self.assertEqual(counters.get('prerefresh.refreshed'), 1)
+        self.assertEqual(counters.get('prerefresh.deferred'), 1)
+
+    def test_refresh_errors_counted(self):
+        scheduler = self.scheduler()
+        self.mock_auth.prerefresh.side_effect = Exception("boom")
+        scheduler.refresh("u1", self.config, 10)
+        counters = metrics.snapshot().get('counters')
+        self.assertEqual(counters.get('prerefresh.errors'), 1)
+        self.assertEqual(scheduler.stats().get('in_flight'), 0)
+
+    def test_outage_counted(self):
+        scheduler = self.scheduler()
+        self.mock_auth.prerefresh.side_effect = \
+            jwt_authentication.UpstreamUnavailable("down")
+        scheduler.refresh("u1", self.config, 10)
+        counters = metrics.snapshot().get('counters')
+        self.assertEqual(counters.get('prerefresh.unavailable'), 1)
+        self.assertEqual(counters.get('prerefresh.errors'), None)
+
+    def test_idle_users_dropped(self):
+        scheduler = self.scheduler(idle_timeout=60)
+        scheduler.track(self.config, "u1")
+        self.mock_time.time.return_value = 1030.0
+        scheduler.track(self.config, "u2")
+        self.mock_time.time.return_value = 1070.0
+        self.assertEqual([u for u, _, _ in scheduler.active_users()], ["u2"])
+        self.assertEqual(scheduler.stats().get('tracked'), 1)
+
+    def test_tracked_users_bounded(self):
+        scheduler = self.scheduler(max_users=2)
+        for user_id in ["u1", "u2", "u1", "u3"]:
+            scheduler.track(self.config, user_id)
+        self.assertEqual([u for u, _, _ in scheduler.active_users()],
+                         ["u1", "u3"])
+
+
+class TestSchedulerRegistry(unittest.TestCase):
+
+    def setUp(self):
+        prerefresh.stop()
+        self.addCleanup(prerefresh.stop)
+
+    def test_track_without_scheduler(self):
+        prerefresh.track(MagicMock(), "u1")
+        self.assertEqual(prerefresh._scheduler, None)
+
+    def test_start_and_stop(self):
+        scheduler = prerefresh.start(workers=1, interval=60)
+        self.assertTrue(prerefresh.start() is scheduler)
+        prerefresh.track(MagicMock(), "u1")
+        self.assertEqual(metrics.snapshot().get('prerefresh').get('tracked'),
+                         1)
+        prerefresh.stop()
+        self.assertEqual(prerefresh._scheduler, None)
+
+
+class TestPrerefresh(unittest.TestCase):
+
+    def setUp(self):
+        patcher1 = patch('auth_backend.jwt_authentication.github')
+        self.addCleanup(patcher1.stop)
+        self.mock_github = patcher1.start()
+        self.mock_github.get.return_value.status_code = 200
+        self.mock_github.get.return_value.json.return_value = {
+            "user": {
+                "id": "u1",
+                "login": "bob"
+            }
+        }
+
+        patcher2 = patch('auth_backend.jwt_authentication.bearer_token_cache',
+                         jwt_authentication.TTLCache(ttl=300))
+        self.addCleanup(patcher2.stop)
+        patcher2.start()
+
+        jwt_authentication.validation_cache.clear()
+        self.addCleanup(jwt_authentication.validation_cache.clear)
+
+        self.auth = JWTAuthentication.from_event({
+            "payload": {},
+            "jwt_signing_secret": "shh",
+            "oauth_client_id": "c123",
+            "auth_dynamodb_endpoint_url": "http://example.com",
+            "auth_dynamodb_table_name": "faker"
+        })
+        self.auth.fetch_bearer_token = MagicMock()
+        self.auth.fetch_bearer_token.return_value = "suchtoken"
+
+    def warm(self):
+        self.auth.lookup_bearer_token("u1")
+        self.auth.retrieve_gh_user_info("suchtoken")
+
+    def test_next_expiry(self):
+        self.assertEqual(self.auth.next_expiry("u1"), None)
+        self.auth.lookup_bearer_token("u1")
+        bearer_expiry = self.auth.next_expiry("u1")
+        self.auth.retrieve_gh_user_info("suchtoken")
+        self.assertTrue(self.auth.next_expiry("u1") < bearer_expiry - 200)
+
+    def test_revalidates_expiring_validation(self):
+        self.warm()
+        self.auth.prerefresh("u1", 120)
+        self.assertEqual(self.mock_github.get.call_count, 2)
+        self.assertEqual(self.auth.fetch_bearer_token.call_count, 1)
+
+    def test_reloads_expiring_bearer_token(self):
+        self.warm()
+        self.auth.prerefresh("u1", 400)
+        self.assertEqual(self.auth.fetch_bearer_token.call_count, 2)
+        self.assertEqual(self.mock_github.get.call_count, 2)
+
+    def test_changed_bearer_token_not_revalidated(self):
+        self.warm()
+        self.auth.fetch_bearer_token.return_value = "othertoken"
+        self.auth.prerefresh("u1", 400)
+        self.assertEqual(self.mock_github.get.call_count, 1)
+
+    def test_rejected_validation_left_to_expire(self):
+        self.mock_github.get.return_value.status_code = 404
+        self.warm()
+        self.assertEqual(self.auth.next_expiry("u1"),
+                         jwt_authentication.bearer_token_cache.entry(
+                             ("faker", "u1"))[0])
+        self.auth.prerefresh("u1", 120)
+        self.assertEqual(self.mock_github.get.call_count, 1)
+
+    @patch('auth_backend.jwt_authentication.prerefresh')
+    def test_minted_tokens_tracked(self, mock_prerefresh):
+        self.auth.format_jwt("u1", "bob", "suchtoken")
+        mock_prerefresh.track.assert_called_once_with(self.auth.config, "u1")
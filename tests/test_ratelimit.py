@@ -0,0 +1,104 @@
+import unittest
+from botocore.exceptions import ClientError
+from mock import patch
+from auth_backend import ratelimit
+from auth_backend.ratelimit import DynamoDBRateLimiter
+from auth_backend.ratelimit import TokenBucketLimiter
+
+
+class TestTokenBucketLimiter(unittest.TestCase):
+
+    def setUp(self):
+        patcher1 = patch('auth_backend.ratelimit.time')
+        self.addCleanup(patcher1.stop)
+        self.mock_time = patcher1.start()
+        self.mock_time.time.return_value = 1000.0
+
+    def test_burst_then_refill(self):
+        limiter = TokenBucketLimiter(rate=1, burst=3)
+        self.assertEqual([limiter.acquire("a") for _ in range(4)],
+                         [True, True, True, False])
+        self.mock_time.time.return_value = 1001.5
+        self.assertTrue(limiter.acquire("a"))
+        self.assertFalse(limiter.acquire("a"))
+        self.assertEqual(limiter.stats(), {"clients": 1,
+                                           "allowed": 4,
+                                           "rejected": 2})
+
+    def test_keys_are_independent(self):
+        limiter = TokenBucketLimiter(rate=1, burst=1)
+        self.assertTrue(limiter.acquire("a"))
+        self.assertFalse(limiter.acquire("a"))
+        self.assertTrue(limiter.acquire("b"))
+
+    def test_least_recently_seen_forgotten(self):
+        limiter = TokenBucketLimiter(rate=1, burst=1, maxsize=2)
+        for key in ["a", "b", "c"]:
+            limiter.acquire(key)
+        self.assertEqual(limiter.stats()["clients"], 2)
+        self.assertTrue(limiter.acquire("a"))
+        self.assertFalse(limiter.acquire("c"))
+
+    def test_retry_after(self):
+        self.assertEqual(TokenBucketLimiter(rate=0.2, burst=1).retry_after(),
+                         5)
+
+
+class TestDynamoDBRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        patcher1 = patch('auth_backend.ratelimit.datastore.get_table')
+        self.addCleanup(patcher1.stop)
+        self.mock_table = patcher1.start().return_value
+
+        patcher2 = patch('auth_backend.ratelimit.time')
+        self.addCleanup(patcher2.stop)
+        patcher2.start().time.return_value = 1005.0
+
+        self.limiter = DynamoDBRateLimiter("http://example.com", "limits",
+                                           rate=1, burst=10)
+
+    def test_conditional_counter(self):
+        self.assertTrue(self.limiter.acquire("ip:1.2.3.4"))
+        kwargs = self.mock_table.update_item.call_args[1]
+        self.assertEqual(kwargs["Key"], {"limit_key": "ip:1.2.3.4:100"})
+        self.assertEqual(kwargs["ExpressionAttributeValues"][":burst"], 10)
+        self.assertEqual(kwargs["ExpressionAttributeValues"][":expires"],
+                         1020)
+        self.assertEqual(self.limiter.retry_after(), 5)
+
+    def test_limit_reached(self):
+        self.mock_table.update_item.side_effect = ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException"}},
+            "UpdateItem"
+        )
+        self.assertFalse(self.limiter.acquire("ip:1.2.3.4"))
+
+    def test_fails_open(self):
+        self.mock_table.update_item.side_effect = ClientError(
+            {"Error": {"Code": "ProvisionedThroughputExceededException"}},
+            "UpdateItem"
+        )
+        self.assertTrue(self.limiter.acquire("ip:1.2.3.4"))
+
+
+class TestGetLimiter(unittest.TestCase):
+
+    def setUp(self):
+        ratelimit.reset()
+        self.addCleanup(ratelimit.reset)
+
+    def test_limiters_shared(self):
+        limiter = ratelimit.get_limiter("memory", 1.0, 5)
+        self.assertTrue(isinstance(limiter, TokenBucketLimiter))
+        self.assertTrue(ratelimit.get_limiter("memory", 1.0, 5) is limiter)
+        self.assertFalse(ratelimit.get_limiter("memory", 2.0, 5) is limiter)
+        self.assertTrue(isinstance(
+            ratelimit.get_limiter("dynamodb", 1.0, 5, "http://x", "t"),
+            DynamoDBRateLimiter
+        ))
+
+    def test_pluggable_limiter(self):
+        shared = TokenBucketLimiter(1, 1)
+        ratelimit.use_limiter(shared)
+        self.assertTrue(ratelimit.get_limiter("memory", 1.0, 5) is shared)
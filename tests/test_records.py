@@ -0,0 +1,63 @@
+import unittest
+from boto3.dynamodb.types import Binary
+from cryptography.fernet import Fernet
+from auth_backend import records
+from auth_backend.records import BearerTokenRecord
+from auth_backend.records import RecordCodec
+from auth_backend.records import RecordError
+
+
+class TestRecordCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.record = BearerTokenRecord("gho_" + "a" * 36, "octocat",
+                                        1700000000)
+
+    def test_round_trip(self):
+        codec = RecordCodec()
+        data = codec.encode(self.record)
+        self.assertEqual(len(data), records.HEADER.size + 7 + 40)
+        self.assertEqual(codec.decode(data), self.record)
+
+    def test_encrypted_round_trip(self):
+        key = Fernet.generate_key().decode('ascii')
+        codec = RecordCodec([key])
+        data = codec.encode(self.record)
+        self.assertFalse(self.record.bearer_token.encode('ascii') in data)
+        self.assertEqual(codec.decode(data), self.record)
+
+        rotated = RecordCodec([Fernet.generate_key().decode('ascii'), key])
+        self.assertEqual(rotated.decode(data), self.record)
+        with self.assertRaises(RecordError):
+            RecordCodec().decode(data)
+        with self.assertRaises(RecordError):
+            RecordCodec([Fernet.generate_key().decode('ascii')]).decode(data)
+
+    def test_unknown_version(self):
+        data = RecordCodec().encode(self.record)
+        with self.assertRaises(RecordError):
+            RecordCodec().decode(b"\x02" + data[1:])
+        with self.assertRaises(RecordError):
+            RecordCodec().decode(data[:3])
+
+    def test_items(self):
+        codec = RecordCodec()
+        item = codec.item(123, self.record)
+        self.assertEqual(item["user_id"], 123)
+        self.assertEqual(item["token_hash"],
+                         records.token_hash(self.record.bearer_token))
+        item["record"] = Binary(item["record"])
+        self.assertEqual(codec.read_item(item), self.record)
+
+    def test_plain_items(self):
+        codec = RecordCodec()
+        self.assertEqual(codec.read_item({"user_id": 1,
+                                          "bearer_token": "abc"}),
+                         BearerTokenRecord("abc", None, None))
+        self.assertEqual(codec.read_item({"user_id": 1}), None)
+
+    def test_token_reference(self):
+        reference = records.token_reference("abc")
+        self.assertEqual(len(reference), 22)
+        self.assertEqual(reference, records.token_reference("abc"))
+        self.assertNotEqual(reference, records.token_reference("abd"))
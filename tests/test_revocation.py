@@ -0,0 +1,114 @@
+import unittest
+from botocore.exceptions import ClientError
+from mock import MagicMock
+from mock import patch
+from auth_backend import revocation
+from auth_backend.revocation import RevocationIndex
+from auth_backend.revocation import RevocationList
+from auth_backend.revocation import RevocationStore
+
+
+class TestRevocationIndex(unittest.TestCase):
+
+    def test_membership(self):
+        index = RevocationIndex().merged(
+            [("jti-%d" % i, 2000) for i in range(100)], now=1000
+        )
+        self.assertEqual(len(index), 100)
+        self.assertEqual(len(index.data), 100 * revocation.ENTRY.size)
+        for i in range(100):
+            self.assertTrue("jti-%d" % i in index)
+        self.assertFalse("jti-100" in index)
+        self.assertFalse("jti-0" in RevocationIndex())
+
+    def test_expired_entries_pruned(self):
+        index = RevocationIndex().merged([("old", 1500), ("new", 2500)],
+                                         now=1000)
+        index = index.merged([("newer", 3000)], now=2000)
+        self.assertFalse("old" in index)
+        self.assertTrue("new" in index)
+        self.assertTrue("newer" in index)
+        self.assertEqual(len(index), 2)
+
+    def test_later_expiry_kept(self):
+        index = RevocationIndex().merged([("a", 3000), ("a", 1500)], now=1000)
+        index = index.merged([], now=2000)
+        self.assertTrue("a" in index)
+
+
+class TestRevocationStore(unittest.TestCase):
+
+    def setUp(self):
+        patcher1 = patch('auth_backend.revocation.datastore.get_table')
+        self.addCleanup(patcher1.stop)
+        self.mock_table = patcher1.start().return_value
+        self.store = RevocationStore("http://example.com", "revoked")
+
+    def test_revoke(self):
+        self.store.revoke("abc", 2000)
+        item = self.mock_table.put_item.call_args[1]["Item"]
+        self.assertEqual(item["partition"], "revoked")
+        self.assertTrue(item["cursor"].endswith(":abc"))
+        self.assertEqual(len(item["cursor"]), 13 + 4)
+        self.assertEqual(item["expires_at"], 2000)
+
+    def test_changes_since_pages_through_results(self):
+        self.mock_table.query.side_effect = [
+            {"Items": [{"jti": "a", "expires_at": 2000,
+                        "cursor": "0000000010000:a"}],
+             "LastEvaluatedKey": {"cursor": "0000000010000:a"}},
+            {"Items": [{"jti": "b", "expires_at": 3000,
+                        "cursor": "0000000012000:b"}]}
+        ]
+        revocations, cursor = self.store.changes_since(9000)
+        self.assertEqual(revocations, [("a", 2000), ("b", 3000)])
+        self.assertEqual(cursor, 12000)
+        first, second = self.mock_table.query.call_args_list
+        self.assertEqual(first[1]["ExpressionAttributeValues"][":since"],
+                         "0000000004000")
+        self.assertEqual(second[1]["ExclusiveStartKey"],
+                         {"cursor": "0000000010000:a"})
+
+
+class TestRevocationList(unittest.TestCase):
+
+    def setUp(self):
+        patcher1 = patch('auth_backend.revocation.time')
+        self.addCleanup(patcher1.stop)
+        self.mock_time = patcher1.start()
+        self.mock_time.time.return_value = 1000.0
+
+        self.store = MagicMock()
+        self.store.changes_since.return_value = ([("a", 2000)], 5000)
+        self.revocation_list = RevocationList(self.store, sync_interval=5)
+
+    def test_synced_incrementally(self):
+        self.assertTrue(self.revocation_list.is_revoked("a"))
+        self.assertFalse(self.revocation_list.is_revoked("b"))
+        self.assertEqual(self.store.changes_since.call_count, 1)
+
+        self.store.changes_since.return_value = ([("b", 2000)], 6000)
+        self.mock_time.time.return_value = 1006.0
+        self.assertTrue(self.revocation_list.is_revoked("b"))
+        self.assertTrue(self.revocation_list.is_revoked("a"))
+        self.store.changes_since.assert_called_with(5000)
+        self.assertEqual(self.revocation_list.stats(),
+                         {"revoked": 2, "cursor": 6000})
+
+    def test_sync_failure_keeps_index(self):
+        self.revocation_list.is_revoked("a")
+        self.store.changes_since.side_effect = ClientError(
+            {"Error": {"Code": "InternalServerError"}}, "Query"
+        )
+        self.mock_time.time.return_value = 1006.0
+        self.assertTrue(self.revocation_list.is_revoked("a"))
+        self.assertEqual(self.revocation_list.cursor, 5000)
+        self.revocation_list.is_revoked("a")
+        self.assertEqual(self.store.changes_since.call_count, 2)
+
+    def test_revoke_is_visible_immediately(self):
+        self.revocation_list.is_revoked("a")
+        self.revocation_list.revoke("c", 2000)
+        self.store.revoke.assert_called_once_with("c", 2000)
+        self.assertTrue(self.revocation_list.is_revoked("c"))
+        self.assertEqual(self.store.changes_since.call_count, 1)
@@ -0,0 +1,120 @@
+import unittest
+import json
+import threading
+from mock import patch
+import requests
+import server
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        patcher1 = patch('server.handler')
+        self.addCleanup(patcher1.stop)
+        self.mock_handler = patcher1.start()
+        self.mock_handler.return_value = {"http_status": 200,
+                                          "data": {"version": "test"}}
+
+        patcher2 = patch('server.datastore')
+        self.addCleanup(patcher2.stop)
+        patcher2.start()
+
+        self.config = server.load_config({
+            "OAUTH_CLIENT_ID": "c123",
+            "OAUTH_CLIENT_SECRET": "shh!",
+            "DYNAMODB_ENDPOINT_URL": "http://example.com",
+            "DYNAMODB_TABLE_NAME": "faker",
+            "DESIRED_OAUTH_SCOPES": "user",
+            "SERVER_WORKERS": "2",
+            "SERVER_MAX_BODY_BYTES": "32"
+        })
+        self.httpd = server.make_server("127.0.0.1", 0, self.config,
+                                        quiet=True)
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.start()
+        self.addCleanup(self.stop_server)
+        self.base_url = "http://127.0.0.1:%s" % self.httpd.server_address[1]
+
+    def stop_server(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def test_load_config(self):
+        self.assertEqual(self.config.get('workers'), 2)
+        base_event = self.config.get('base_event')
+        self.assertEqual(base_event.get('oauth_client_id'), "c123")
+        self.assertEqual(base_event.get('github_pool_size'), 2)
+        self.assertEqual(self.config.get('prerefresh'), None)
+
+    def test_load_prerefresh_config(self):
+        self.assertEqual(server.load_prerefresh_config({
+            "SERVER_PREREFRESH_WORKERS": "4",
+            "SERVER_PREREFRESH_BUDGET": "2.5"
+        }), {"workers": 4, "budget": 2.5})
+        self.assertEqual(server.load_prerefresh_config({
+            "SERVER_PREREFRESH_WORKERS": "0"
+        }), None)
+
+    def test_event_built_from_config(self):
+        r = requests.post(self.base_url + "/auth/token",
+                          data=json.dumps({"password": "p"}))
+        self.assertEqual(r.status_code, 200)
+        event = self.mock_handler.call_args[0][0]
+        self.assertEqual(event.get('resource-path'), "/auth/token")
+        self.assertEqual(event.get('payload'), {"password": "p"})
+        self.assertEqual(event.get('auth_dynamodb_table_name'), "faker")
+        self.assertEqual(event.get('source-ip'), "127.0.0.1")
+
+    def test_error_response(self):
+        self.mock_handler.return_value = {
+            "http_status": 401,
+            "data": {"error": "Not Authorized"}
+        }
+        r = requests.get(self.base_url + "/auth/refresh")
+        self.assertEqual(r.status_code, 401)
+        self.assertEqual(r.json(), {"error": "Not Authorized"})
+        event = self.mock_handler.call_args[0][0]
+        self.assertEqual(event.get('auth_error_mode'), "return")
+
+    def test_metrics_snapshot(self):
+        r = requests.get(self.base_url + "/auth/metrics")
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue("counters" in r.json())
+        self.assertTrue("timers" in r.json())
+        self.assertEqual(self.mock_handler.call_count, 0)
+
+    def test_keepalive(self):
+        session = requests.Session()
+        for _ in range(3):
+            r = session.get(self.base_url + "/auth/ping")
+            self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(self.httpd.connections), 1)
+        session.close()
+
+    def test_idle_keepalive_connections_do_not_block(self):
+        sessions = [requests.Session() for _ in range(2)]
+        for session in sessions:
+            self.addCleanup(session.close)
+            r = session.get(self.base_url + "/auth/ping")
+            self.assertEqual(r.status_code, 200)
+        self.assertEqual(sessions[0].get(self.base_url + "/auth/ping")
+                         .headers.get('Connection'), None)
+        self.assertEqual(r.headers.get('Connection'), "close")
+        r = requests.get(self.base_url + "/auth/ping", timeout=2)
+        self.assertEqual(r.status_code, 200)
+
+    def test_body_too_large(self):
+        r = requests.post(self.base_url + "/auth/token",
+                          data=json.dumps({"password": "x" * 64}))
+        self.assertEqual(r.status_code, 413)
+        self.assertEqual(self.mock_handler.call_count, 0)
+
+    def test_invalid_json(self):
+        for body in ["nope", '"x"', "[1]"]:
+            r = requests.post(self.base_url + "/auth/token", data=body)
+            self.assertEqual(r.status_code, 400)
+        self.assertEqual(self.mock_handler.call_count, 0)
+
+    def test_listen_backlog(self):
+        self.assertTrue(self.httpd.request_queue_size >
+                        2 * self.config.get('workers'))
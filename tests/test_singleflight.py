@@ -0,0 +1,75 @@
+import unittest
+import threading
+from auth_backend import metrics
+from auth_backend.singleflight import SingleFlight
+from auth_backend.singleflight import Timeout
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.flight = SingleFlight("test")
+        self.release = threading.Event()
+        self.calls = []
+
+    def slow_call(self, result="value", error=None):
+        def call():
+            self.calls.append(1)
+            self.release.wait(5)
+            if error is not None:
+                raise error
+            return result
+        return call
+
+    def run_concurrently(self, fn, count, timeout=5):
+        results = []
+
+        def worker():
+            try:
+                results.append(self.flight.do("key", fn, timeout=timeout))
+            except Exception as e:
+                results.append(e)
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        while metrics.snapshot()["counters"].get(
+                "singleflight.test.coalesced", 0) < count - 1:
+            threading.Event().wait(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_coalesced(self):
+        results = self.run_concurrently(self.slow_call(), 5)
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(len(self.flight), 0)
+
+    def test_error_propagated(self):
+        error = ValueError("upstream failed")
+        results = self.run_concurrently(self.slow_call(error=error), 3)
+        self.assertEqual(results, [error] * 3)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_sequential_calls_not_coalesced(self):
+        self.release.set()
+        self.assertEqual(self.flight.do("key", self.slow_call("a")), "a")
+        self.assertEqual(self.flight.do("key", self.slow_call("b")), "b")
+        self.assertEqual(len(self.calls), 2)
+
+    def test_waiter_times_out(self):
+        leader = threading.Thread(
+            target=self.flight.do, args=("key", self.slow_call())
+        )
+        leader.start()
+        while not self.calls:
+            threading.Event().wait(0.001)
+        with self.assertRaises(Timeout):
+            self.flight.do("key", self.slow_call(), timeout=0.01)
+        self.release.set()
+        leader.join()
+        self.assertEqual(metrics.snapshot()["counters"].get(
+            "singleflight.test.timeouts"), 1)
@@ -0,0 +1,233 @@
+import unittest
+import time
+import jwt
+import json
+from auth_backend import tokens
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.asymmetric import rsa
+except ImportError:  # pragma: no cover
+    rsa = None
+
+
+def private_key_pem(private_key):
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+
+def public_key_pem(private_key):
+    return private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+
+class TestHS256Codec(unittest.TestCase):
+
+    def setUp(self):
+        self.secret = "sekr3t"
+        self.codec = tokens.HS256Codec(self.secret)
+        now = int(time.time())
+        self.claims = {
+            "iat": now,
+            "exp": now + 600,
+            "sub": 1234,
+            "github_login": "bob",
+            "github_token": "bobstoken"
+        }
+
+    def test_pyjwt_decodes_codec_tokens(self):
+        token = self.codec.encode(self.claims)
+        decoded = jwt.decode(token, self.secret, algorithms=['HS256'])
+        self.assertEqual(decoded, self.claims)
+        header = jwt.get_unverified_header(token)
+        self.assertEqual(header, {"typ": "JWT", "alg": "HS256"})
+
+    def test_codec_decodes_pyjwt_tokens(self):
+        token = jwt.encode(self.claims, self.secret, algorithm='HS256')
+        self.assertEqual(self.codec.decode(token), self.claims)
+
+    def test_same_signature_as_pyjwt(self):
+        token = self.codec.encode(self.claims)
+        signing_input = token.rsplit('.', 1)[0].encode('ascii')
+        algorithm = jwt.algorithms.HMACAlgorithm(jwt.algorithms.HMACAlgorithm.SHA256)  # NOQA
+        expected = algorithm.sign(signing_input,
+                                  algorithm.prepare_key(self.secret))
+        self.assertEqual(tokens.base64url_decode(token.rsplit('.', 1)[1].encode('ascii')),  # NOQA
+                         expected)
+
+    def test_wrong_secret(self):
+        token = jwt.encode(self.claims, "other", algorithm='HS256')
+        with self.assertRaises(tokens.InvalidSignatureError):
+            self.codec.decode(token)
+
+    def test_tampered_payload(self):
+        header, payload, signature = self.codec.encode(self.claims).split('.')
+        forged = tokens.json_segment(dict(self.claims, sub=1)).decode('ascii')
+        with self.assertRaises(tokens.InvalidSignatureError):
+            self.codec.decode('.'.join([header, forged, signature]))
+
+    def test_malformed_tokens(self):
+        for token in [None, 42, "", "fake", "a.b", "a.b.c", u"é.b.c"]:
+            with self.assertRaises(tokens.InvalidTokenError):
+                self.codec.decode(token)
+
+    def test_expired_token(self):
+        self.claims['exp'] = int(time.time()) - 10
+        token = self.codec.encode(self.claims)
+        with self.assertRaises(tokens.ExpiredSignatureError):
+            self.codec.decode(token)
+        with self.assertRaises(jwt.exceptions.ExpiredSignatureError):
+            jwt.decode(token, self.secret, algorithms=['HS256'])
+        self.assertEqual(self.codec.decode(token, leeway=60), self.claims)
+
+    def test_immature_token(self):
+        self.claims['nbf'] = int(time.time()) + 60
+        token = self.codec.encode(self.claims)
+        with self.assertRaises(tokens.ImmatureSignatureError):
+            self.codec.decode(token)
+
+
+class TestKeyring(unittest.TestCase):
+
+    def setUp(self):
+        self.keys = {"2016-01": "old-secret", "2016-02": "new-secret"}
+        self.keyring = tokens.Keyring(self.keys, "2016-02", "legacy")
+        self.claims = {"sub": 1234, "exp": int(time.time()) + 600}
+
+    def test_signs_with_active_kid(self):
+        token = self.keyring.encode(self.claims)
+        self.assertEqual(jwt.get_unverified_header(token).get('kid'),
+                         "2016-02")
+        self.assertEqual(jwt.decode(token, "new-secret",
+                                    algorithms=['HS256']),
+                         self.claims)
+
+    def test_verifies_retiring_key(self):
+        token = tokens.HS256Codec("old-secret", "2016-01").encode(self.claims)
+        self.assertEqual(self.keyring.decode(token), self.claims)
+
+    def test_verifies_legacy_tokens_without_kid(self):
+        token = jwt.encode(self.claims, "legacy", algorithm='HS256')
+        self.assertEqual(self.keyring.decode(token), self.claims)
+
+    def test_verifies_foreign_header_by_kid(self):
+        token = jwt.encode(self.claims, "old-secret", algorithm='HS256',
+                           headers={"kid": "2016-01"})
+        self.assertEqual(self.keyring.decode(token), self.claims)
+
+    def test_unknown_kid(self):
+        token = tokens.HS256Codec("old-secret", "2015-12").encode(self.claims)
+        with self.assertRaises(tokens.InvalidSignatureError):
+            self.keyring.decode(token)
+
+    def test_kid_does_not_select_another_secret(self):
+        token = tokens.HS256Codec("old-secret", "2016-02").encode(self.claims)
+        with self.assertRaises(tokens.InvalidSignatureError):
+            self.keyring.decode(token)
+
+    def test_unsupported_algorithm(self):
+        token = jwt.encode(self.claims, "legacy", algorithm='HS512')
+        with self.assertRaises(tokens.DecodeError):
+            self.keyring.decode(token)
+
+    def test_retired_key(self):
+        token = self.keyring.encode(self.claims)
+        keyring = tokens.Keyring({"2016-03": "newest"}, "2016-03")
+        with self.assertRaises(tokens.InvalidSignatureError):
+            keyring.decode(token)
+
+    def test_unknown_active_kid(self):
+        with self.assertRaises(ValueError):
+            tokens.Keyring(self.keys, "2016-03")
+
+    def test_get_keyring_is_cached(self):
+        self.assertIs(tokens.get_keyring(self.keys, "2016-02"),
+                      tokens.get_keyring(dict(self.keys), "2016-02"))
+
+
+@unittest.skipIf(rsa is None, "cryptography is not installed")
+class TestAsymmetricKeyring(unittest.TestCase):
+
+    def setUp(self):
+        self.rsa_key = rsa.generate_private_key(public_exponent=65537,
+                                                key_size=2048,
+                                                backend=default_backend())
+        self.ec_key = ec.generate_private_key(ec.SECP256R1(),
+                                              default_backend())
+        self.claims = {"sub": 1234, "exp": int(time.time()) + 600}
+
+    def keyring(self, algorithm, private_key):
+        return tokens.Keyring({"k1": private_key_pem(private_key)}, "k1",
+                              algorithm=algorithm)
+
+    def test_rs256_round_trip(self):
+        keyring = self.keyring("RS256", self.rsa_key)
+        token = keyring.encode(self.claims)
+        self.assertEqual(keyring.decode(token), self.claims)
+        self.assertEqual(jwt.decode(token, public_key_pem(self.rsa_key),
+                                    algorithms=['RS256']),
+                         self.claims)
+
+    def test_es256_round_trip(self):
+        keyring = self.keyring("ES256", self.ec_key)
+        token = keyring.encode(self.claims)
+        self.assertEqual(keyring.decode(token), self.claims)
+        self.assertEqual(jwt.decode(token, public_key_pem(self.ec_key),
+                                    algorithms=['ES256']),
+                         self.claims)
+
+    def test_verifies_pyjwt_es256_tokens(self):
+        keyring = self.keyring("ES256", self.ec_key)
+        token = jwt.encode(self.claims, private_key_pem(self.ec_key),
+                           algorithm='ES256', headers={"kid": "k1"})
+        self.assertEqual(keyring.decode(token), self.claims)
+
+    def test_rejects_tampered_signature(self):
+        keyring = self.keyring("RS256", self.rsa_key)
+        token = keyring.encode(self.claims)
+        forged = tokens.HS256Codec("secret", "k1").encode(self.claims)
+        with self.assertRaises(tokens.InvalidTokenError):
+            keyring.decode(token[:-4] + "AAAA")
+        with self.assertRaises(tokens.InvalidTokenError):
+            keyring.decode(forged)
+
+    def test_key_must_match_algorithm(self):
+        p384_key = ec.generate_private_key(ec.SECP384R1(), default_backend())
+        for algorithm, private_key in [("RS256", self.ec_key),
+                                       ("ES256", self.rsa_key),
+                                       ("ES256", p384_key)]:
+            with self.assertRaises(ValueError):
+                self.keyring(algorithm, private_key)
+
+    def test_needs_active_key(self):
+        with self.assertRaises(ValueError):
+            tokens.Keyring(legacy_secret="secret", algorithm="RS256")
+
+    def test_jwks(self):
+        keyring = self.keyring("RS256", self.rsa_key)
+        jwk = keyring.jwks.get('keys')[0]
+        self.assertEqual(jwk.get('kid'), "k1")
+        self.assertEqual(jwk.get('alg'), "RS256")
+        public_key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+        token = keyring.encode(self.claims)
+        self.assertEqual(jwt.decode(token, public_key, algorithms=['RS256']),
+                         self.claims)
+
+    def test_ec_jwks(self):
+        keyring = self.keyring("ES256", self.ec_key)
+        jwk = keyring.jwks.get('keys')[0]
+        numbers = self.ec_key.public_key().public_numbers()
+        self.assertEqual(jwk.get('crv'), "P-256")
+        self.assertEqual(tokens.bytes_to_int(tokens.base64url_decode(jwk.get('x').encode('ascii'))),  # NOQA
+                         numbers.x)
+
+    def test_symmetric_keys_not_published(self):
+        keyring = tokens.Keyring({"k1": "secret"}, "k1")
+        self.assertEqual(keyring.jwks, {"keys": []})